@@ -6,8 +6,11 @@
 killall -9 sooperlooper
 su patch -c 'sooperlooper -p 9951 -l 1 -c 2 -t 20 > $HOME/sl.log 2>&1 &'
 
-# wait for SL to start
-sleep 1
+# wait for sooperlooper to register its ports (up to 10 seconds)
+for i in $(seq 1 100); do
+    JACK_NO_START_SERVER=1 jack_lsp 2> /dev/null | grep -q 'sooperlooper:common_in_1' && break
+    sleep 0.1
+done
 
 # confirm port names
 jack_lsp -c
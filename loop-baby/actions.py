@@ -1,14 +1,21 @@
 import time
 from osc import slider_ratio_to_gain_ratio
 
-def make_actions(sl_client, interface, button_map, settings_map):
+def make_actions(sl_client, interface, button_map, settings_map, ntrack_banks=1):
 
-    # make modes, loops, and sessions (the latter are indexed by track number)
+    # make modes, loops, and sessions (the latter are indexed by track number);
+    # with more than one bank of tracks, the track buttons show one bank
+    # of loops at a time, so loop i is on the same button as loop i+ntracks
     ntracks = len([x for x in button_map.values() if type(x) is int])
-    actions = {'loops': [None]*ntracks, 'sessions': [None]*ntracks, 'modes': []}
+    actions = {'loops': [None]*(ntracks*ntrack_banks), 'sessions': [None]*ntracks,
+        'modes': [], 'recording': set()}
     for button_number, name in button_map.items():
         if type(name) is int:
-            actions['loops'][name-1] = Loop(name-1, button_number, interface, sl_client)
+            for bank in range(ntrack_banks):
+                loop = Loop(bank*ntracks + name-1, button_number, interface, sl_client,
+                    actions['recording'])
+                loop.is_visible = bank == 0
+                actions['loops'][loop.track] = loop
             actions['sessions'][name-1] = SessionButton(name-1, button_number, interface)
         else:
             actions['modes'].append(Button(name, button_number, interface))
@@ -91,31 +98,37 @@ class SettingsButton(Button):
         """
         send new setting to SL
         """
-        if self.param == 'quantize':
-            for loop in loops:
-                loop.quantize(self.option[1])
-            # this is currently just a single default
-            # the plan is to eventually have a 'quantize_x' setting
-            # where x == 4, 8, 16, or whatever you want
-            if 'cycle_' in self.option[0]:
-                eighth_per_cycle = self.option[0].split('cycle_')[1]
-                self.sl_client.set('eighth_per_cycle', int(eighth_per_cycle))
-        elif self.param in ['sync_source']:
-            self.sl_client.set(self.param, self.option[1])
-            # we must also turn sync on for each track
-            for loop in loops:
-                if self.option[0] == 'none':
-                    loop.sync_off()
-                else:
-                    loop.sync_on()
-        else:
-            self.sl_client.set(self.param, self.value)
+        # send the setting for every loop in a single bundle
+        with self.sl_client.bundle():
+            if self.param == 'quantize':
+                for loop in loops:
+                    loop.quantize(self.option[1])
+                # this is currently just a single default
+                # the plan is to eventually have a 'quantize_x' setting
+                # where x == 4, 8, 16, or whatever you want
+                if 'cycle_' in self.option[0]:
+                    eighth_per_cycle = self.option[0].split('cycle_')[1]
+                    self.sl_client.set('eighth_per_cycle', int(eighth_per_cycle))
+            elif self.param in ['sync_source']:
+                self.sl_client.set(self.param, self.option[1])
+                # we must also turn sync on for each track
+                for loop in loops:
+                    if self.option[0] == 'none':
+                        loop.sync_off()
+                    else:
+                        loop.sync_on()
+            else:
+                self.sl_client.set(self.param, self.value)
 
 class Loop(Button):
-    def __init__(self, track, button_number, interface, sl_client):
+    def __init__(self, track, button_number, interface, sl_client, recording=None):
         super().__init__(track, button_number, interface)
         self.track = track
         self.sl_client = sl_client
+        self.is_visible = True # False if its bank of tracks is not showing
+        # loops recording or overdubbing, shared by all loops, so that
+        # we only have to stop these ones when a button is pressed
+        self.recording = recording if recording is not None else set()
         self.reset_state()
 
     def reset_state(self):
@@ -129,13 +142,52 @@ class Loop(Button):
         self.stopped_record_id = None
         self.pressed_once = False
         self.has_had_something_recorded = False
+        self.ntakes = 0 # recordings and overdubs started, for undoing them (see Looper.cancel_presses)
         self.sync_is_on = False
         self.quantize_value = 0
         self.volume_ratio = 1.0
+        self.update_recording()
+
+    def update_recording(self):
+        if self.is_recording or self.is_overdubbing:
+            self.recording.add(self)
+        else:
+            self.recording.discard(self)
+
+    def set_color(self, color=None):
+        # another loop has this button while our bank is hidden
+        if self.is_visible:
+            super().set_color(color)
 
     def enable(self):
         self.is_enabled = True
 
+    def engine_state(self):
+        """
+        what SL last reported about this loop (see OscSooperLooper.loop_state),
+        or None if SL is not sending us updates
+        """
+        return self.sl_client.loop_state(self.track)
+
+    def is_being_recorded(self):
+        state = self.engine_state()
+        if state is None or state.state == 'unknown':
+            return self.is_recording or self.is_overdubbing
+        return state.state in ['waitstart', 'recording', 'waitstop', 'overdubbing']
+
+    def has_audio(self):
+        state = self.engine_state()
+        if state is None:
+            return self.has_had_something_recorded
+        return state.loop_len > 0
+
+    def muted(self):
+        state = self.engine_state()
+        if state is None or state.state not in ['muted', 'playing']:
+            # e.g., when paused, SL doesn't tell us if we are muted
+            return self.is_muted
+        return state.state == 'muted'
+
     def disable(self):
         self.reset_state()
 
@@ -180,21 +232,27 @@ class Loop(Button):
         if not self.is_enabled:
             return
         self.is_recording = not self.is_recording
-        self.sl_client.hit('record', self.track)
-        self.has_had_something_recorded = True
-        if not self.is_recording:
-            # just stopped recording; check if we were muted
-            self.remute_if_necessary()
+        self.ntakes += self.is_recording
+        self.update_recording()
+        with self.sl_client.bundle():
+            self.sl_client.hit('record', self.track)
+            self.has_had_something_recorded = True
+            if not self.is_recording:
+                # just stopped recording; check if we were muted
+                self.remute_if_necessary()
 
     def toggle_overdub(self):
         if not self.is_enabled:
             return
         self.is_overdubbing = not self.is_overdubbing
-        self.sl_client.hit('overdub', self.track)
-        self.has_had_something_recorded = True
-        if not self.is_overdubbing:
-            # just stopped overdubbing; check if we were muted
-            self.remute_if_necessary()
+        self.ntakes += self.is_overdubbing
+        self.update_recording()
+        with self.sl_client.bundle():
+            self.sl_client.hit('overdub', self.track)
+            self.has_had_something_recorded = True
+            if not self.is_overdubbing:
+                # just stopped overdubbing; check if we were muted
+                self.remute_if_necessary()
 
     def undo(self):
         if not self.is_enabled:
@@ -234,8 +292,10 @@ class Loop(Button):
         if not self.is_enabled:
             return
         # reset_sync_pos so that it always plays from the top
-        self.sl_client.hit('reset_sync_pos', self.track)
-        self.sl_client.hit('oneshot', self.track)
+        # (sent together so SL applies both at once)
+        with self.sl_client.bundle():
+            self.sl_client.hit('reset_sync_pos', self.track)
+            self.sl_client.hit('oneshot', self.track)
         # if will auto-mute when done, so let's just mark this
         # because we just have to deal with what SL wants
         self.mark_as_muted()
@@ -0,0 +1,126 @@
+import time
+import random
+
+IDLE_INTERVAL = 0.02 # how often to check for new animations, when none are running
+
+def random_color():
+    return (random.randint(0,255), random.randint(0,255), random.randint(0,255))
+
+# animations are generators that draw one frame into the interface
+# (with set_color or set_rgb), and then yield; they end by returning
+
+def lightshow(interface):
+    """
+    flashes buttons on and off in a random order, one per frame (forever)
+    """
+    while True:
+        button_indices = list(range(interface.nbuttons))
+        random.shuffle(button_indices)
+        for i in button_indices:
+            interface.set_rgb(i, random_color())
+            yield
+        for i in button_indices:
+            interface.set_color(i, 'off')
+            yield
+
+def sweep(interface, color='random'):
+    """
+    lights up each button in turn, then turns each one off
+    """
+    if color is None:
+        return
+    for i in range(interface.nbuttons):
+        if color == 'random':
+            interface.set_rgb(i, random_color())
+        else:
+            interface.set_color(i, color)
+        yield
+    for i in range(interface.nbuttons):
+        interface.set_color(i, 'off')
+        yield
+
+class Animation:
+    __slots__ = ['name', 'frames', 'frame_secs', 'next_time', 'on_done', 'interruptible']
+    def __init__(self, name, frames, frame_secs, on_done, interruptible, now):
+        self.name = name
+        self.frames = frames
+        self.frame_secs = frame_secs
+        self.next_time = now
+        self.on_done = on_done
+        self.interruptible = interruptible
+
+class Animator:
+    """
+    runs animations on the interface's LEDs, each at its own frame rate,
+    without blocking: call tick() from the main loop (and then show()),
+    and wait for input at most time_until_next_frame() in between;
+    animations started later draw on top of earlier ones
+    """
+    def __init__(self):
+        self.animations = {} # name -> Animation, in the order started
+
+    def start(self, name, frames, frame_secs, on_done=None, interruptible=True, now=None):
+        """
+        frames is an animation (see above); on_done is called if it ends
+        on its own; a button press stops animations that are interruptible;
+        its first frame is drawn by the next tick()
+        """
+        now = time.monotonic() if now is None else now
+        self.animations.pop(name, None)
+        self.animations[name] = Animation(name, frames, frame_secs, on_done, interruptible, now)
+
+    def stop(self, name):
+        """
+        returns True if the animation was running
+        """
+        animation = self.animations.pop(name, None)
+        if animation is None:
+            return False
+        animation.frames.close()
+        return True
+
+    def stop_interruptible(self):
+        """
+        returns the names of the animations stopped
+        """
+        names = [name for name, animation in self.animations.items() if animation.interruptible]
+        for name in names:
+            self.stop(name)
+        return names
+
+    def is_running(self, name=None):
+        if name is None:
+            return len(self.animations) > 0
+        return name in self.animations
+
+    def time_until_next_frame(self, now=None):
+        """
+        seconds until tick() has something to draw (None if nothing is running)
+        """
+        if not self.animations:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0, min(animation.next_time for animation in self.animations.values()) - now)
+
+    def tick(self, now=None):
+        """
+        draws the next frame of every animation that is due;
+        returns True if anything was drawn
+        """
+        now = time.monotonic() if now is None else now
+        drew = False
+        for animation in list(self.animations.values()):
+            if now < animation.next_time or self.animations.get(animation.name) is not animation:
+                continue
+            try:
+                next(animation.frames)
+            except StopIteration:
+                self.animations.pop(animation.name, None)
+                if animation.on_done is not None:
+                    animation.on_done()
+            drew = True
+            # keep a fixed frame rate, unless we fell more than a frame behind
+            animation.next_time += animation.frame_secs
+            if animation.next_time < now:
+                animation.next_time = now + animation.frame_secs
+        return drew
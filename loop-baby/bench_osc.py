@@ -0,0 +1,203 @@
+"""
+benchmarks the OSC layer against a local SooperLooper stand-in;
+each result is the median of --runs runs
+
+numbers vary a lot between machines, so there is no baseline in the repo;
+to compare a transport change, make your own on the same machine:
+    1. on the base commit, run: python bench_osc.py --save_baseline
+       (saved to static/benchmarks/osc_baseline.json, which git ignores)
+    2. on your change, run: python bench_osc.py --compare
+       each result is shown next to its baseline, and results worse by
+       more than --threshold, and by more than the runs vary (and, for
+       round trips, by more than MIN_RTT_CHANGE_MS), are marked
+       REGRESSION (and the exit code is 1)
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+from osc import OscSooperLooper
+from sl_standin import SooperLooperStandIn
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+BASELINE_FILE = os.path.join(BASE_PATH, 'static', 'benchmarks', 'osc_baseline.json')
+STANDIN_PORT = 19951
+REPLY_PORT = 17777
+REPLY_TIMEOUT = 1.0 # seconds
+REGRESSION_THRESHOLD = 0.25 # flag results that are this much worse than baseline
+MIN_RTT_CHANGE_MS = 0.05 # round trips are ~0.15 ms locally, and vary by about this much
+NRUNS = 5
+
+class BenchClient(OscSooperLooper):
+    """
+    counts replies instead of printing them
+    """
+    def __init__(self, *args, **kwargs):
+        self.nreplies = 0
+        super().__init__(*args, **kwargs)
+
+    def handle_osc_message(self, address, *args):
+        self.nreplies += 1
+
+    def handle_get(self, address, *args):
+        self.nreplies += 1
+
+    def handle_pong(self, address, *args):
+        super().handle_pong(address, *args)
+        self.nreplies += 1
+
+    def wait_for_replies(self, nreplies, timeout=REPLY_TIMEOUT):
+        t_end = time.monotonic() + timeout
+        while self.nreplies < nreplies:
+            if time.monotonic() > t_end:
+                raise Exception('Timed out waiting for reply from stand-in')
+            self.process()
+
+def wait_for_standin(standin, nreceived, timeout=REPLY_TIMEOUT):
+    t_end = time.monotonic() + timeout
+    while standin.nreceived < nreceived:
+        if time.monotonic() > t_end:
+            raise Exception('Stand-in only received {} of {} messages'.format(
+                standin.nreceived, nreceived))
+        time.sleep(0.001)
+
+def percentile(sorted_values, p):
+    return sorted_values[int(round(p/100.0*(len(sorted_values)-1)))]
+
+def bench_throughput(client, standin, send, n, nmessages=1):
+    """
+    returns calls/sec for calling send(i) n times, where each call
+    sends nmessages (timed until the stand-in has received all of them)
+    """
+    nreceived = standin.nreceived
+    t0 = time.perf_counter()
+    for i in range(n):
+        send(i)
+    wait_for_standin(standin, nreceived + n*nmessages)
+    return n/(time.perf_counter() - t0)
+
+def bench_round_trip(client, send, n):
+    """
+    returns round-trip times (ms) for send(i) and its reply
+    """
+    times = []
+    for i in range(n):
+        nreplies = client.nreplies
+        t0 = time.perf_counter()
+        send(i)
+        client.wait_for_replies(nreplies + 1)
+        times.append(1000*(time.perf_counter() - t0))
+    return sorted(times)
+
+def run_once(client, standin, n):
+    results = {}
+    results['hit_msgs_per_sec'] = bench_throughput(client, standin,
+        lambda i: client.hit('mute', i % 4), n)
+    results['set_msgs_per_sec'] = bench_throughput(client, standin,
+        lambda i: client.set('wet', (i % 100)/100.0, i % 4), n)
+    def bundled(i):
+        # e.g., Looper.play(): trigger, then re-mute a loop
+        with client.bundle():
+            client.hit('trigger', -1)
+            client.hit('mute', i % 4)
+    results['bundle_msgs_per_sec'] = 2*bench_throughput(client, standin,
+        bundled, n//2, nmessages=2)
+    for name, send in [('get', lambda i: client.get('state', i % 4)),
+            ('ping', lambda i: client.ping())]:
+        times = bench_round_trip(client, send, n//10)
+        for p in [50, 95, 99]:
+            results['{}_rtt_p{}_ms'.format(name, p)] = percentile(times, p)
+    return results
+
+def run(n, nruns=NRUNS):
+    """
+    returns each result from every run, e.g., {'hit_msgs_per_sec': [...], ...}
+    """
+    standin = SooperLooperStandIn(port=STANDIN_PORT, nloops=4)
+    standin.start()
+    # no set() cache, so that every call is actually sent
+    client = BenchClient(client_url='127.0.0.1', client_port=STANDIN_PORT,
+        server_url='127.0.0.1', server_port=REPLY_PORT, use_cache=False)
+    runs = {}
+    try:
+        for i in range(nruns):
+            for name, value in run_once(client, standin, n).items():
+                runs.setdefault(name, []).append(value)
+    finally:
+        client.terminate()
+        standin.stop()
+    return runs
+
+def median(values):
+    return percentile(sorted(values), 50)
+
+def spread(values):
+    return max(values) - min(values)
+
+def compare(runs, baseline_runs, threshold=REGRESSION_THRESHOLD):
+    """
+    returns the names of results whose median is worse than baseline's by
+    more than threshold, and by more than both sets of runs vary
+    (and, for round trips, by more than MIN_RTT_CHANGE_MS);
+    lower is worse for msgs/sec; higher is worse for latencies
+    """
+    regressions = []
+    for name, values in runs.items():
+        if name not in baseline_runs:
+            continue
+        base = median(baseline_runs[name])
+        margin = max(threshold*base, spread(values) + spread(baseline_runs[name]))
+        if name.endswith('_per_sec'):
+            is_worse = median(values) < base - margin
+        else:
+            is_worse = median(values) > base + max(margin, MIN_RTT_CHANGE_MS)
+        if is_worse:
+            regressions.append(name)
+    return regressions
+
+def main(args):
+    baseline = {}
+    if args.compare:
+        if not os.path.exists(args.baseline_file):
+            print('No baseline at {}; run with --save_baseline first (on the base commit)'.format(
+                args.baseline_file))
+            sys.exit(2)
+        with open(args.baseline_file) as f:
+            baseline = json.load(f)['runs']
+
+    runs = run(args.n, args.runs)
+    regressions = compare(runs, baseline, args.threshold)
+    for name, values in runs.items():
+        line = '{:<24} {:10.3f} (+/- {:0.3f})'.format(name, median(values), spread(values)/2)
+        if name in baseline:
+            line += '   (baseline {:10.3f})'.format(median(baseline[name]))
+        if name in regressions:
+            line += '   REGRESSION'
+        print(line)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline_file), exist_ok=True)
+        with open(args.baseline_file, 'w') as f:
+            json.dump({'n': args.n, 'platform': sys.platform, 'runs': runs}, f, indent=2)
+        print('Saved baseline to {}'.format(args.baseline_file))
+    elif regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="benchmark OSC messages to a local SooperLooper stand-in")
+    parser.add_argument('-n', type=int, default=2000,
+        help='messages per throughput benchmark (round trips use n/10)')
+    parser.add_argument('--runs', type=int, default=NRUNS,
+        help='times to run each benchmark (results are the median)')
+    parser.add_argument('--baseline_file', type=str, default=BASELINE_FILE)
+    parser.add_argument('--save_baseline',
+        dest='save_baseline', action='store_true')
+    parser.add_argument('--compare',
+        dest='compare', action='store_true',
+        help='compare against --baseline_file (see above)')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,77 @@
+import time
+import argparse
+import numpy as np
+
+from sample_cache import MIXER_FREQUENCY, MIXER_CHANNELS
+from sampler_engine import SamplerEngine, BLOCK_FRAMES, block_deadline
+
+SAMPLE_SECS = 4 # long enough that no voice ends during a benchmark
+NBLOCKS = 200 # blocks rendered per voice count
+SAFETY_MARGIN = 0.5 # only count voice counts that use this much of the deadline
+
+def percentile(sorted_values, p):
+    return sorted_values[int(round(p/100.0*(len(sorted_values)-1)))]
+
+def make_samples(n, block_frames, nblocks, nchannels=MIXER_CHANNELS):
+    nframes = max(SAMPLE_SECS*MIXER_FREQUENCY, (nblocks+1)*block_frames)
+    rng = np.random.default_rng(0)
+    return [(0.1*rng.standard_normal((nframes, nchannels))).astype('f4') for i in range(n)]
+
+def bench_voices(nvoices, samples, block_frames, nblocks):
+    """
+    returns sorted times (ms) to render each block with nvoices playing
+    """
+    engine = SamplerEngine(max_voices=nvoices, retrigger='layer', block_frames=block_frames)
+    for i in range(nvoices):
+        engine.trigger(i, samples[i % len(samples)], gain=0.5)
+    engine.render_int16() # warm up
+    times = []
+    for i in range(nblocks):
+        t0 = time.perf_counter()
+        engine.render_int16()
+        times.append(1000*(time.perf_counter() - t0))
+    return sorted(times)
+
+def main(args):
+    deadline_ms = 1000*block_deadline(args.block_frames)
+    budget_ms = args.margin*deadline_ms
+    print('Block of {} frames at {} Hz: {:0.2f} ms deadline ({:0.2f} ms budget)'.format(
+        args.block_frames, MIXER_FREQUENCY, deadline_ms, budget_ms))
+    samples = make_samples(16, args.block_frames, args.nblocks)
+
+    def fits(nvoices):
+        times = bench_voices(nvoices, samples, args.block_frames, args.nblocks)
+        p50, p99 = percentile(times, 50), percentile(times, 99)
+        print('{:>4} voices   p50={:7.3f} ms  p99={:7.3f} ms   {}'.format(
+            nvoices, p50, p99, 'ok' if p99 <= budget_ms else 'OVER BUDGET'))
+        return p99 <= budget_ms
+
+    # double until we go over budget, then bisect between
+    # the last count that fit and the first that didn't
+    max_fit = 0
+    min_over = None
+    nvoices = 1
+    while max_fit < args.max_voices:
+        if not fits(nvoices):
+            min_over = nvoices
+            break
+        max_fit = nvoices
+        nvoices = min(2*nvoices, args.max_voices)
+    while min_over is not None and min_over - max_fit > 1:
+        nvoices = (max_fit + min_over)//2
+        if fits(nvoices):
+            max_fit = nvoices
+        else:
+            min_over = nvoices
+    print('{} voices fit in the block deadline (tested up to {})'.format(max_fit, args.max_voices))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="benchmark how many sampler voices we can mix per block")
+    parser.add_argument('--block_frames', type=int, default=BLOCK_FRAMES)
+    parser.add_argument('--nblocks', type=int, default=NBLOCKS)
+    parser.add_argument('--max_voices', type=int, default=1024)
+    parser.add_argument('--margin', type=float, default=SAFETY_MARGIN,
+        help='fraction of the deadline that mixing is allowed to use')
+    args = parser.parse_args()
+    main(args)
@@ -6,7 +6,7 @@ SCREENSAVER_TIME_SECS = 60*5
 BUTTON_MAP = { # arranged as installed
 	12: 1,  8: 2,  4: 3,  0: 4,
 	13: 5,  9: 6,  5: 7,  1: 8,
-	14: 'oneshot', 10: 'save/recall', 6: 'settings', 2: 'volume/gain/monitor',
+	14: 'oneshot/sampler', 10: 'save/recall', 6: 'settings', 2: 'volume/gain/monitor',
 	15: 'play/pause', 11: 'record/overdub', 7: 'undo/redo', 3: 'mute/clear'}
 
 SETTINGS_MAP = {
@@ -20,6 +20,46 @@ SETTINGS_MAP = {
 	1: {'action': 'shutdown'},
 }
 
+# four boards tiled as an 8x8 grid (numbered row by row, from the top left):
+# tracks along the top row, and modes along the bottom row
+BUTTON_MAP_8X8 = {
+	0: 1, 1: 2, 2: 3, 3: 4, 4: 5, 5: 6, 6: 7, 7: 8,
+	56: 'oneshot/sampler', 57: 'save/recall', 58: 'settings', 59: 'volume/gain/monitor',
+	60: 'play/pause', 61: 'record/overdub', 62: 'undo/redo', 63: 'mute/clear'}
+
+SETTINGS_MAP_8X8 = { # same settings, on the same tracks as in SETTINGS_MAP
+	0: SETTINGS_MAP[12], 1: SETTINGS_MAP[8],
+	5: SETTINGS_MAP[9], 6: SETTINGS_MAP[5], 7: SETTINGS_MAP[1],
+}
+
+LAYOUTS = {
+	'4x4': {'shape': (4, 4), 'addresses': ((0x2E,),),
+		'button_map': BUTTON_MAP, 'settings_map': SETTINGS_MAP},
+	'8x8': {'shape': (8, 8), 'addresses': ((0x2E, 0x2F), (0x30, 0x31)),
+		'button_map': BUTTON_MAP_8X8, 'settings_map': SETTINGS_MAP_8X8},
+}
+
+COLORS = { # RGB values for the color names in COLOR_MAP
+    'off': (0, 0, 0),
+    'purple': (180, 0, 255),
+    'red': (255, 0, 0),
+    'orange': (255, 164, 0),
+    'green': (0, 255, 0),
+    'yellow': (158, 152, 17),
+    'gray': (100, 100, 100),
+    'blue': (0, 0, 255),
+    'lightblue': (7, 34, 81),
+    'blueish': (33, 211, 237),
+    'darkgray': (10, 10, 10),
+    'seagreen': (30, 255, 30),
+    'lightseagreen': (39, 239, 120),
+    'salmon': (206, 28, 41),
+    'lightorange': (176, 76, 9),
+    'lightpurple': (87, 20, 174),
+    'lighterpurple': (70, 27, 87),
+    'pink': (100, 0, 100),
+}
+
 COLOR_MAP = {
     None: 'gray',
     'track': 'gray',
@@ -32,6 +72,9 @@ COLOR_MAP = {
     'undo': 'lightseagreen',
     'redo': 'seagreen',
     'oneshot': 'green',
+    'sampler': 'blueish',
+    'sampler_pad': 'lighterpurple',
+    'sampler_pressed': 'blueish',
     'save': 'pink',
     'recall': 'lightorange',
     'settings': 'lightpurple',
@@ -42,6 +85,7 @@ COLOR_MAP = {
     'track_exists': 'darkgray',
     'session_exists': 'pink',
     'session_empty': 'darkgray',
+    'session_saving': 'yellow',
     'sync_source_none': 'off',
     'sync_source_track_1': 'red',
     'sync_source_track_2': 'orange',
@@ -79,3 +123,9 @@ META_COMMANDS = {
         'callback': lambda looper: subprocess.Popen(['bash', os.path.join(BASE_PATH, 'startup.sh')])
         },
 }
+
+# (gesture, button) -> Looper method to run (see GestureEngine);
+# the press(es) making up the gesture are cancelled first
+GESTURE_MAP = {
+    ('long_press', 'mute/clear'): 'toggle_mute_all',
+}
@@ -0,0 +1,159 @@
+import os
+import wave
+import struct
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+# SL always saves loops as 32-bit float WAVs; we keep them as 16-bit WAVs
+# (half the size) named e.g. "0.slsess_loop_00.wav16", and decode them
+# back to float WAVs in CACHE_DIR (RAM, on the Pi) when recalling
+COMPRESSED_SUFFIX = '16'
+CACHE_DIR = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'loop-baby')
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+def compressed_path(path):
+    return path + COMPRESSED_SUFFIX
+
+def cached_path(path):
+    return os.path.join(CACHE_DIR, os.path.basename(path))
+
+def read_wav(path):
+    """
+    returns (format, nchannels, rate, bits per sample, sample bytes);
+    unlike the wave module, this also reads float WAVs
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise Exception('Not a WAV file: {}'.format(path))
+    i = 12
+    fmt = None
+    while i + 8 <= len(data):
+        chunk_id, size = struct.unpack('<4sI', data[i:i+8])
+        chunk = data[i+8:i+8+size]
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', chunk[:16])
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE:
+                # the real format is the first two bytes of the subformat GUID
+                fmt = (struct.unpack('<H', chunk[24:26])[0],) + fmt[1:]
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise Exception('WAV data before format: {}'.format(path))
+            audio_format, nchannels, rate, _, _, bits = fmt
+            return audio_format, nchannels, rate, bits, chunk
+        i += 8 + size + (size % 2)
+    raise Exception('No audio found in WAV file: {}'.format(path))
+
+def is_complete_wav(path):
+    """
+    True once the header accounts for the whole file: SL (libsndfile) writes
+    the RIFF and data chunk sizes when it closes the file, so until then they
+    don't match what is on disk (or the data chunk is still empty)
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            header = f.read(12)
+            if len(header) < 12:
+                return False
+            riff, riff_size, wave_id = struct.unpack('<4sI4s', header)
+            if riff != b'RIFF' or wave_id != b'WAVE' or riff_size + 8 != size:
+                return False
+            i = 12
+            while i + 8 <= size:
+                f.seek(i)
+                chunk_id, chunk_size = struct.unpack('<4sI', f.read(8))
+                if chunk_id == b'data':
+                    return 0 < chunk_size and i + 8 + chunk_size <= size
+                i += 8 + chunk_size + (chunk_size % 2)
+    except (OSError, struct.error):
+        pass
+    return False
+
+def write_float_wav(path, nchannels, rate, samples):
+    """
+    writes float32 samples (interleaved) as a 32-bit float WAV
+    """
+    data = samples.astype('<f4').tobytes()
+    nframes = len(samples)//nchannels
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<4sI4s', b'RIFF', 4 + 26 + 12 + 8 + len(data), b'WAVE'))
+        f.write(struct.pack('<4sIHHIIHHH', b'fmt ', 18, WAVE_FORMAT_IEEE_FLOAT,
+            nchannels, rate, 4*nchannels*rate, 4*nchannels, 32, 0))
+        f.write(struct.pack('<4sII', b'fact', 4, nframes))
+        f.write(struct.pack('<4sI', b'data', len(data)))
+        f.write(data)
+
+def compress_wav(infile, outfile):
+    """
+    converts a 32-bit float WAV to a 16-bit WAV
+    (runs in a worker process; see AudioCompressor)
+    """
+    import numpy as np
+    audio_format, nchannels, rate, bits, data = read_wav(infile)
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT and bits == 32:
+        samples = np.frombuffer(data, dtype='<f4')
+        data = np.clip(np.round(samples*32767), -32768, 32767).astype('<i2').tobytes()
+    elif not (audio_format == WAVE_FORMAT_PCM and bits == 16):
+        raise Exception('Unsupported WAV format ({}, {} bits): {}'.format(audio_format, bits, infile))
+    tmpfile = outfile + '.tmp'
+    w = wave.open(tmpfile, 'wb')
+    w.setnchannels(nchannels)
+    w.setsampwidth(2)
+    w.setframerate(rate)
+    w.writeframes(data)
+    w.close()
+    os.replace(tmpfile, outfile)
+    return outfile
+
+def decompress_wav(infile, outfile):
+    """
+    converts a 16-bit WAV back to the 32-bit float WAV that SL expects
+    (runs in a worker process; see AudioCompressor)
+    """
+    import numpy as np
+    w = wave.open(infile, 'rb')
+    nchannels, rate = w.getnchannels(), w.getframerate()
+    data = w.readframes(w.getnframes())
+    w.close()
+    samples = np.frombuffer(data, dtype='<i2').astype('<f4')/32768.0
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    tmpfile = outfile + '.tmp'
+    write_float_wav(tmpfile, nchannels, rate, samples)
+    os.replace(tmpfile, outfile)
+    return outfile
+
+def lower_priority():
+    os.nice(10)
+
+class AudioCompressor:
+    """
+    runs compress_wav/decompress_wav in a background process,
+    so that the looper never waits on them
+    """
+    def __init__(self, max_workers=1):
+        self.max_workers = max_workers
+        self.pool = None # started on first use
+
+    def submit(self, fcn, *args):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                initializer=lower_priority)
+        return self.pool.submit(fcn, *args)
+
+    def compress(self, infile):
+        return self.submit(compress_wav, infile, compressed_path(infile))
+
+    def decompress(self, infile):
+        """
+        infile is the original (float) path;
+        decodes its compressed version into CACHE_DIR
+        """
+        return self.submit(decompress_wav, compressed_path(infile), cached_path(infile))
+
+    def terminate(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
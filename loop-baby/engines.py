@@ -0,0 +1,350 @@
+import os
+import time
+import xml.etree.ElementTree
+from contextlib import ExitStack
+from concurrent.futures import Future
+
+from osc import OscSooperLooper, PING_TIMEOUT, OSC_SERVER_PORT, OSC_CLIENT_PORT
+
+LOOPS_PER_ENGINE = 4
+ENGINE_FILE_SUFFIX = '_engine_{}' # e.g., "0.slsess_engine_1" is engine 1's part of "0.slsess"
+
+def parse_engine_url(url):
+    """
+    e.g., "192.168.1.20:9951" -> ("192.168.1.20", 9951)
+    """
+    if ':' in url:
+        host, port = url.rsplit(':', 1)
+        return host, int(port)
+    return url, OSC_CLIENT_PORT
+
+def count_loops(infile):
+    """
+    number of loops in a .slsess file (0 if we can't read it)
+    """
+    try:
+        loopers = xml.etree.ElementTree.parse(infile).find('Loopers')
+    except (OSError, xml.etree.ElementTree.ParseError):
+        return 0
+    return 0 if loopers is None else len(loopers)
+
+class RouterBundle:
+    """
+    opens a bundle on every engine, so that each engine receives
+    what was sent to it as one datagram
+    """
+    def __init__(self, router, timetag=None):
+        self.router = router
+        self.timetag = timetag
+        self.stack = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for engine in self.router.engines:
+            self.stack.enter_context(engine.bundle(self.timetag))
+        return self
+
+    def __exit__(self, *args):
+        return self.stack.__exit__(*args)
+
+class EngineRouter:
+    """
+    spreads loops across several SooperLooper engines (e.g., one SL per
+    core, or a second box on the LAN), so that one engine's xruns don't
+    take down every track; has the same interface as OscSooperLooper,
+    where loop indices are global, and are routed to an (engine, local
+    index) pair: the first loops_per_engine loops go to the first engine,
+    and so on; actions on all loops (e.g., 'pause_on' or 'trigger')
+    are sent to every engine at once, and actions on the selected loop
+    only to the engine that has it; global params holding a loop index
+    (see engine_values) are translated for each engine
+    """
+    def __init__(self, engine_urls, loops_per_engine=LOOPS_PER_ENGINE,
+        empty_session=None, use_cache=True, server_port=OSC_SERVER_PORT, reply_host=None):
+        self.engines = []
+        for i, url in enumerate(engine_urls):
+            host, port = parse_engine_url(url)
+            # each engine gets its own client, reply port, and reply paths
+            self.engines.append(OscSooperLooper(client_url=host, client_port=port,
+                client_name='sooperlooper_client_{}'.format(i),
+                server_port=server_port + i,
+                server_name='sooperlooper_server_{}'.format(i),
+                empty_session=empty_session, use_cache=use_cache, reply_host=reply_host,
+                reply_prefix='/engine_{}'.format(i)))
+        self.loops_per_engine = loops_per_engine
+        self.empty_session = empty_session
+        self.use_cache = use_cache
+        self.engine_nloops = [0]*len(self.engines) # loops each engine has
+        self.nloops = 0 # loops in use, across all engines
+        self.selected_loop = 0 # global index of SL's selected loop (loop == -3)
+        self.nwrites = 0
+
+    def route(self, loop):
+        """
+        returns the (engine, local loop index) for a global loop index
+        """
+        engine, local = divmod(loop, self.loops_per_engine)
+        if engine >= len(self.engines):
+            raise Exception('Loop {} is past the last engine ({} loops per engine)'.format(
+                loop, self.loops_per_engine))
+        return self.engines[engine], local
+
+    def engines_for(self, loop):
+        """
+        (engine, loop index) pairs to send a command for loop to;
+        the selected loop (-3) goes to the engine that has it (as its index there);
+        other loops < 0 (e.g., all loops) and None (global) go to every engine
+        """
+        if loop == -3:
+            return [self.route(self.selected_loop)]
+        if loop is None or loop < 0:
+            return [(engine, loop) for engine in self.engines]
+        return [self.route(loop)]
+
+    @property
+    def verbose(self):
+        return self.engines[0].verbose
+
+    @verbose.setter
+    def verbose(self, verbose):
+        for engine in self.engines:
+            engine.verbose = verbose
+
+    @property
+    def loop_states_changed(self):
+        return any(engine.loop_states_changed for engine in self.engines)
+
+    @loop_states_changed.setter
+    def loop_states_changed(self, changed):
+        for engine in self.engines:
+            engine.loop_states_changed = changed
+
+    @property
+    def write_errors(self):
+        write_errors = {}
+        for engine in self.engines:
+            write_errors.update(engine.write_errors)
+        return write_errors
+
+    def check_health(self):
+        """
+        see OscSooperLooper.check_health; returns True if any engine's health changed
+        """
+        changed = False
+        for engine in self.engines:
+            changed = engine.check_health() or changed
+        return changed
+
+    def process(self):
+        # nb: one call handles replies from every engine
+        self.engines[0].process()
+
+    def bundle(self, timetag=None):
+        return RouterBundle(self, timetag)
+
+    def flush(self):
+        for engine in self.engines:
+            engine.flush()
+
+    def terminate(self):
+        for engine in self.engines:
+            engine.terminate()
+
+    def invalidate_cache(self):
+        for engine in self.engines:
+            engine.invalidate_cache()
+
+    def cache_stats(self):
+        stats = {'hits': 0, 'misses': 0, 'size': 0}
+        for engine in self.engines:
+            for key, value in engine.cache_stats().items():
+                stats[key] += value
+        return stats
+
+    def hit(self, action, loop=-3):
+        if len(self.engines_for(loop)) > 1:
+            # send to every engine before handling any replies
+            with self.bundle():
+                for engine, local in self.engines_for(loop):
+                    engine.hit(action, local)
+        else:
+            for engine, local in self.engines_for(loop):
+                engine.hit(action, local)
+
+    def get(self, param, loop=None):
+        """
+        global params are read from the first engine
+        """
+        if loop is None:
+            self.engines[0].get(param)
+        else:
+            for engine, local in self.engines_for(loop):
+                engine.get(param, local)
+
+    def engine_values(self, param, value):
+        """
+        (engine, value) pairs to set a global param to; params holding
+        a loop index are sent as that loop's index on the engine that has it:
+        - selected_loop_num (0 indexed) is only sent to that engine
+        - sync_source > 0 (1 indexed) syncs that engine's loops to it,
+          but the other engines can't see it, so their loops don't sync
+        """
+        if param == 'selected_loop_num':
+            owner, local = self.route(value)
+            return [(owner, local)]
+        if param == 'sync_source' and value > 0:
+            owner, local = self.route(value-1)
+            return [(engine, local+1 if engine is owner else 0) for engine in self.engines]
+        return [(engine, value) for engine in self.engines]
+
+    def set(self, param, value, loop=None):
+        if loop is None:
+            if param == 'selected_loop_num':
+                self.selected_loop = value
+            with self.bundle():
+                for engine, engine_value in self.engine_values(param, value):
+                    engine.set(param, engine_value)
+            return
+        with self.bundle():
+            for engine, local in self.engines_for(loop):
+                engine.set(param, value, local)
+
+    def loop_state(self, loop):
+        engine, local = self.route(loop)
+        return engine.loop_state(local)
+
+    def enable_auto_updates(self, *args, **kwargs):
+        for engine in self.engines:
+            engine.enable_auto_updates(*args, **kwargs)
+
+    def load_empty_session(self):
+        # every engine now has one loop, but we are only using the first one
+        for engine in self.engines:
+            engine.load_empty_session()
+        self.engine_nloops = [1]*len(self.engines)
+        self.nloops = 1
+
+    def add_loop(self):
+        """
+        adds the next loop on whichever engine it belongs to
+        (unless that engine already has a spare loop)
+        """
+        engine, local = self.route(self.nloops)
+        index = self.engines.index(engine)
+        if self.engine_nloops[index] <= local:
+            engine.add_loop()
+            self.engine_nloops[index] += 1
+        self.nloops += 1
+
+    def engines_in_use(self):
+        return max(1, -(-self.nloops // self.loops_per_engine))
+
+    def session_files(self, outfile):
+        """
+        each engine in use saves its loops to its own file, e.g.,
+        ["0.slsess", "0.slsess_engine_1", "0.slsess_engine_2"]
+        """
+        return [outfile] + [outfile + ENGINE_FILE_SUFFIX.format(i)
+            for i in range(1, self.engines_in_use())]
+
+    def new_write_id(self):
+        self.nwrites += 1
+        return self.nwrites
+
+    def save_session(self, outfile, write_id=None):
+        for engine, engine_file in zip(self.engines, self.session_files(outfile)):
+            engine.save_session(engine_file, write_id)
+
+    def save_loop_audio(self, index, outfile, write_id=None):
+        engine, local = self.route(index)
+        engine.save_loop_audio(local, outfile, write_id)
+
+    def load_session(self, infile):
+        """
+        loads each engine's part of the session; engines that weren't
+        in use when it was saved have no file, and get the empty session
+        """
+        self.nloops = 0
+        for i, engine in enumerate(self.engines):
+            engine_file = infile if i == 0 else infile + ENGINE_FILE_SUFFIX.format(i)
+            if i > 0 and not os.path.exists(engine_file):
+                engine.load_empty_session()
+                self.engine_nloops[i] = 1
+                continue
+            engine.load_session(engine_file)
+            self.engine_nloops[i] = count_loops(engine_file)
+            self.nloops += self.engine_nloops[i]
+
+    def ping(self):
+        """
+        returns a Future whose result is the total loop count,
+        once every engine has replied
+        """
+        future = Future()
+        futures = [engine.ping() for engine in self.engines]
+        def check(_):
+            if future.done() or not all(f.done() for f in futures):
+                return
+            if any(f.cancelled() for f in futures):
+                future.cancel()
+            else:
+                future.set_result(sum(f.result() for f in futures))
+        for f in futures:
+            f.add_done_callback(check)
+        return future
+
+    def probe_engines(self, timeout=PING_TIMEOUT):
+        """
+        pings every engine at once; returns each engine's loopcount
+        (or None, for engines that didn't answer within timeout)
+        """
+        futures = [engine.ping() for engine in self.engines]
+        self.flush()
+        t_end = time.monotonic() + timeout
+        while not all(f.done() for f in futures) and time.monotonic() < t_end:
+            self.process()
+            time.sleep(0.001)
+        results = []
+        for i, (engine, future) in enumerate(zip(self.engines, futures)):
+            # give up on the ones that didn't answer
+            health = 'down' if future.cancel() else 'up'
+            if health != engine.health:
+                print('SL engine {} ({}:{}) is {}'.format(i,
+                    engine.client_url, engine.client_port, health))
+            engine.health = health
+            results.append(future.result() if health == 'up' else None)
+        return results
+
+    def probe(self, timeout=PING_TIMEOUT):
+        """
+        returns the total loopcount, or None if any engine doesn't answer
+        """
+        results = self.probe_engines(timeout)
+        if None in results:
+            return None
+        return sum(results)
+
+    def expected_engine_nloops(self, nloops):
+        """
+        how many loops each engine has once we have added nloops in all
+        (after load_empty_session, every engine has at least one)
+        """
+        return [max(1, min(self.loops_per_engine, nloops - i*self.loops_per_engine))
+            for i in range(len(self.engines))]
+
+    def is_ready(self, expected_nloops=None, timeout=PING_TIMEOUT):
+        """
+        expected_nloops is the total loop count (see expected_engine_nloops)
+        """
+        results = self.probe_engines(timeout)
+        if None in results:
+            return False
+        return expected_nloops is None or results == self.expected_engine_nloops(expected_nloops)
+
+    def wait_until_ready(self, expected_nloops=None, timeout=10.0):
+        t_end = time.monotonic() + timeout
+        while time.monotonic() < t_end:
+            if self.is_ready(expected_nloops, min(PING_TIMEOUT, t_end - time.monotonic())):
+                return True
+            time.sleep(0.01)
+        return False
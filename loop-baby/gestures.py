@@ -0,0 +1,98 @@
+import time
+
+DEBOUNCE_SECS = 0.02 # a press this soon after a release is the button bouncing
+CHORD_WINDOW_SECS = 0.5 # a chord's buttons must all be pressed within this
+LONG_PRESS_SECS = 0.8
+
+class Press:
+    __slots__ = ['number', 'time', 'token', 'consumed']
+    def __init__(self, number, t, token):
+        self.number = number
+        self.time = t
+        self.token = token # whatever on_press returned, for cancelling it later
+        self.consumed = False # True once part of a gesture
+
+class GestureEngine:
+    """
+    sits between the interface and the looper: every press and release
+    is passed on at once (so a tap is handled as fast as before),
+    and if presses turn out to be part of a gesture, its handler gets
+    the tokens on_press returned for them, so it can cancel them:
+    - chord: all of a chord's buttons held at once,
+        having been pressed within chord_window seconds
+    - long press: one button held on its own for long_press_secs
+        (noticed by poll, so call it often while is_timing() is True,
+        or else when the button is released)
+    spurious edges are dropped: releases of buttons that aren't held,
+    presses of buttons that are, and presses right after a release;
+    give press and release the time of the event (e.g., Event.time),
+    not of when we got around to it, or else events replayed (or just
+    handled) quickly will look like bouncing, or like chords
+    """
+    def __init__(self, on_press, on_release, chords=None,
+        on_chord=None, on_long_press=None,
+        chord_window=CHORD_WINDOW_SECS, long_press_secs=LONG_PRESS_SECS,
+        debounce_secs=DEBOUNCE_SECS):
+        self.on_press = on_press
+        self.on_release = on_release
+        self.chords = dict((name, set(buttons)) for name, buttons in (chords or {}).items())
+        self.on_chord = on_chord
+        self.on_long_press = on_long_press
+        self.chord_window = chord_window
+        self.long_press_secs = long_press_secs
+        self.debounce_secs = debounce_secs
+        self.ndropped = 0
+        self.reset()
+
+    def reset(self):
+        self.held = {} # button number -> Press
+        self.last_release = {} # button number -> time
+
+    def is_timing(self):
+        """
+        True if a long press might still happen
+        """
+        return len(self.held) == 1 and not next(iter(self.held.values())).consumed
+
+    def press(self, number, t=None):
+        t = time.monotonic() if t is None else t
+        if number in self.held or t - self.last_release.get(number, -1) < self.debounce_secs:
+            self.ndropped += 1
+            return
+        press = Press(number, t, None)
+        self.held[number] = press
+        press.token = self.on_press(number)
+
+        for name, buttons in self.chords.items():
+            if number not in buttons or not buttons.issubset(self.held):
+                continue
+            presses = sorted((self.held[i] for i in buttons), key=lambda press: press.time)
+            if presses[-1].time - presses[0].time > self.chord_window or any(p.consumed for p in presses):
+                continue
+            for p in presses:
+                p.consumed = True
+            if self.on_chord is not None:
+                self.on_chord(name, [p.token for p in presses])
+            break
+
+    def release(self, number, t=None):
+        t = time.monotonic() if t is None else t
+        if number not in self.held:
+            # false event (happens sometimes for some reason)
+            self.ndropped += 1
+            return
+        # in case poll didn't get to it first
+        self.poll(t)
+        del self.held[number]
+        self.last_release[number] = t
+        self.on_release(number)
+
+    def poll(self, t=None):
+        if not self.is_timing():
+            return
+        t = time.monotonic() if t is None else t
+        press = next(iter(self.held.values()))
+        if t - press.time >= self.long_press_secs:
+            press.consumed = True
+            if self.on_long_press is not None:
+                self.on_long_press(press.number, [press.token])
@@ -1,5 +1,6 @@
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import time
 import random
 import pygame
 
@@ -12,17 +13,19 @@ KEYBOARD_MAP = {
     }
 
 class Event:
-    def __init__(self, number, edge):
+    def __init__(self, number, edge, t=None):
         self.number = number
         self.edge = edge
+        self.time = time.monotonic() if t is None else t # see GestureEngine
 
 class Keyboard:
     def __init__(self, pressed_code, released_code):
         self.pressed_code = pressed_code
         self.released_code = released_code
 
-        self.callbacks = [None]*16
-        self.pixels = [0]*16
+        self.nbuttons = 16
+        self.callbacks = [None]*self.nbuttons
+        self.pixels = [0]*self.nbuttons
         self.button = None
         self.pressed = False
         self.time = 0
@@ -91,18 +94,24 @@ class Keyboard:
             event = Event(self.button, self.pressed_code)
             self.callbacks[self.button](event)
 
+    def wait_for_input(self, timeout=None):
+        self.sync()
+        time.sleep(.02)
+
     def set_color_all_buttons(self, color):
         pass
 
     def set_color(self, index, color):
         pass
 
-    def set_color_map(self, color_map):
+    def set_rgb(self, index, rgb):
         pass
 
-    def terminate(self):
+    def show(self):
         pass
 
-    def lightshow(self):
+    def set_color_map(self, color_map):
         pass
 
+    def terminate(self):
+        pass
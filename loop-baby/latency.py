@@ -0,0 +1,129 @@
+import time
+import signal
+from array import array
+
+# stages, in the order they happen after a button edge
+STAGES = ['edge', 'stop_record', 'action', 'osc_send', 'colors', 'led_flush']
+DEFAULT_CAPACITY = 4096 # marks kept in the ring buffer
+
+# the active recorder; None when instrumentation is off,
+# so call sites cost only this check, e.g.:
+#     if latency.recorder is not None:
+#         latency.recorder.mark('osc_send')
+recorder = None
+
+def enable(capacity=DEFAULT_CAPACITY, report_signal=signal.SIGUSR1):
+    """
+    start recording; sending report_signal (e.g., 'kill -USR1 <pid>')
+    prints the report without stopping the looper
+    """
+    global recorder
+    recorder = LatencyRecorder(capacity)
+    if report_signal is not None:
+        signal.signal(report_signal, lambda signum, frame: recorder.print_report())
+    return recorder
+
+def percentile(sorted_values, p):
+    """
+    nearest-rank percentile of an already-sorted list
+    """
+    index = int(round(p/100.0*(len(sorted_values)-1)))
+    return sorted_values[index]
+
+class LatencyRecorder:
+    """
+    records a monotonic timestamp for each stage of each button event,
+    in a preallocated ring buffer (the oldest marks are overwritten)
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.event_ids = array('q', [0]*capacity)
+        self.stages = array('b', [0]*capacity)
+        self.times = array('q', [0]*capacity)
+        self.count = 0 # total marks ever recorded
+        self.event_id = 0 # event that later marks belong to (0 = none)
+        self.stage_indices = dict((stage, i) for i, stage in enumerate(STAGES))
+
+    def mark(self, stage, event_id=None):
+        """
+        stage 'edge' starts a new event; marks for other stages
+        are attributed to the most recent edge unless event_id is given
+        """
+        if stage == 'edge':
+            self.event_id = event_id
+        elif event_id is None:
+            event_id = self.event_id
+        i = self.count % self.capacity
+        self.event_ids[i] = event_id
+        self.stages[i] = self.stage_indices[stage]
+        self.times[i] = time.monotonic_ns()
+        self.count += 1
+
+    def end_event(self):
+        """
+        call once the event has been fully handled (LEDs included),
+        so that later marks are not attributed to it
+        """
+        self.event_id = 0
+
+    def latencies(self):
+        """
+        returns, for each stage, the ms from each event's edge
+        to the first time that stage was reached
+        """
+        n = min(self.count, self.capacity)
+        start = self.count - n
+        edges = {}
+        firsts = {}
+        for j in range(start, start+n):
+            i = j % self.capacity
+            key = (self.event_ids[i], self.stages[i])
+            if self.stages[i] == 0:
+                edges[self.event_ids[i]] = self.times[i]
+            elif key not in firsts:
+                firsts[key] = self.times[i]
+        results = dict((stage, []) for stage in STAGES[1:])
+        for (event_id, stage), t in firsts.items():
+            if event_id in edges and t >= edges[event_id]:
+                results[STAGES[stage]].append((t - edges[event_id])/1e6)
+        return results
+
+    def report(self):
+        nevents = list(self.stages[:min(self.count, self.capacity)]).count(0)
+        lines = ['Latency from button edge (ms), {} events:'.format(nevents)]
+        for stage, values in self.latencies().items():
+            if not values:
+                continue
+            values = sorted(values)
+            lines.append('   {:<12} n={:<5} p50={:7.2f}  p95={:7.2f}  p99={:7.2f}'.format(
+                stage, len(values), percentile(values, 50),
+                percentile(values, 95), percentile(values, 99)))
+        return '\n'.join(lines)
+
+    def print_report(self):
+        print(self.report())
+
+class StartupTimer:
+    """
+    times each phase of startup, e.g.:
+        timer.mark('imports') # time from t_start until now
+        timer.mark('interface') # time since 'imports'
+    """
+    def __init__(self, t_start=None):
+        self.t_start = time.monotonic() if t_start is None else t_start
+        self.t_last = self.t_start
+        self.phases = []
+
+    def mark(self, phase):
+        now = time.monotonic()
+        self.phases.append((phase, now - self.t_last))
+        self.t_last = now
+
+    def report(self):
+        lines = ['Startup took {:0.2f}s:'.format(self.t_last - self.t_start)]
+        for phase, secs in self.phases:
+            lines.append('   {:<16} {:6.3f}s'.format(phase, secs))
+        return '\n'.join(lines)
+
+    def print_report(self):
+        print(self.report())
@@ -1,31 +1,52 @@
+import time
+T_START = time.monotonic() # for the startup report
 import os
 import sys
-import time
+import asyncio
 import argparse
 import subprocess
 
-# interface options: trellis, keyboard
-try:
-    from trellis import Trellis
-except:
-    print("WARNING: Could not import Trellis. Try running 'sudo pip3 install adafruit-circuitpython-neotrellis'")
-from keyboard import Keyboard
-
+# nb: interfaces (trellis, keyboard, replay) are imported in main(),
+# so that we only load the one we use
+import latency
+import animations
+from animations import Animator
 from actions import make_actions
-from osc import OscSooperLooper, slider_ratio_to_gain_ratio
+from osc import OscSooperLooper, slider_ratio_to_gain_ratio, PING_TIMEOUT, MAX_LOOP_COUNT
+from engines import EngineRouter, parse_engine_url, LOOPS_PER_ENGINE
 from save_and_recall import SLSessionManager
-from button_settings import COLOR_MAP, BUTTON_MAP, SETTINGS_MAP, SCREENSAVER_TIME_SECS
+from button_settings import COLOR_MAP, BUTTON_MAP, SETTINGS_MAP, SCREENSAVER_TIME_SECS, LAYOUTS
+from button_settings import META_COMMANDS, GESTURE_MAP
+from gestures import GestureEngine, CHORD_WINDOW_SECS, LONG_PRESS_SECS
 
 BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
 
 BUTTON_PRESSED = 3
 BUTTON_RELEASED = 2
 
+# used by the asyncio runtime (see Looper.start_async)
+POLL_INTERVAL = 0.02 # seconds between reads of the interface
+OSC_PROCESS_INTERVAL = 0.005 # seconds between checks for replies from SL
+SAMPLER_PUMP_INTERVAL = 0.01 # less than one block of sampler audio
+
+# seconds per frame of each LED animation (see animations.py)
+LIGHTSHOW_FRAME_SECS = 0.07
+STARTUP_FRAME_SECS = 0.03
+RESTART_FRAME_SECS = 0.1
+SAVE_PROGRESS_FRAME_SECS = 0.25
+
+ENGINE_TIMEOUT = 5 # seconds to wait for SL to load a session
+RESTART_TIMEOUT = 30 # seconds to wait for jack and SL to restart
+GESTURE_POLL_INTERVAL = 0.05 # while a button might become a long press
+MAX_CANCELLABLE_PRESSES = 32
+
 class Looper:
     def __init__(self, sl_client, interface, button_map=BUTTON_MAP,
         settings_map=SETTINGS_MAP,
         screensaver_time_secs=SCREENSAVER_TIME_SECS, 
-        session_dir=None, startup_color='random', verbose=False, nloops=4):
+        session_dir=None, startup_color='random', verbose=False, nloops=4,
+        auto_update_ms=None, event_recorder=None, startup_timer=None,
+        sampler=None, ntrack_banks=1, gesture_settings=None):
 
         self.verbose = verbose
         self.sl_client = sl_client
@@ -33,25 +54,59 @@ class Looper:
         self.interface = interface
         self.interface.set_callback(self.button_handler)
 
-        actions = make_actions(self.sl_client, self.interface, button_map, settings_map)
+        actions = make_actions(self.sl_client, self.interface, button_map, settings_map,
+            ntrack_banks)
         self.button_map = button_map
+        # holding this button in save/recall mode pages between banks of sessions
+        self.save_recall_button = next((number for number, name in button_map.items()
+            if name == 'save/recall'), None)
+        # holding this button pages between banks of tracks (if there are several)
+        self.track_bank_button = next((number for number, name in button_map.items()
+            if name == 'volume/gain/monitor'), None)
+        self.mode_before_paging = None
+        self.can_restore_mode = False # True until we page, after pressing one of these
+        self.selected_track = None # the loop whose volume we are setting
         self.loops = actions['loops']
+        self.recording_loops = actions['recording']
+        self.ntracks = len(actions['sessions']) # loops shown at once
+        self.ntrack_banks = ntrack_banks
+        self.track_bank = 0
         self.mode_buttons = actions['modes']
         self.settings = actions['settings']
         self.session_manager = SLSessionManager(actions['sessions'],
             session_dir, self.sl_client)
 
         self.event_id = 0 # for counting button events
-        self.buttons_pressed = set()
         self.initial_nloops = nloops
+        self.auto_update_ms = auto_update_ms
         self.screensaver_time_secs = screensaver_time_secs
+        self.event_loop = None # set when running with start_async()
+        self.event_recorder = event_recorder # for replaying button presses later
+        self.startup_timer = startup_timer # reported once the looper is on
+        self.sampler = sampler # plays samples from the track buttons in 'sampler' mode
+        self.startup_color = startup_color # for the sweep across the buttons at startup
+        self.animator = Animator()
+
+        # chords (from META_COMMANDS), and long presses;
+        # META_COMMANDS are given for the 4x4 layout, so we find the
+        # buttons with the same jobs in this one
+        chords = {}
+        for name, command in META_COMMANDS.items():
+            buttons = [number for n in command['command'] for number, job in button_map.items()
+                if job == BUTTON_MAP[n]]
+            if len(buttons) == len(command['command']):
+                chords[name] = buttons
+        self.gestures = GestureEngine(self.handle_press, self.handle_release, chords,
+            on_chord=self.handle_chord,
+            on_long_press=lambda number, event_ids: self.handle_gesture('long_press', number, event_ids),
+            **(gesture_settings or {}))
+        self.states_before_press = {} # event_id -> (mode, is_playing, track states)
 
     def init_loops(self):
         """
         enable internal loops, and create them in SL
         """
         self.sl_client.load_empty_session()
-        time.sleep(0.2) # delay to wait for SL
 
         self.nloops = self.initial_nloops
         # first disable loops (in case we are restarting)
@@ -63,6 +118,16 @@ class Looper:
         # one loop exists; must tell SL about the remaining ones
         for i in range(self.nloops-1):
             self.sl_client.add_loop()
+        # SL handles these in order, so once it reports all of our loops,
+        # it has loaded the empty session (which has one loop) and added the rest;
+        # without an empty session, SL keeps whatever loops it had
+        expected_nloops = self.nloops if self.sl_client.empty_session is not None else None
+        if not self.sl_client.wait_until_ready(expected_nloops, ENGINE_TIMEOUT):
+            print('WARNING: SL did not have {} loops within {}s'.format(
+                self.nloops, ENGINE_TIMEOUT))
+        if self.auto_update_ms:
+            # have SL keep us updated on the state of each loop
+            self.sl_client.enable_auto_updates(self.auto_update_ms)
 
     def add_loop(self, internal_add_only=False):
         """
@@ -77,29 +142,159 @@ class Looper:
         """
         this gets called when a Trellis button is pressed
         """
+        if self.event_recorder is not None:
+            self.event_recorder.record(event)
         if self.mode == 'lightshow':
+            self.animator.stop('lightshow')
             self.init_looper()
             return
+        if self.mode == 'restarting':
+            # ignore buttons until SL is back up
+            return
+        if self.animator.stop_interruptible():
+            # e.g., pressed during the startup sweep
+            self.redraw_buttons()
         self.time_last_pressed = time.time()
         self.event_id += 1
-        button_name = self.button_map[event.number]   
+        if latency.recorder is not None:
+            latency.recorder.mark('edge', self.event_id)
+        button_name = self.button_map.get(event.number)
+        if button_name is None:
+            # not every button has a job on larger grids
+            return
 
+        # presses are handled right away, and cancelled later
+        # if they turn out to be part of a gesture (see GestureEngine)
         if event.edge == BUTTON_PRESSED:
-            event_type = 'pressed'
-            self.buttons_pressed.add(event.number)
+            self.gestures.press(event.number, t=event.time)
         elif event.edge == BUTTON_RELEASED:
-            event_type = 'released'
-            if event.number in self.buttons_pressed:
-                self.buttons_pressed.remove(event.number)
-            else:
-                # false event (happens sometimes for some reason)
-                return
+            self.gestures.release(event.number, t=event.time)
         else:
             print('Error (unknown event.edge): {}'.format(event.edge))
+
+    def handle_press(self, button_number):
+        """
+        returns the event_id, so that the press can be cancelled
+        """
+        button_name = self.button_map[button_number]
+        if self.verbose:
+            print('Button pressed: ({}, {})'.format(button_number, button_name))
+        # what to go back to, if this press is cancelled
+        self.states_before_press[self.event_id] = (self.mode, self.is_playing, self.track_states())
+        if len(self.states_before_press) > MAX_CANCELLABLE_PRESSES:
+            del self.states_before_press[next(iter(self.states_before_press))]
+        self.process_button(button_name, button_number, 'pressed', self.event_id)
+        return self.event_id
+
+    def handle_release(self, button_number):
+        button_name = self.button_map[button_number]
+        if self.verbose:
+            print('Button released: ({}, {})'.format(button_number, button_name))
+        self.process_button(button_name, button_number, 'released', self.event_id)
+
+    def track_states(self):
+        """
+        what a press can change about the tracks, and can be undone (see restore_track_states)
+        """
+        loops = [(loop.ntakes, loop.is_muted, loop.pressed_once, loop.volume_ratio)
+            for loop in self.loops]
+        sessions = [session.pressed_once for session in self.session_manager.sessions]
+        return loops, sessions, self.selected_track
+
+    def restore_track_states(self, states):
+        """
+        undo what presses did to the tracks since states = track_states():
+        recordings and overdubs they started are stopped, and undone in SL;
+        mutes and volumes are set back, and buttons pressed once are unpressed;
+        what can't be undone stays (e.g., stopping a recording, a oneshot,
+        or saving or recalling a session)
+        """
+        loops, sessions, self.selected_track = states
+        with self.sl_client.bundle():
+            for loop, (ntakes, was_muted, pressed_once, volume_ratio) in zip(self.loops, loops):
+                loop.pressed_once = pressed_once
+                if not loop.is_enabled:
+                    continue
+                if loop.ntakes > ntakes:
+                    nundos = loop.ntakes - ntakes
+                    state = loop.engine_state()
+                    if state is not None and state.state == 'waitstart':
+                        # (quantized) the last take never started
+                        nundos -= 1
+                    if loop.is_recording:
+                        loop.toggle_record()
+                    elif loop.is_overdubbing:
+                        loop.toggle_overdub()
+                    for i in range(nundos):
+                        loop.undo()
+                    loop.ntakes = ntakes
+                if loop.is_muted != was_muted:
+                    loop.toggle('mute')
+                if loop.volume_ratio != volume_ratio:
+                    loop.set_volume(volume_ratio)
+        for session, pressed_once in zip(self.session_manager.sessions, sessions):
+            session.pressed_once = pressed_once
+
+    def cancel_presses(self, event_ids):
+        """
+        undo the mode changes (and play/pause), and what they did to the tracks,
+        of presses that turned out to be part of a gesture
+        """
+        state = self.states_before_press.get(min(event_ids))
+        if state is None:
             return
+        mode, is_playing, track_states = state
+        self.restore_track_states(track_states)
+        if is_playing and not self.is_playing:
+            self.play()
+        elif self.is_playing and not is_playing:
+            self.pause()
+        self.mode = mode
         if self.verbose:
-            print('Button {}: ({}, {})'.format(event_type, event.number, button_name))
-        self.process_button(button_name, event.number, event_type, self.event_id)
+            print('   Cancelled {} press(es); mode -> {}'.format(len(event_ids), self.mode))
+        self.set_mode_colors_given_mode()
+        self.set_track_colors_given_mode()
+
+    def handle_chord(self, name, event_ids):
+        self.cancel_presses(event_ids)
+        self.run_meta_command(name)
+
+    def handle_gesture(self, gesture, button_number, event_ids):
+        """
+        runs the Looper method in GESTURE_MAP for this gesture and button, if any
+        """
+        method = GESTURE_MAP.get((gesture, self.button_map[button_number]))
+        if method is None:
+            return
+        if self.verbose:
+            print('Gesture: {} on {} -> {}'.format(gesture, self.button_map[button_number], method))
+        self.cancel_presses(event_ids)
+        getattr(self, method)()
+
+    def run_meta_command(self, name):
+        command = META_COMMANDS[name]
+        print('Meta command: {}'.format(name))
+        if command['restart_looper']:
+            # e.g., startup.sh restarts SL, so we wait for it, then start over
+            self.restart_jack_and_sl(start=lambda: command['callback'](self))
+        else:
+            self.terminate()
+            command['callback'](self)
+
+    def toggle_mute_all(self):
+        """
+        mute every loop, or unmute them all if they already are
+        """
+        if not self.is_playing:
+            print('   Cannot mute when paused; otherwise loops will get out of sync!')
+            return
+        loops = [loop for loop in self.loops[:self.nloops] if loop.is_enabled]
+        mode = 'mute' if any(not loop.is_muted for loop in loops) else 'unmute'
+        with self.sl_client.bundle():
+            for loop in loops:
+                if loop.is_muted != (mode == 'mute'):
+                    loop.toggle('mute')
+        self.set_track_colors_given_mode()
 
     def process_button(self, button_name, button_number, press_type, event_id):
         """
@@ -109,27 +304,36 @@ class Looper:
         """
         # updates happen at the time of button press
         if press_type == 'pressed':
-            # any time a button is pressed, we will
-            # stop any recording/overdubbing going on
-            for loop in self.loops:
-                loop.stop_record_or_overdub(event_id)
+            # everything sent to SL for this press goes out as one bundle
+            with self.sl_client.bundle():
+                # any time a button is pressed, we will
+                # stop any recording/overdubbing going on
+                for loop in sorted(self.recording_loops, key=lambda loop: loop.track):
+                    loop.stop_record_or_overdub(event_id)
+                if latency.recorder is not None:
+                    latency.recorder.mark('stop_record', event_id)
 
-            # now handle the button press
-            if type(button_name) is int:
-                self.process_track_change(button_name, button_number, event_id)
-                if self.verbose:
-                    print('   ({}) track = {}'.format(self.mode, button_name))
-            else:
-                self.process_mode_change(button_name)
-                if self.verbose:
-                    print('   Mode change -> {} ({})'.format(self.mode, 'playing' if self.is_playing else 'paused'))
+                # now handle the button press
+                if type(button_name) is int:
+                    self.process_track_change(button_name, button_number, event_id)
+                    if self.verbose:
+                        print('   ({}) track = {}'.format(self.mode, button_name))
+                else:
+                    self.process_mode_change(button_name)
+                    if self.verbose:
+                        print('   Mode change -> {} ({})'.format(self.mode, 'playing' if self.is_playing else 'paused'))
+                if latency.recorder is not None:
+                    latency.recorder.mark('action', event_id)
+            if type(button_name) is not int:
                 self.set_mode_colors_given_mode()
             self.set_track_colors_given_mode()
+            if latency.recorder is not None:
+                latency.recorder.mark('colors', event_id)
 
         # mark when a track button is unpressed
         elif press_type == 'released':
             if type(button_name) is int:
-                self.loops[button_name-1].unpress()
+                self.loop_for_track(button_name).unpress()
                 self.set_track_colors_given_mode()
 
     def set_mode_colors_given_mode(self):
@@ -152,9 +356,11 @@ class Looper:
     def set_track_colors_given_mode(self):
         """
         set colors of all track buttons based on self.mode
+        (using what SL reports about each loop, if we are getting updates)
         """
+        loops = self.visible_loops()
         if self.mode == None:
-            for loop in self.loops:                
+            for loop in loops:                
                 if not loop.is_enabled:
                     color = 'off'
                 elif loop.is_pressed:
@@ -163,66 +369,79 @@ class Looper:
                     color = 'off'
                 loop.set_color(color)
         elif self.mode == 'oneshot':
-            for loop in self.loops:
+            for loop in loops:
                 if not loop.is_enabled:
                     color = 'off'
                 elif loop.is_pressed:
                     color = self.mode
-                elif loop.has_had_something_recorded:
+                elif loop.has_audio():
                     color = 'track_recorded'
                 else:
                     color = 'off'
                 loop.set_color(color)
         elif self.mode in ['record', 'overdub']:
             # color buttons if track exists but isn't currently being recorded to
-            for loop in self.loops:
+            for loop in loops:
                 if not loop.is_enabled:
                     color = 'off'
-                elif loop.is_recording or loop.is_overdubbing:
+                elif loop.is_being_recorded():
                     color = self.mode
-                elif loop.has_had_something_recorded:
+                elif loop.has_audio():
                     color = 'track_recorded'
                 else:
                     color = 'track_exists'
                 loop.set_color(color)
         elif self.mode == 'mute':
-            for loop in self.loops:
+            for loop in loops:
                 if not loop.is_enabled:
                     color = 'off'
-                elif not loop.has_had_something_recorded:
+                elif not loop.has_audio():
                     color = 'track_exists'
-                elif loop.is_muted:
+                elif loop.muted():
                     color = 'mute_on'
                 else:
                     color = 'mute_off'
                 loop.set_color(color)
         elif self.mode in ['undo', 'redo']:
-            for loop in self.loops:
+            for loop in loops:
                 if not loop.is_enabled:
                     color = 'off'
                 elif loop.is_pressed:
                     color = self.mode
-                elif loop.has_had_something_recorded:
+                elif loop.has_audio():
                     color = 'track_exists'
                 else:
                     color = 'off'
                 loop.set_color(color)
         elif self.mode == 'clear':
-            for loop in self.loops:                
+            for loop in loops:                
                 if not loop.is_enabled:
                     color = 'off'
                 elif loop.pressed_once:
                     if self.verbose:
                         print('    Refreshing {}'.format(loop.button_number))
                     color = 'track_pressed_once'
-                elif loop.has_had_something_recorded:
+                elif loop.has_audio():
                     color = 'track_exists'
                 else:
                     color = 'off'
                 loop.set_color(color)
+        elif self.mode == 'sampler':
+            for loop in loops:
+                if loop.track % self.ntracks >= len(self.sampler):
+                    color = 'off'
+                elif loop.is_pressed:
+                    color = 'sampler_pressed'
+                else:
+                    color = 'sampler_pad'
+                loop.set_color(color)
         elif self.mode in ['save', 'recall']:
             for session in self.session_manager.sessions:
-                if self.session_manager.exists(session.name):
+                index = self.session_manager.session_index(session.name)
+                if self.session_manager.is_saving(index):
+                    # blink while SL writes the files
+                    color = 'session_saving' if int(2*time.time()) % 2 == 0 else 'off'
+                elif self.session_manager.exists(index):
                     if session.pressed_once:
                         color = 'track_pressed_once'
                     else:
@@ -237,16 +456,16 @@ class Looper:
                 button.set_color()
                 button_numbers_set.append(button.button_number)
             # now turn all other track buttons off
-            for loop in self.loops:
+            for loop in loops:
                 if loop.button_number not in button_numbers_set:
                     loop.set_color('off')
         elif self.mode == 'volume':
             if self.selected_track is None:
                 # show tracks you can select to then set volume
-                for loop in self.loops:
+                for loop in loops:
                     if not loop.is_enabled:
                         color = 'off'
-                    elif loop.has_had_something_recorded:
+                    elif loop.has_audio():
                         color = 'track_recorded'
                     else:
                         color = 'track_exists'
@@ -255,9 +474,9 @@ class Looper:
                 # visualize volume by highlighting
                 # all tracks up to that proportion
                 # e.g., if slider_ratio is 0.5, color the first 4 tracks
-                track_count = int((len(self.loops)-1)*self.selected_track.volume_ratio)
-                for loop in self.loops:
-                    if loop.track <= track_count:
+                track_count = int((self.ntracks-1)*self.selected_track.volume_ratio)
+                for i, loop in enumerate(loops):
+                    if i <= track_count:
                         color = 'volume'
                     else:
                         color = 'off'
@@ -266,9 +485,9 @@ class Looper:
             # visualize gain level by highlighting
             # all tracks up to that proportion
             # e.g., if slider_ratio is 0.5, color the first 4 tracks
-            track_count = int((len(self.loops)-1)*self.gain_slider)
-            for loop in self.loops:
-                if loop.track <= track_count:
+            track_count = int((self.ntracks-1)*self.gain_slider)
+            for i, loop in enumerate(loops):
+                if i <= track_count:
                     color = 'gain'
                 else:
                     color = 'off'
@@ -277,20 +496,63 @@ class Looper:
             # visualize monitor level by highlighting
             # all tracks up to that proportion
             # e.g., if slider_ratio is 0.5, color the first 4 tracks
-            track_count = int((len(self.loops)-1)*self.monitor_slider)
-            for loop in self.loops:
-                if loop.track <= track_count:
+            track_count = int((self.ntracks-1)*self.monitor_slider)
+            for i, loop in enumerate(loops):
+                if i <= track_count:
                     color = 'monitor'
                 else:
                     color = 'off'
                 loop.set_color(color)
 
+    def refresh_if_loops_changed(self):
+        """
+        handle any updates from SL, and update track colors
+        if a loop's state changed without us pressing anything
+        """
+        self.sl_client.process()
+        # notice (and report) if SL stops answering
+        self.sl_client.check_health()
+        if not self.sl_client.loop_states_changed:
+            return
+        self.sl_client.loop_states_changed = False
+        if self.mode not in ['lightshow', 'restarting']:
+            self.set_track_colors_given_mode()
+
+    def poll_save_jobs(self):
+        """
+        check on sessions being saved
+        (save_progress_frames animates their buttons)
+        """
+        if not self.session_manager.is_busy():
+            return
+        finished = self.session_manager.poll_jobs()
+        for job in finished:
+            if job.status == 'done':
+                print('Saved session at index {}'.format(job.index))
+                # shrink the audio files, in the background
+                self.session_manager.compress_session(job.index)
+            else:
+                print('ERROR: Could not save session at index {}'.format(job.index))
+        if finished and self.mode in ['save', 'recall']:
+            self.set_track_colors_given_mode()
+
+    def save_progress_frames(self):
+        """
+        animation that blinks the buttons of sessions being saved,
+        until SL has written every file
+        """
+        while self.session_manager.jobs:
+            if self.mode in ['save', 'recall']:
+                self.set_track_colors_given_mode()
+            yield
+
     def pause(self):
         """
         pause all loops, and mark sync position for when we play
         """
-        self.sl_client.hit('set_sync_pos', -1)
-        self.sl_client.hit('pause_on', -1)
+        with self.sl_client.bundle():
+            self.sl_client.hit('set_sync_pos', -1)
+            self.sl_client.hit('pause_on', -1)
         if self.mode in ['record', 'overdub', 'mute']:
             print('   Cannot {} when paused, so setting mode -> None'.format(self.mode))
             self.mode = None
@@ -305,10 +567,12 @@ class Looper:
             print('   Cannot {} when playing, so setting mode -> None'.format(self.mode))
             self.mode = None
         # when unpausing, 'trigger' restarts from where we paused
-        self.sl_client.hit('trigger', -1)
-        # but we must now check which tracks were muted and re-mute
-        for loop in self.loops:
-            loop.remute_if_necessary()
+        # but we must now check which tracks were muted and re-mute;
+        # sending these as one bundle keeps muted loops from blipping
+        with self.sl_client.bundle():
+            self.sl_client.hit('trigger', -1)
+            for loop in self.loops:
+                loop.remute_if_necessary()
         self.is_playing = True
 
     def process_mode_change(self, mode):
@@ -334,13 +598,28 @@ class Looper:
         previous_mode = self.mode
         if mode == 'record/overdub':
             mode = 'overdub' if previous_mode == 'record' else 'record'
+        elif mode == 'oneshot/sampler':
+            if previous_mode != 'oneshot':
+                mode = 'oneshot'
+            elif self.sampler is not None:
+                mode = 'sampler'
+                # make sure the pads' samples are loaded before they are pressed
+                self.sampler.preload(range(self.ntracks))
+            else:
+                mode = None
         elif mode == 'save/recall':
             mode = 'recall' if previous_mode == 'save' else 'save'
+            # in case this press turns out to be for paging (see page_sessions)
+            self.mode_before_paging = previous_mode
+            self.can_restore_mode = True
         elif mode == 'undo/redo':
             mode = 'redo' if previous_mode == 'undo' else 'undo'
         elif mode == 'mute/clear':
             mode = 'clear' if previous_mode == 'mute' else 'mute'
         elif mode == 'volume/gain/monitor':
+            # in case this press turns out to be for paging (see page_tracks)
+            self.mode_before_paging = previous_mode
+            self.can_restore_mode = True
             if previous_mode == 'volume':
                 if self.selected_track is None:
                     mode = 'gain'
@@ -383,18 +662,29 @@ class Looper:
         actions depend on what mode we're in
         we also set button color based on the mode
         """
-        if track < len(self.loops):
-            self.loops[track-1].press()
+        if self.ntrack_banks > 1 and self.track_bank_button in self.gestures.held:
+            # holding volume/gain/monitor: top row of tracks pages back, bottom row forward
+            self.page_tracks(-1 if track <= self.ntracks//2 else 1)
+            return
+
+        index = self.track_bank*self.ntracks + track-1 # the loop on this button
+        if track < self.ntracks:
+            self.loops[index].press()
 
         if self.mode == None:
-            if not self.loops[track-1].is_enabled and (track-2 < 0 or self.loops[track-2].is_enabled):
+            if not self.loops[index].is_enabled and (index-1 < 0 or self.loops[index-1].is_enabled):
                 print('   Creating new loop: {}'.format(self.nloops+1))
                 self.add_loop()
                 # must toggle again, since before it wouldn't have applied
-                self.loops[track-1].press()
+                self.loops[index].press()
 
         if self.mode in ['save', 'recall']:
+            if self.save_recall_button in self.gestures.held:
+                # holding save/recall: top row of tracks pages back, bottom row forward
+                self.page_sessions(-1 if track <= self.ntracks//2 else 1)
+                return
             session = self.session_manager.sessions[track-1]
+            index = self.session_manager.session_index(session.name)
             loop = None
             setting = None
         elif self.mode == 'settings':
@@ -407,13 +697,17 @@ class Looper:
                     print('   No setting associated with that track button.')
                 return
         else:
-            loop = self.loops[track-1]
-            if not self.loops[track-1].is_enabled:
+            loop = self.loops[index]
+            if not loop.is_enabled:
                 loop = None
             session = None
             setting = None
 
-        if self.mode == 'oneshot':
+        if self.mode == 'sampler':
+            # samples are loaded in the background (see Sampler.preload)
+            self.sampler.trigger(track-1)
+
+        elif self.mode == 'oneshot':
             # warning: once you hit this once, this loop will forever
             # be out of sync; this is because we cannot store the sync_pos
             # and then restore it later
@@ -459,26 +753,33 @@ class Looper:
                 print('   Loop index does not exist for {}'.format(self.mode))
 
         elif self.mode == 'save':
-            if not self.session_manager.exists(session.name) or session.pressed_once:
-                self.session_manager.save_session(session.name, self.loops)
+            if self.session_manager.is_saving(index):
+                print('   Still saving session at index {}'.format(index))
+            elif not self.session_manager.exists(index) or session.pressed_once:
+                self.session_manager.save_session(index, self.loops)
+                self.animator.start('save_progress', self.save_progress_frames(),
+                    SAVE_PROGRESS_FRAME_SECS, interruptible=False)
                 session.pressed_once = False
                 if self.verbose:
-                    print('   Saving session at index {}'.format(track-1))
+                    print('   Saving session at index {}'.format(index))
             else:
                 if self.verbose:
                     print('   Pressed track {} once for {}'.format(track, self.mode))
                 session.pressed_once = True
 
         elif self.mode == 'recall':
-            if self.session_manager.exists(session.name) and session.pressed_once:
-                self.recall_session(session)
+            if self.session_manager.exists(index) and session.pressed_once:
+                self.recall_session(index)
                 session.pressed_once = False
                 if self.verbose:
-                    print('   Loading session at index {}'.format(track-1))
+                    print('   Loading session at index {}'.format(index))
             elif not session.pressed_once:
                 if self.verbose:
                     print('   Pressed track {} once for {}'.format(track, self.mode))
                 session.pressed_once = True
+                if self.session_manager.exists(index):
+                    # get a head start on decompressing its audio
+                    self.session_manager.decompress_session(index)
             else:
                 print('   Saved session does not exist at track {}'.format(track))
 
@@ -499,23 +800,73 @@ class Looper:
             else:
                 # a track has already been selected,
                 # so here we set the volume of that selected track
-                slider_ratio = (track-1)*1.0/(len(self.loops)-1)
+                slider_ratio = (track-1)*1.0/(self.ntracks-1)
                 self.selected_track.set_volume(slider_ratio)
 
         elif self.mode == 'gain':
-            self.gain_slider = (track-1)*1.0/(len(self.loops)-1)
+            self.gain_slider = (track-1)*1.0/(self.ntracks-1)
             self.set_level('input_gain', self.gain_slider)
 
         elif self.mode == 'monitor':
-            self.monitor_slider = (track-1)*1.0/(len(self.loops)-1)
+            self.monitor_slider = (track-1)*1.0/(self.ntracks-1)
             self.set_level('dry', self.monitor_slider)
 
-    def recall_session(self, session):
+    def restore_mode_before_paging(self, modes=None):
+        """
+        pressing the button we held to page toggled the mode,
+        but we were just paging, so we go back to the mode we were in
+        (if it is one of modes, or any mode if modes is None)
+        """
+        if self.can_restore_mode and (modes is None or self.mode_before_paging in modes):
+            self.mode = self.mode_before_paging
+            if self.mode == 'volume':
+                self.selected_track = None
+            self.set_mode_colors_given_mode()
+        self.can_restore_mode = False
+
+    def visible_loops(self):
+        """
+        the loops in the bank of tracks being shown
+        """
+        return self.loops[self.track_bank*self.ntracks:(self.track_bank+1)*self.ntracks]
+
+    def loop_for_track(self, track):
+        return self.loops[self.track_bank*self.ntracks + track-1]
+
+    def page_tracks(self, step):
+        """
+        show the previous (step=-1) or next (step=1) bank of tracks;
+        loops in other banks keep playing (and recording) as before
+        """
+        self.restore_mode_before_paging()
+        for loop in self.visible_loops():
+            loop.is_pressed = False
+            loop.is_visible = False
+        self.track_bank = (self.track_bank + step) % self.ntrack_banks
+        for loop in self.visible_loops():
+            loop.is_visible = True
+        print('   Showing tracks {}-{}'.format(self.track_bank*self.ntracks + 1,
+            (self.track_bank+1)*self.ntracks))
+
+    def page_sessions(self, step):
+        """
+        show the previous (step=-1) or next (step=1) bank of sessions
+        """
+        self.restore_mode_before_paging(['save', 'recall'])
+        self.session_manager.page(step)
+        for session in self.session_manager.sessions:
+            session.pressed_once = False
+        print('   Showing sessions in bank {}'.format(self.session_manager.bank))
+
+    def recall_session(self, index):
         """
         when recalling a session, we have to make sure
-        we have the right number of loops
+        we have the right number of loops (once SL has been sent it,
+        which waits until its audio is decompressed)
         """
-        has_audio = self.session_manager.load_session(session.name)
+        self.session_manager.load_session(index, on_sent=self.set_loops_for_session)
+
+    def set_loops_for_session(self, has_audio):
         nloops = len(has_audio)
         # remove extra loops (internally)
         for loop in self.loops[nloops:]:
@@ -525,6 +876,7 @@ class Looper:
         for i,loop in enumerate(self.loops):
             if i < len(has_audio) and has_audio[i]:
                 loop.has_had_something_recorded = True
+        self.set_track_colors_given_mode()
 
     def initialize_settings(self):
         """
@@ -540,15 +892,14 @@ class Looper:
             button.init(self.loops)
 
     def lightshow(self):
+        """
+        the screensaver; it ends when the next button press calls init_looper()
+        """
         if self.verbose:
             print('Entering lightshow...')
-        try:
-            self.mode = 'lightshow'
-            self.interface.lightshow()
-            self.init_looper()
-        except KeyboardInterrupt:
-            # Properly close the system.
-            self.terminate()
+        self.mode = 'lightshow'
+        self.animator.start('lightshow', animations.lightshow(self.interface),
+            LIGHTSHOW_FRAME_SECS)
 
     def shutdown_pi(self):
         print('Shutting down!')
@@ -560,20 +911,57 @@ class Looper:
         self.terminate()
         subprocess.Popen(['sudo', 'reboot'])
 
-    def restart_jack_and_sl(self, nseconds_restart_delay=7):
-        print('Restarting jack and SL!')
+    def start_jack_and_sl(self):
         subprocess.Popen(['bash', os.path.join(BASE_PATH, 'startup.sh')])
-        for j in range(nseconds_restart_delay):
-            if j % 2 == 0:
-                color = 'red'
-            else:
-                color = 'off'
-            self.interface.set_color_all_buttons(color)
-            time.sleep(1)
-        # wait a generous amount of time for startup.sh to finish
+
+    def restart_jack_and_sl(self, restart_timeout=RESTART_TIMEOUT, start=None):
+        """
+        start (default: start_jack_and_sl) kicks off the restart;
+        this returns right away, and the buttons blink until SL is back
+        """
+        print('Restarting jack and SL!')
+        self.mode = 'restarting'
+        (start or self.start_jack_and_sl)()
+        self.animator.start('restart', self.restart_frames(restart_timeout),
+            RESTART_FRAME_SECS, interruptible=False)
+
+    def restart_frames(self, restart_timeout):
+        """
+        animation that blinks red twice a second while we wait for SL;
+        startup.sh kills SL, so we wait until it stops answering pings,
+        and then until the new one answers; then we start over
+        """
+        t_start = time.time()
+        was_down = False
+        ping = None
+        while time.time() - t_start < restart_timeout:
+            elapsed = time.time() - t_start
+            self.interface.set_color_all_buttons('red' if int(2*elapsed) % 2 == 0 else 'off')
+            # the reply is handled by refresh_if_loops_changed
+            if ping is None:
+                ping = self.sl_client.ping()
+                self.sl_client.flush()
+                t_ping = time.time()
+            elif ping.done():
+                if was_down:
+                    break
+                ping = None
+            elif time.time() - t_ping > PING_TIMEOUT:
+                # (a late reply to it doesn't count)
+                ping.cancel()
+                was_down = True
+                ping = None
+            yield
+        else:
+            print('WARNING: SL did not restart within {}s'.format(restart_timeout))
         # clear loops and start from scratch
         self.init_looper()
-        
+
+    def redraw_buttons(self):
+        self.interface.set_color_all_buttons('off')
+        self.set_mode_colors_given_mode()
+        self.set_track_colors_given_mode()
+
     def init_looper(self):
         # load empty session and set up loops
         self.init_loops()
@@ -584,64 +972,251 @@ class Looper:
         self.initialize_settings()
 
         # handle button colors
-        self.buttons_pressed = set()
-        self.interface.set_color_all_buttons('off')
-        self.set_mode_colors_given_mode()
+        self.gestures.reset()
+        self.redraw_buttons()
         self.time_last_pressed = time.time()
         if self.verbose:
             print('Looper on!')
+        if self.startup_timer is not None:
+            self.startup_timer.mark('init_looper')
+            self.startup_timer.print_report()
+            self.startup_timer = None
+
+    def start_startup_sweep(self):
+        """
+        sweep across the buttons (any press ends it early)
+        """
+        self.animator.start('startup', animations.sweep(self.interface, self.startup_color),
+            STARTUP_FRAME_SECS, on_done=self.redraw_buttons)
 
     def start(self):
         self.init_looper()
+        self.start_startup_sweep()
         try:
             while True:
-                self.interface.sync()
-                time.sleep(.02)
-                if int(time.time() - self.time_last_pressed) > self.screensaver_time_secs:
+                # returns at least once a second so we can check the screensaver
+                # (or sooner, when the next animation frame is due)
+                if self.sampler is not None and self.sampler.is_playing():
+                    timeout = SAMPLER_PUMP_INTERVAL
+                elif self.session_manager.is_busy():
+                    timeout = 0.25
+                else:
+                    timeout = 1.0
+                if self.gestures.is_timing():
+                    timeout = min(timeout, GESTURE_POLL_INTERVAL)
+                if self.animator.is_running():
+                    timeout = min(timeout, self.animator.time_until_next_frame())
+                self.interface.wait_for_input(timeout=timeout)
+                self.gestures.poll()
+                if self.sampler is not None:
+                    self.sampler.pump()
+                if latency.recorder is not None:
+                    latency.recorder.end_event()
+                self.refresh_if_loops_changed()
+                self.poll_save_jobs()
+                if self.animator.tick():
+                    self.interface.show()
+                if self.mode not in ['lightshow', 'restarting'] and \
+                    time.time() - self.time_last_pressed > self.screensaver_time_secs:
                     # turn on screensaver lightshow
-                    print((time.time(), self.time_last_pressed, time.time()-self.time_last_pressed, self.screensaver_time_secs))
                     self.lightshow()
         except KeyboardInterrupt:
             # Properly close the system.
             self.terminate()
 
+    def start_async(self):
+        """
+        like start(), but reading buttons, handling replies from SL,
+        the screensaver, and animations each run as separate tasks
+        on one asyncio event loop, so none of them block the others
+        """
+        try:
+            asyncio.run(self.run_async())
+        except KeyboardInterrupt:
+            # Properly close the system.
+            self.terminate()
+
+    async def run_async(self):
+        self.event_loop = asyncio.get_running_loop()
+        self.init_looper()
+        self.start_startup_sweep()
+        tasks = [self.input_task(), self.osc_task(), self.screensaver_task(),
+            self.animation_task()]
+        if self.sampler is not None:
+            tasks.append(self.sampler_task())
+        await asyncio.gather(*tasks)
+
+    async def input_task(self):
+        edge_source = getattr(self.interface, 'edge_source', None)
+        while True:
+            if edge_source is None:
+                self.interface.sync()
+                await asyncio.sleep(POLL_INTERVAL)
+            else:
+                # wait for the trellis INT line in a worker thread,
+                # but handle the buttons here on the event loop
+                has_events = await self.event_loop.run_in_executor(None,
+                    edge_source.wait, 1.0)
+                if has_events:
+                    self.interface.sync(edge_source.pending())
+                else:
+                    self.interface.show()
+            if latency.recorder is not None:
+                latency.recorder.end_event()
+
+    async def osc_task(self):
+        while True:
+            self.gestures.poll()
+            self.refresh_if_loops_changed()
+            self.poll_save_jobs()
+            await asyncio.sleep(OSC_PROCESS_INTERVAL)
+
+    async def sampler_task(self):
+        while True:
+            self.sampler.pump()
+            await asyncio.sleep(SAMPLER_PUMP_INTERVAL)
+
+    async def screensaver_task(self):
+        while True:
+            await asyncio.sleep(1)
+            if self.mode in ['lightshow', 'restarting']:
+                continue
+            if time.time() - self.time_last_pressed > self.screensaver_time_secs:
+                self.lightshow()
+
+    async def animation_task(self):
+        while True:
+            if self.animator.tick():
+                self.interface.show()
+            timeout = self.animator.time_until_next_frame()
+            await asyncio.sleep(animations.IDLE_INTERVAL if timeout is None else timeout)
+
     def terminate(self):
         if self.verbose:
             print()
             print('Ending looper...')
         self.pause()
+        if self.verbose and self.sl_client.use_cache:
+            print('OSC set() cache: {}'.format(self.sl_client.cache_stats()))
+        if latency.recorder is not None:
+            latency.recorder.print_report()
         self.sl_client.terminate()
+        self.session_manager.terminate()
+        if self.sampler is not None:
+            self.sampler.terminate()
+            if self.verbose:
+                print(self.sampler.stats())
         self.interface.terminate()
+        if self.event_recorder is not None:
+            self.event_recorder.close()
+            print('Recorded {} button events to {}'.format(
+                self.event_recorder.nevents, self.event_recorder.outfile))
         if self.verbose:
             print('See ya!')
 
 def main(args):
+    startup_timer = latency.StartupTimer(T_START)
+    startup_timer.mark('imports')
+
     # start jackd and sooperlooper, and wait until finished
     if args.startup:
         startup = subprocess.Popen(['bash', args.startup_script])
         startup.communicate()
+        startup_timer.mark('startup_script')
+
+    if args.latency:
+        # print a report on exit, or on 'kill -USR1 <pid>'
+        latency.enable()
 
     # connect to SooperLooper via OSC
     if args.verbose:
         print('Setting up Sooper Looper OSC client...')
-    sl_client = OscSooperLooper(client_url=args.osc_url,
-        empty_session=args.empty_session_file)
+    if len(args.engines) > 1:
+        # loops are spread across several SL engines
+        sl_client = EngineRouter(args.engines, args.loops_per_engine,
+            empty_session=args.empty_session_file,
+            use_cache=not args.no_osc_cache, reply_host=args.reply_host)
+    else:
+        client_url, client_port = parse_engine_url(args.engines[0] if args.engines else args.osc_url)
+        sl_client = OscSooperLooper(client_url=client_url, client_port=client_port,
+            empty_session=args.empty_session_file,
+            use_cache=not args.no_osc_cache, reply_host=args.reply_host)
+    startup_timer.mark('osc_client')
 
     # connect with either trellis PCB or keyboard
+    layout = LAYOUTS[args.layout]
+    if args.interface == 'keyboard' and args.layout != '4x4':
+        print("ERROR: The keyboard interface only has a 4x4 layout")
+        return
+    ntracks = len([name for name in layout['button_map'].values() if type(name) is int])
+    if ntracks*args.track_banks > MAX_LOOP_COUNT:
+        print("ERROR: At most {} loops ({} banks of {} tracks)".format(
+            MAX_LOOP_COUNT, MAX_LOOP_COUNT//ntracks, ntracks))
+        return
     if args.verbose:
         print('Initializing {} interface...'.format(args.interface))
     if args.interface == 'trellis':
-        interface = Trellis(startup_color=args.color)
+        try:
+            from trellis import Trellis, GPIOEdgeSource
+        except ImportError:
+            print("ERROR: Could not import Trellis. Try running 'sudo pip3 install adafruit-circuitpython-neotrellis'")
+            raise
+        if args.input_mode == 'interrupt':
+            edge_source = GPIOEdgeSource(args.int_pin)
+        else:
+            edge_source = None
+        interface = Trellis(debug=args.verbose,
+            edge_source=edge_source, addresses=layout['addresses'])
     elif args.interface == 'keyboard':
+        from keyboard import Keyboard
         interface = Keyboard(BUTTON_PRESSED, BUTTON_RELEASED)
+    elif args.interface == 'replay':
+        from replay import Replay
+        interface = Replay(args.replay_file, realtime=not args.fast_replay,
+            nbuttons=max(layout['button_map'])+1)
+    elif args.interface == 'web':
+        from web import WebInterface
+        nrows, ncols = layout['shape']
+        interface = WebInterface(BUTTON_PRESSED, BUTTON_RELEASED, nrows, ncols,
+            host=args.web_host, port=args.web_port, debug=args.verbose,
+            token=args.web_token)
     interface.set_color_map(COLOR_MAP)
-    
+    startup_timer.mark('interface')
+
+    if args.sample_name:
+        # nb: pygame's audio output has to be able to share the sound card with jack
+        from sampler_engine import Sampler
+        sampler = Sampler(args.sample_name, args.sample_dir,
+            args.sample_memory_mb, args.max_voices, args.steal, args.retrigger)
+        startup_timer.mark('sampler')
+    else:
+        sampler = None
+
+    if args.record_events:
+        from replay import EventRecorder
+        event_recorder = EventRecorder(args.record_events)
+    else:
+        event_recorder = None
     looper = Looper(sl_client=sl_client,
         interface=interface,
+        button_map=layout['button_map'],
+        settings_map=layout['settings_map'],
         session_dir=args.session_dir,
-        verbose=args.verbose)
+        startup_color=args.color,
+        verbose=args.verbose,
+        auto_update_ms=args.auto_update_ms,
+        event_recorder=event_recorder,
+        startup_timer=startup_timer if args.verbose else None,
+        sampler=sampler,
+        ntrack_banks=args.track_banks,
+        gesture_settings={'chord_window': args.chord_window,
+            'long_press_secs': args.long_press_secs})
+    startup_timer.mark('looper')
     try:
-        looper.start()
+        if args.runtime == 'asyncio':
+            looper.start_async()
+        else:
+            looper.start()
     except:
         looper.terminate()
         raise
@@ -657,13 +1232,69 @@ if __name__ == '__main__':
         dest='startup_script',
         default=os.path.join(BASE_PATH, 'startup.sh'))
     parser.add_argument('-i', '--interface',
-        choices=['keyboard', 'trellis'],
+        choices=['keyboard', 'trellis', 'replay', 'web'],
         default='trellis')
+    parser.add_argument('--web_host', type=str, default='127.0.0.1',
+        help='address to serve the web interface on (-i web); e.g., 0.0.0.0 for every machine on the LAN, which then needs a token')
+    parser.add_argument('--web_token', type=str, default=None,
+        help='token the web interface requires (-i web); made up for us if --web_host is not localhost')
+    parser.add_argument('--web_port', type=int, default=8080,
+        help='port to serve the web interface on (-i web)')
+    parser.add_argument('--record_events', type=str,
+        help='file to record button events to (for use with -i replay)')
+    parser.add_argument('--replay_file', type=str,
+        help='button events to play back with -i replay')
+    parser.add_argument('--fast_replay',
+        dest='fast_replay', action='store_true',
+        help='replay button events as fast as possible')
+    parser.add_argument('--runtime',
+        choices=['blocking', 'asyncio'], default='blocking',
+        help="asyncio runs input, OSC replies, and animations as separate tasks")
+    parser.add_argument('--input_mode',
+        choices=['poll', 'interrupt'], default='poll',
+        help="how to read the trellis: poll every 20ms, or wait on its INT line")
+    parser.add_argument('--int_pin', type=int, nargs='+', default=[5],
+        help="BCM pin connected to the trellis INT line (for --input_mode interrupt); with several boards, give one pin per board to only read boards with events")
+    parser.add_argument('--layout', choices=list(LAYOUTS), default='4x4',
+        help="4x4 (one trellis board), or 8x8 (four boards, tiled)")
     parser.add_argument('-c', '--color', type=str,
         choices=['purple', 'red', 'gray', 'green',
         'blue', 'orange', 'random'], default='random')
     parser.add_argument('-o', '--osc_url', type=str,
         default='127.0.0.1')
+    parser.add_argument('--engines', type=str, nargs='+', default=[],
+        help='host:port of each SL engine to spread loops across (e.g., 127.0.0.1:9951 127.0.0.1:9952)')
+    parser.add_argument('--reply_host', type=str, default=None,
+        help='address SL should send replies to (default: our address on the route to each engine)')
+    parser.add_argument('--loops_per_engine', type=int, default=LOOPS_PER_ENGINE,
+        help='loops on each SL engine, when using --engines')
+    parser.add_argument('--no_osc_cache',
+        dest='no_osc_cache', action='store_true',
+        help='always send parameter values to SL, even if unchanged')
+    parser.add_argument('--latency',
+        dest='latency', action='store_true',
+        help='record latency from button press to OSC send and LED write')
+    parser.add_argument('--auto_update_ms', type=int, default=100,
+        help='interval for state updates from SL (0 to turn off)')
+    parser.add_argument('--track_banks', type=int, default=1,
+        help="banks of loops on the track buttons (hold 'volume/gain/monitor' and press a track to page)")
+    parser.add_argument('--chord_window', type=float, default=CHORD_WINDOW_SECS,
+        help='seconds within which all buttons of a chord must be pressed')
+    parser.add_argument('--long_press_secs', type=float, default=LONG_PRESS_SECS)
+    parser.add_argument('--sample_name', type=str,
+        help="kit in static/samples to play in sampler mode (press 'oneshot' twice)")
+    parser.add_argument('--sample_dir', type=str,
+        default=os.path.join(BASE_PATH, 'static', 'samples'))
+    parser.add_argument('--sample_memory_mb', type=float, default=64,
+        help='how much RAM decoded samples can use')
+    parser.add_argument('--max_voices', type=int, default=16,
+        help='how many samples can play at once in sampler mode')
+    parser.add_argument('--steal', type=str, default='oldest',
+        choices=['oldest', 'quietest'],
+        help='which voice to cut off once --max_voices are playing')
+    parser.add_argument('--retrigger', type=str, default='restart',
+        choices=['restart', 'layer'],
+        help="whether pressing a pad that is playing restarts it or plays over it")
     parser.add_argument('--session_dir', type=str,
         default=os.path.join(BASE_PATH, 'static', 'saved_sessions'))
     parser.add_argument('--empty_session_file', type=str,
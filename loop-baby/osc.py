@@ -1,6 +1,10 @@
 import time
-import numpy as np
+import math
+import socket
+import latency
+from concurrent.futures import Future
 from osc4py3.as_eventloop import *
+from osc4py3 import as_eventloop
 from osc4py3 import oscbuildparse
 from osc4py3 import oscmethod as osm
 
@@ -11,21 +15,55 @@ OSC_SERVER_URL = "0.0.0.0"
 OSC_SERVER_PORT = 7777
 OSC_SERVER_NAME = 'sooperlooper_server'
 
-MAX_LOOP_COUNT = 8
+MAX_LOOP_COUNT = 32 # e.g., four banks of eight tracks (see --track_banks)
 MINIMUM_LOOP_DURATION = 60 # seconds
 MONO, STEREO = (1, 2)
+PING_TIMEOUT = 0.25 # seconds to wait for each reply when probing SL
+STALE_PING_SECS = 10.0 # pings unanswered for this long are given up on (see ping)
+HEALTH_CHECK_INTERVAL = 2.0 # seconds between pings while running (see check_health)
+AUTO_UPDATE_CONTROLS = ['state', 'loop_pos', 'loop_len', 'cycle_len']
+AUTO_UPDATE_INTERVAL_MS = 100 # nb: SL currently always uses 100ms
 
 def slider_ratio_to_gain_ratio(slider_ratio):
-    gr = np.power(2.0,(np.sqrt(np.sqrt(np.sqrt(slider_ratio)))*198.0-198.0)/6.0)
-    return 0.0 if np.isclose(gr, 0.0) else float(gr)
+    gr = math.pow(2.0,(math.sqrt(math.sqrt(math.sqrt(slider_ratio)))*198.0-198.0)/6.0)
+    return 0.0 if math.isclose(gr, 0.0, abs_tol=1e-8) else gr
 
 def gain_ratio_to_slider_ratio(gain_ratio):
-    sr = np.power((6.0*np.log(gain_ratio)/np.log(2.0)+198.0)/198.0, 8.0)
-    return float(sr)
+    if gain_ratio <= 0.0:
+        return 0.0
+    sr = math.pow((6.0*math.log2(gain_ratio)+198.0)/198.0, 8.0)
+    return sr
+
+def osc_process_all():
+    """
+    osc_process only handles one socket event per call (it gives the socket
+    monitor a deadline of 0, which has always passed), so when a reply
+    from SL is waiting, what we send only goes out on the next call;
+    this keeps calling it until every ready event has been handled
+    """
+    osc_process()
+    monitor = as_eventloop.select_monitor
+    while monitor is not None and monitor.pending:
+        osc_process()
+
+def local_address_for(host, port=OSC_CLIENT_PORT):
+    """
+    the address of this machine that host can reach us at, e.g.,
+    our LAN address for an SL on another box, or 127.0.0.1 for a local one
+    (connecting a UDP socket sends nothing, but picks the route)
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect((host, port))
+            return s.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
 
 class OscBase:
+    nclients = 0 # osc4py3 is shared by every client in this process
+
     def __init__(self, client_url=OSC_CLIENT_URL, client_port=OSC_CLIENT_PORT, client_name=OSC_CLIENT_NAME, server_url=OSC_SERVER_URL, server_port=OSC_SERVER_PORT, server_name=OSC_SERVER_NAME,
-        empty_session=None):
+        empty_session=None, reply_host=None):
 
         self.client_url = client_url
         self.client_port = client_port
@@ -33,9 +71,17 @@ class OscBase:
         self.server_url = server_url
         self.server_port = server_port
         self.server_name = server_name
+        # where SL sends replies; we listen on server_url (every interface,
+        # by default), but SL needs an address that reaches us
+        self.reply_host = reply_host or local_address_for(client_url, client_port)
         self.empty_session = empty_session # .slsess
 
+        # messages collected by an open bundle (see OscBundle)
+        self.pending = None
+        self.pending_timetag = None
+
         osc_startup()
+        OscBase.nclients += 1
         self.make_client()
         self.make_server()
 
@@ -44,17 +90,60 @@ class OscBase:
         osc_udp_client(self.client_url, self.client_port, self.client_name)
 
     def make_server(self):
-        self.return_url = "osc.udp://{}:{}".format(self.server_url, self.server_port)
+        self.return_url = "osc.udp://{}:{}".format(self.reply_host, self.server_port)
 
         # receives messages from self or sooperlooper
         osc_udp_server(self.server_url, self.server_port, self.server_name)
 
     def terminate(self):
-        osc_terminate()
+        self.flush()
+        OscBase.nclients -= 1
+        if OscBase.nclients <= 0:
+            osc_terminate()
+
+    def process(self):
+        """
+        handle any messages received from SL (e.g., replies to /get or /ping)
+        """
+        osc_process_all()
+
+    def bundle(self, timetag=None):
+        """
+        returns a context manager that collects all messages sent
+        inside of it and sends them as one osc bundle on exit
+        """
+        return OscBundle(self, timetag)
+
+    def flush(self):
+        """
+        send any messages collected by an open bundle right away
+        (the bundle stays open for subsequent messages)
+        """
+        if not self.pending:
+            return
+        msgs = self.pending
+        self.pending = []
+        if len(msgs) == 1 and self.pending_timetag is None:
+            msg = msgs[0]
+        else:
+            if self.pending_timetag is None:
+                timetag = oscbuildparse.OSC_IMMEDIATELY
+            else:
+                timetag = oscbuildparse.unixtime2timetag(self.pending_timetag)
+            msg = oscbuildparse.OSCBundle(timetag, msgs)
+        osc_send(msg, self.client_name)
+        if latency.recorder is not None:
+            latency.recorder.mark('osc_send')
+        osc_process_all()
 
     def _send_message(self, msg):
+        if self.pending is not None:
+            self.pending.append(msg)
+            return
         osc_send(msg, self.client_name)
-        osc_process()
+        if latency.recorder is not None:
+            latency.recorder.mark('osc_send')
+        osc_process_all()
 
     def handle_osc_message(self, address, *args):
         """
@@ -63,13 +152,80 @@ class OscBase:
         """
         print('received msg to: {}; msg = {}'.format(address, *args))
 
+class OscBundle:
+    """
+    collects messages sent by an OscBase client, e.g.:
+        with sl_client.bundle():
+            sl_client.hit('trigger', -1)
+            sl_client.hit('mute', 2)
+    so that SL receives them in one datagram and applies them together
+
+    timetag is a unix time (e.g., time.time() + 0.01) at which SL
+    should apply the bundle; if None, it is applied immediately.
+    nested bundles are merged into the outermost one.
+    """
+    def __init__(self, client, timetag=None):
+        self.client = client
+        self.timetag = timetag
+        self.is_outermost = False
+
+    def __enter__(self):
+        if self.client.pending is None:
+            self.client.pending = []
+            self.client.pending_timetag = self.timetag
+            self.is_outermost = True
+        return self
+
+    def __exit__(self, *args):
+        if not self.is_outermost:
+            return
+        try:
+            self.client.flush()
+        finally:
+            self.client.pending = None
+            self.client.pending_timetag = None
+
+class LoopState:
+    """
+    what SL last reported about one loop
+    (positions and lengths are in seconds)
+    """
+    __slots__ = ['state', 'loop_pos', 'loop_len', 'cycle_len']
+
+    def __init__(self):
+        self.state = 'unknown'
+        self.loop_pos = 0.0
+        self.loop_len = 0.0
+        self.cycle_len = 0.0
+
+    def __repr__(self):
+        return 'LoopState({}, pos={:.2f}, len={:.2f}, cycle={:.2f})'.format(
+            self.state, self.loop_pos, self.loop_len, self.cycle_len)
+
 class OscSooperLooper(OscBase):
-    def __init__(self, *args, **kwargs):
+    # see EngineRouter, for spreading loops across several SL engines
+    loops_per_engine = MAX_LOOP_COUNT
+
+    def __init__(self, *args, use_cache=True, reply_prefix='', **kwargs):
         super().__init__(*args, **kwargs)
 
-        osc_method("/ping", self.handle_osc_message,
+        # replies from SL go to paths starting with reply_prefix, e.g.,
+        # "/engine_1/get"; osc4py3 dispatches replies from every server
+        # to the same handlers, so each SL engine needs its own prefix
+        self.reply_prefix = reply_prefix
+
+        # nb: SL sends errors to /ping, and replies to our pings to /pong/<ping id>
+        osc_method(self.reply_path("/ping"), self.handle_osc_message,
+            argscheme=osm.OSCARG_ADDRESS + osm.OSCARG_DATA)
+        osc_method(self.reply_path("/pong/*"), self.handle_pong,
+            argscheme=osm.OSCARG_ADDRESS + osm.OSCARG_DATA)
+        osc_method(self.reply_path("/get"), self.handle_get,
             argscheme=osm.OSCARG_ADDRESS + osm.OSCARG_DATA)
-        osc_method("/get", self.handle_get,
+        osc_method(self.reply_path("/update"), self.handle_update,
+            argscheme=osm.OSCARG_ADDRESS + osm.OSCARG_DATA)
+        osc_method(self.reply_path("/loop_count"), self.handle_loop_count,
+            argscheme=osm.OSCARG_ADDRESS + osm.OSCARG_DATA)
+        osc_method(self.reply_path("/write_error/*"), self.handle_write_error,
             argscheme=osm.OSCARG_ADDRESS + osm.OSCARG_DATA)
 
         self.actions = ["record", "overdub", "multiply", "insert",
@@ -100,15 +256,167 @@ class OscSooperLooper(OscBase):
         self.state = 'off'
         self.verbose = False
 
+        # last value sent to SL for each (param, loop), used by set()
+        # to skip writes that SL already holds; use_cache=False always sends
+        self.use_cache = use_cache
+        self.cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # per-loop state, kept current by SL once enable_auto_updates is called
+        self.loop_states = {}
+        self.auto_update_interval = None
+        self.loop_states_changed = False # set when a loop changes state
+
+        # ping id -> (Future returned by ping(), time sent), until it's answered
+        self.nping_ids = 0
+        self.ping_futures = {}
+
+        # errors from SL for each save, keyed by the id from new_write_id()
+        self.nwrites = 0
+        self.write_errors = {}
+
+        # whether SL is answering: 'unknown', 'up', or 'down' (see probe and check_health)
+        self.health = 'unknown'
+        self.health_ping = None # the last ping sent by check_health
+        self.t_health_ping = 0
+        self.time_last_reply = None
+        self.nloops = None # SL's loop count, as of its last reply
+
+    def reply_path(self, path):
+        return self.reply_prefix + path
+
+    def session_files(self, outfile):
+        """
+        the files that save_session writes (one per SL engine)
+        """
+        return [outfile]
+
+    def invalidate_cache(self):
+        """
+        forget all values sent to SL (e.g., after SL loads a session)
+        """
+        self.cache = {}
+
+    def cache_stats(self):
+        return {'hits': self.cache_hits, 'misses': self.cache_misses,
+            'size': len(self.cache)}
+
     def handle_get(self, address, *args):
         if not args or len(args[0]) != 3:
-            print('Unexpected get: {}'.format(*args))
-        kind = args[0][1]
+            print('Unexpected get: {}'.format(args))
+            return
+        loop, kind, value = args[0]
         if kind == 'state':
-            self.state = self.state_lookup.get(args[0][2])
-            print('state: {}, value: {}'.format(self.state, args[0][2]))
+            self.state = self.state_lookup.get(value)
+            print('state: {}, value: {}'.format(self.state, value))
         else:
-            print('{}: {}'.format(kind, args[0][2]))
+            print('{}: {}'.format(kind, value))
+        if kind in AUTO_UPDATE_CONTROLS and loop >= 0:
+            self.update_loop_state(loop, kind, value)
+
+    def handle_update(self, address, *args):
+        """
+        sent by SL (see enable_auto_updates) when a control changes:
+            i:loop_index  s:control  f:value
+        """
+        if not args or len(args[0]) != 3:
+            print('Unexpected update: {}'.format(*args))
+            return
+        loop, kind, value = args[0]
+        self.update_loop_state(loop, kind, value)
+
+    def handle_loop_count(self, address, *args):
+        """
+        sent by SL whenever the number of loops changes:
+            s:hosturl  s:version  i:loopcount
+        new loops must be registered for updates
+        """
+        if not args or len(args[0]) != 3:
+            print('Unexpected loop count: {}'.format(*args))
+            return
+        nloops = args[0][2]
+        self.nloops = nloops
+        for loop in list(self.loop_states):
+            if loop >= nloops:
+                self.loop_states.pop(loop)
+        if self.auto_update_interval is not None:
+            self.register_auto_updates()
+
+    def handle_pong(self, address, *args):
+        """
+        SL's reply to ping(), e.g.:
+            /pong/3  s:hosturl  s:version  i:loopcount
+        only resolves that ping's future, so a late reply to an earlier
+        ping can't answer a newer one
+        """
+        if not args or len(args[0]) != 3:
+            print('Unexpected ping reply: {}'.format(*args))
+            return
+        nloops = args[0][2]
+        self.nloops = nloops
+        self.time_last_reply = time.monotonic()
+        future, t_sent = self.ping_futures.pop(int(address.rsplit('/', 1)[1]), (None, None))
+        if future is not None and not future.done():
+            future.set_result(nloops)
+
+    def new_write_id(self):
+        """
+        returns a unique id for a save, so that we know which save
+        any error from SL refers to (see handle_write_error)
+        """
+        self.nwrites += 1
+        return self.nwrites
+
+    def handle_write_error(self, address, *args):
+        """
+        SL only replies to a save if it fails, e.g.:
+            /write_error/3  s:"Loop Save Failed"
+        """
+        write_id = int(address.rsplit('/', 1)[1])
+        self.write_errors[write_id] = args[0] if args else ''
+        print('Error saving ({}): {}'.format(write_id, self.write_errors[write_id]))
+
+    def update_loop_state(self, loop, kind, value):
+        if loop not in self.loop_states:
+            self.loop_states[loop] = LoopState()
+        loop_state = self.loop_states[loop]
+        if kind == 'state':
+            value = self.state_lookup.get(int(value), 'unknown')
+            if value != loop_state.state:
+                self.loop_states_changed = True
+        elif kind == 'loop_len' and (value > 0) != (loop_state.loop_len > 0):
+            # loop just got (or lost) audio
+            self.loop_states_changed = True
+        setattr(loop_state, kind, value)
+
+    def loop_state(self, loop):
+        """
+        returns what SL last reported for this loop,
+        or None if we are not getting updates for it
+        """
+        return self.loop_states.get(loop)
+
+    def enable_auto_updates(self, interval_ms=AUTO_UPDATE_INTERVAL_MS):
+        """
+        ask SL to send us the state, position, and lengths of every loop
+        whenever they change, at most once per interval_ms
+        """
+        self.auto_update_interval = interval_ms
+        # SL tells us when loops are added/removed, so we can register them
+        msg = oscbuildparse.OSCMessage("/register", None,
+            [self.return_url, self.reply_path("/loop_count")])
+        self._send_message(msg)
+        self.register_auto_updates()
+
+    def register_auto_updates(self, loop=-1):
+        """
+        /sl/#/register_auto_update  s:ctrl i:ms_interval s:returl s:retpath
+        """
+        for ctrl in AUTO_UPDATE_CONTROLS:
+            msg = oscbuildparse.OSCMessage("/sl/{}/register_auto_update".format(loop),
+                None, [ctrl, self.auto_update_interval, self.return_url, self.reply_path("/update")])
+            self._send_message(msg)
 
     def hit(self, action, loop=-3):
         """
@@ -138,11 +446,11 @@ class OscSooperLooper(OscBase):
         """
         if loop is None:
             msg = oscbuildparse.OSCMessage("/get",
-                None, [param, self.return_url, "/get"])
+                None, [param, self.return_url, self.reply_path("/get")])
         else:
             assert loop >= -3 and loop <= MAX_LOOP_COUNT-1
             msg = oscbuildparse.OSCMessage("/sl/{}/get".format(loop),
-                None, [param, self.return_url, "/get"])
+                None, [param, self.return_url, self.reply_path("/get")])
         self._send_message(msg)
 
     def set(self, param, value, loop=None):
@@ -154,10 +462,25 @@ class OscSooperLooper(OscBase):
             assert value >= -3 and value <= MAX_LOOP_COUNT
         if param == 'selected_loop_num':
             assert value >= 0 and value <= MAX_LOOP_COUNT-1
+        if loop is not None:
+            assert loop >= -3 and loop <= MAX_LOOP_COUNT-1
+        if self.use_cache:
+            if loop is not None and loop < 0:
+                # applies to several loops, so we can't skip it,
+                # and we no longer know what each loop holds
+                for key in [k for k in self.cache if k[0] == param and k[1] is not None]:
+                    self.cache.pop(key)
+            elif self.cache.get((param, loop)) == value:
+                self.cache_hits += 1
+                if self.verbose:
+                    print("Set param={}, value={}, loop={} (cached)".format(param, value, loop))
+                return
+            else:
+                self.cache[(param, loop)] = value
+            self.cache_misses += 1
         if loop is None:
             msg = oscbuildparse.OSCMessage("/set", None, [param, value])
         else:
-            assert loop >= -3 and loop <= MAX_LOOP_COUNT-1
             msg = oscbuildparse.OSCMessage("/sl/{}/set".format(loop),
                 None, [param, value])
         if self.verbose:
@@ -172,30 +495,46 @@ class OscSooperLooper(OscBase):
             print('No empty session file (.slsess) was found.')
             return
         print('Loading empty session from file: {}'.format(self.empty_session))
+        self.invalidate_cache()
+        self.loop_states = {}
         msg = oscbuildparse.OSCMessage("/load_session", None,
-            [self.empty_session, self.return_url, "/ping"])
+            [self.empty_session, self.return_url, self.reply_path("/ping")])
         self._send_message(msg)
+        if self.auto_update_interval is not None:
+            # the session's loops replace ours, so register them too
+            self.register_auto_updates()
 
     def load_session(self, infile):
         """
         /load_session   s:filename  s:return_url  s:error_path
         """
         print('Loading session from file: {}'.format(infile))
+        self.invalidate_cache()
+        self.loop_states = {}
         msg = oscbuildparse.OSCMessage("/load_session", None,
-            [infile, self.return_url, "/ping"])
+            [infile, self.return_url, self.reply_path("/ping")])
         self._send_message(msg)
+        if self.auto_update_interval is not None:
+            # the session's loops replace ours, so register them too
+            self.register_auto_updates()
+
+    def error_path(self, write_id):
+        if write_id is None:
+            return self.reply_path("/ping")
+        return self.reply_path("/write_error/{}".format(write_id))
 
-    def save_session(self, outfile):
+    def save_session(self, outfile, write_id=None):
         """
         /save_session   s:filename  s:return_url  s:error_path
         saves current session description to filename.
+        if write_id is given, any error is stored in self.write_errors
         """
         print('Saving session to file: {}'.format(outfile))
         msg = oscbuildparse.OSCMessage("/save_session", None,
-            [outfile, self.return_url, "/ping"])
+            [outfile, self.return_url, self.error_path(write_id)])
         self._send_message(msg)
 
-    def save_loop_audio(self, index, outfile):
+    def save_loop_audio(self, index, outfile, write_id=None):
         """
         /sl/#/save_loop   s:filename  s:format  s:endian  s:return_url  s:error_path
        saves current loop to given filename, may return error to error_path
@@ -203,13 +542,15 @@ class OscSooperLooper(OscBase):
         """
         print('Saving audio in loop {} to file: {}'.format(index, outfile))
         msg = oscbuildparse.OSCMessage("/sl/{}/save_loop".format(index),
-            None, [outfile, '', '', self.return_url, "/ping"])
+            None, [outfile, '', '', self.return_url, self.error_path(write_id)])
         self._send_message(msg)
 
     def add_loop(self):
         """
         /loop_add  i:#channels  f:min_length_seconds
         """
+        # the new loop starts with SL's defaults
+        self.invalidate_cache()
         msg = oscbuildparse.OSCMessage("/loop_add", None,
             [STEREO, MINIMUM_LOOP_DURATION])
         self._send_message(msg)
@@ -220,6 +561,89 @@ class OscSooperLooper(OscBase):
          If engine is there, it will respond with to the given URL and PATH
           with an OSC message with arguments:
              s:hosturl  s:version  i:loopcount
+        returns a Future whose result will be SL's loopcount
+        (cancel it to give up on the reply; pings unanswered after
+        STALE_PING_SECS are cancelled for us)
         """
-        msg = oscbuildparse.OSCMessage("/ping", None, [self.return_url, "/ping"])
+        now = time.monotonic()
+        for ping_id, (future, t_sent) in list(self.ping_futures.items()):
+            if future.done() or now - t_sent > STALE_PING_SECS:
+                future.cancel()
+                self.ping_futures.pop(ping_id)
+        self.nping_ids += 1
+        future = Future()
+        self.ping_futures[self.nping_ids] = (future, now)
+        msg = oscbuildparse.OSCMessage("/ping", None,
+            [self.return_url, self.reply_path("/pong/{}".format(self.nping_ids))])
         self._send_message(msg)
+        return future
+
+    def wait_for_reply(self, future, timeout=PING_TIMEOUT):
+        """
+        handle incoming messages until future is done, or until timeout
+        (when we cancel it); returns True if the future is done
+        """
+        t_end = time.monotonic() + timeout
+        while not future.done():
+            if time.monotonic() > t_end:
+                future.cancel()
+                return False
+            self.process()
+            time.sleep(0.001)
+        return True
+
+    def probe(self, timeout=PING_TIMEOUT):
+        """
+        returns SL's loopcount, or None if SL doesn't answer within timeout
+        """
+        future = self.ping()
+        self.flush() # in case we are inside a bundle
+        if not self.wait_for_reply(future, timeout):
+            self.health = 'down'
+            return None
+        self.health = 'up'
+        return future.result()
+
+    def check_health(self, interval=HEALTH_CHECK_INTERVAL):
+        """
+        call often while running: every interval seconds, SL is 'down' if it
+        hasn't answered the last ping, and we ping it again (without waiting);
+        returns True if its health changed
+        """
+        now = time.monotonic()
+        if now - self.t_health_ping < interval:
+            return False
+        changed = False
+        if self.health_ping is not None:
+            is_answered = self.health_ping.done() and not self.health_ping.cancelled()
+            health = 'up' if is_answered else 'down'
+            self.health_ping.cancel() # a reply after this doesn't count
+            changed = health != self.health
+            if changed:
+                print('SL at {}:{} is {}'.format(self.client_url, self.client_port, health))
+            self.health = health
+        self.health_ping = self.ping()
+        self.t_health_ping = now
+        return changed
+
+    def is_ready(self, expected_nloops=None, timeout=PING_TIMEOUT):
+        """
+        returns True if SL answers a ping within timeout,
+        and (if expected_nloops is given) has that many loops
+        """
+        nloops = self.probe(timeout)
+        if nloops is None:
+            return False
+        return expected_nloops is None or nloops == expected_nloops
+
+    def wait_until_ready(self, expected_nloops=None, timeout=10.0):
+        """
+        ping SL until it is ready (see is_ready); returns False
+        if it still isn't ready after timeout seconds
+        """
+        t_end = time.monotonic() + timeout
+        while time.monotonic() < t_end:
+            if self.is_ready(expected_nloops, min(PING_TIMEOUT, t_end - time.monotonic())):
+                return True
+            time.sleep(0.01)
+        return False
@@ -0,0 +1,124 @@
+import time
+import atexit
+import struct
+
+# each event is stored as (seconds since recording began, button number, edge)
+LOG_HEADER = b'LOOPBABY-EVENTS-1\n'
+EVENT_FORMAT = struct.Struct('<dBB')
+
+class Event:
+    def __init__(self, number, edge, t):
+        self.number = number
+        self.edge = edge
+        self.time = t
+
+class EventRecorder:
+    """
+    writes button events to a compact binary log, for replaying later;
+    each event is flushed as it is written (there are only a few per second),
+    so the log survives the looper crashing or being killed
+    """
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.f = open(outfile, 'wb')
+        self.f.write(LOG_HEADER)
+        self.f.flush()
+        self.t_start = time.monotonic()
+        self.nevents = 0
+        atexit.register(self.close)
+
+    def record(self, event):
+        self.f.write(EVENT_FORMAT.pack(time.monotonic() - self.t_start,
+            event.number, event.edge))
+        self.f.flush()
+        self.nevents += 1
+
+    def close(self):
+        if not self.f.closed:
+            self.f.close()
+        atexit.unregister(self.close)
+
+def read_event_log(infile):
+    """
+    returns a list of (timestamp, number, edge)
+    """
+    with open(infile, 'rb') as f:
+        data = f.read()
+    if not data.startswith(LOG_HEADER):
+        raise Exception('Not a button event log: {}'.format(infile))
+    return list(EVENT_FORMAT.iter_unpack(data[len(LOG_HEADER):]))
+
+class Replay:
+    """
+    an interface (like Trellis or Keyboard) that plays back
+    a button event log recorded with EventRecorder;
+    if realtime is False, events are sent as fast as possible
+    (one per sync) so that we can benchmark the looper
+    """
+    def __init__(self, infile, realtime=True, nbuttons=16):
+        self.infile = infile
+        self.events = read_event_log(infile)
+        self.realtime = realtime
+        self.nbuttons = nbuttons
+        self.callbacks = [None]*nbuttons
+        self.color_map = {}
+        self.colors = [None]*nbuttons
+        self.index = 0
+        self.t_start = None
+        self.ncolor_writes = 0 # calls to set_color
+        self.npixels_changed = 0 # calls that actually changed a color
+
+    def set_callback(self, fcn):
+        self.callbacks = [fcn for i in range(self.nbuttons)]
+
+    def set_color_map(self, color_map):
+        self.color_map = color_map
+
+    def sync(self):
+        if self.t_start is None:
+            self.t_start = time.monotonic()
+        if self.index >= len(self.events):
+            print('Replayed {} events in {:0.3f}s'.format(len(self.events),
+                time.monotonic() - self.t_start))
+            raise KeyboardInterrupt
+        if self.realtime:
+            elapsed = time.monotonic() - self.t_start
+            while self.index < len(self.events) and self.events[self.index][0] <= elapsed:
+                self.send(self.events[self.index])
+        else:
+            self.send(self.events[self.index])
+
+    def send(self, log_entry):
+        t, number, edge = log_entry
+        self.index += 1
+        # when the event happened, as if the recording began when we did,
+        # so that gestures (and debouncing) see the same timing
+        # whether or not we are replaying as fast as possible
+        self.callbacks[number](Event(number, edge, self.t_start + t))
+
+    def wait_for_input(self, timeout=None):
+        if self.realtime:
+            time.sleep(.02)
+        self.sync()
+
+    def set_color_all_buttons(self, color):
+        for i in range(self.nbuttons):
+            self.set_color(i, color)
+
+    def set_color(self, index, color):
+        if color in self.color_map:
+            color = self.color_map[color]
+        self.ncolor_writes += 1
+        if self.colors[index] != color:
+            self.colors[index] = color
+            self.npixels_changed += 1
+
+    def set_rgb(self, index, rgb):
+        self.set_color(index, rgb)
+
+    def show(self):
+        pass
+
+    def terminate(self):
+        print('Replay: {} color writes, {} changed a button'.format(
+            self.ncolor_writes, self.npixels_changed))
@@ -0,0 +1,231 @@
+import os
+os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
+import glob
+import wave
+import threading
+from collections import OrderedDict
+import pygame
+
+from compression import read_wav, WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT
+
+# the format we open the mixer with, and convert samples to on disk,
+# so that pygame never has to resample when loading a sample
+MIXER_FREQUENCY = 22050
+MIXER_SIZE = -16
+MIXER_CHANNELS = 2
+MIXER_BUFFER = 512
+
+SAMPLE_DIR = 'static/samples'
+CONVERTED_DIR = '.converted' # inside each kit's folder
+MEMORY_BUDGET_MB = 64 # decoded samples kept in RAM
+
+def init_mixer():
+    # source: https://stackoverflow.com/questions/18273722/pygame-sound-delay
+    # init(frequency, size, channels, buffer)
+    pygame.mixer.pre_init(MIXER_FREQUENCY, MIXER_SIZE, MIXER_CHANNELS, MIXER_BUFFER)
+    pygame.init()
+    pygame.mixer.quit()
+    pygame.mixer.init(MIXER_FREQUENCY, MIXER_SIZE, MIXER_CHANNELS, MIXER_BUFFER)
+
+def convert_wav(infile, outfile, rate=MIXER_FREQUENCY, nchannels=MIXER_CHANNELS):
+    """
+    writes infile as a 16-bit WAV with the given rate and channels
+    (linear interpolation, which is fine for one-shot samples)
+    """
+    import numpy as np
+    audio_format, in_nchannels, in_rate, bits, data = read_wav(infile)
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT and bits in [32, 64]:
+        samples = np.frombuffer(data, dtype='<f{}'.format(bits//8)).astype('f4')
+    elif audio_format == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(data, dtype='u1').astype('f4') - 128)/128.0
+    elif audio_format == WAVE_FORMAT_PCM and bits in [16, 32]:
+        samples = np.frombuffer(data, dtype='<i{}'.format(bits//8)).astype('f4')/2**(bits-1)
+    elif audio_format == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(data[:len(data) - len(data) % 3], dtype='u1').reshape(-1, 3)
+        ints = (raw[:,0].astype('i4') | (raw[:,1].astype('i4') << 8) | (raw[:,2].astype('i4') << 16))
+        samples = (np.where(ints >= 2**23, ints - 2**24, ints)).astype('f4')/2**23
+    else:
+        raise Exception('Unsupported WAV format ({}, {} bits): {}'.format(audio_format, bits, infile))
+    samples = samples[:len(samples) - len(samples) % in_nchannels].reshape(-1, in_nchannels)
+
+    # match channels: average down to mono, or repeat mono
+    if in_nchannels != nchannels:
+        mono = samples.mean(axis=1, keepdims=True)
+        samples = np.repeat(mono, nchannels, axis=1)
+    if in_rate != rate and len(samples) > 1:
+        nframes = int(round(len(samples)*rate/in_rate))
+        t_out = np.arange(nframes)*(in_rate/rate)
+        t_in = np.arange(len(samples))
+        samples = np.stack([np.interp(t_out, t_in, samples[:,c]) for c in range(nchannels)], axis=1)
+    data = np.clip(np.round(samples*32767), -32768, 32767).astype('<i2').tobytes()
+
+    os.makedirs(os.path.dirname(outfile), exist_ok=True)
+    tmpfile = outfile + '.tmp'
+    w = wave.open(tmpfile, 'wb')
+    w.setnchannels(nchannels)
+    w.setsampwidth(2)
+    w.setframerate(rate)
+    w.writeframes(data)
+    w.close()
+    os.replace(tmpfile, outfile)
+    return outfile
+
+class SampleCache:
+    """
+    loads a kit of samples (static/samples/<name>/*.wav) as they are needed:
+    each sample is decoded on first use (or by preload, in the background),
+    and the least recently used ones are dropped once the decoded samples
+    take up more than memory_budget_mb; samples are first converted
+    to the mixer's format, and kept in <name>/.converted on disk
+    if as_arrays is True, samples are float32 arrays (for SamplerEngine),
+    rather than pygame.mixer.Sound objects
+    """
+    def __init__(self, sample_name, sample_dir=SAMPLE_DIR, memory_budget_mb=MEMORY_BUDGET_MB,
+        as_arrays=False):
+        self.sample_name = sample_name
+        self.kit_dir = os.path.join(sample_dir, sample_name)
+        self.soundfiles = sorted(glob.glob(os.path.join(self.kit_dir, '*.wav')))
+        self.memory_budget = int(memory_budget_mb*1024*1024)
+        self.as_arrays = as_arrays
+        self.sounds = OrderedDict() # index -> (pygame.mixer.Sound, nbytes), oldest first
+        self.nbytes = 0
+        self.lock = threading.Lock()
+        self.preloader = None
+        self.is_preloading = False
+        self.wanted = [] # samples to preload first (see preload)
+        self.nloads = 0
+        self.nevictions = 0
+
+    def __len__(self):
+        return len(self.soundfiles)
+
+    def converted_path(self, index):
+        """
+        converts the sample to the mixer's format if we have not yet
+        (or if the original changed since we did)
+        """
+        infile = self.soundfiles[index]
+        outfile = os.path.join(self.kit_dir, CONVERTED_DIR, os.path.basename(infile))
+        if not os.path.exists(outfile) or os.path.getmtime(outfile) < os.path.getmtime(infile):
+            convert_wav(infile, outfile)
+        return outfile
+
+    def load(self, index):
+        if self.as_arrays:
+            import numpy as np
+            w = wave.open(self.converted_path(index), 'rb')
+            data = w.readframes(w.getnframes())
+            nchannels = w.getnchannels()
+            w.close()
+            sample = (np.frombuffer(data, dtype='<i2').astype('f4')/32768.0).reshape(-1, nchannels)
+            return sample, sample.nbytes
+        sound = pygame.mixer.Sound(self.converted_path(index))
+        frequency, size, nchannels = pygame.mixer.get_init()
+        nbytes = int(sound.get_length()*frequency)*nchannels*abs(size)//8
+        return sound, nbytes
+
+    def get_if_loaded(self, index):
+        """
+        returns the sample, or None if it isn't loaded (this never decodes)
+        """
+        index = index % len(self.soundfiles)
+        with self.lock:
+            if index not in self.sounds:
+                return None
+            self.sounds.move_to_end(index)
+            return self.sounds[index][0]
+
+    def get(self, index):
+        """
+        returns the sample's pygame.mixer.Sound (or array), loading it if needed
+        """
+        index = index % len(self.soundfiles)
+        with self.lock:
+            if index in self.sounds:
+                self.sounds.move_to_end(index)
+                return self.sounds[index][0]
+        sound, nbytes = self.load(index)
+        with self.lock:
+            if index not in self.sounds:
+                self.sounds[index] = (sound, nbytes)
+                self.nbytes += nbytes
+                self.nloads += 1
+            self.sounds.move_to_end(index)
+            self.evict(keep=index)
+            return self.sounds[index][0]
+
+    def evict(self, keep=None):
+        """
+        drop least recently used samples until we are within budget
+        (call with self.lock held)
+        """
+        for index in list(self.sounds):
+            if self.nbytes <= self.memory_budget:
+                break
+            if index == keep:
+                continue
+            _, nbytes = self.sounds.pop(index)
+            self.nbytes -= nbytes
+            self.nevictions += 1
+
+    def play(self, index):
+        if self.as_arrays:
+            raise Exception('Samples loaded as arrays are played with SamplerEngine')
+        self.get(index).play()
+
+    def preload(self, indices=None):
+        """
+        load samples in the background: the given ones first (e.g., the pads
+        we are about to play), then the rest, in order, until we hit the budget
+        """
+        with self.lock:
+            if indices is not None and self.soundfiles:
+                self.wanted.extend(index % len(self.soundfiles) for index in indices)
+            if self.preloader is not None:
+                # already running; it will get to these
+                return
+            self.is_preloading = True
+            self.preloader = threading.Thread(target=self.preload_samples, daemon=True)
+            self.preloader.start()
+
+    def preload_samples(self):
+        index = 0 # the next sample to fill the budget with
+        while self.is_preloading:
+            with self.lock:
+                wanted = self.wanted.pop(0) if self.wanted else None
+                if wanted is None and (index >= len(self.soundfiles) or self.nbytes >= self.memory_budget):
+                    self.preloader = None
+                    return
+            if wanted is not None:
+                # these are about to be played, so they count as recently used
+                self.get(wanted)
+                continue
+            with self.lock:
+                is_loaded = index in self.sounds
+            if is_loaded:
+                index += 1
+                continue
+            sound, nbytes = self.load(index)
+            with self.lock:
+                if self.nbytes + nbytes > self.memory_budget:
+                    index = len(self.soundfiles)
+                    continue
+                if index not in self.sounds:
+                    # preloaded samples go to the front, so played samples outlive them
+                    self.sounds[index] = (sound, nbytes)
+                    self.sounds.move_to_end(index, last=False)
+                    self.nbytes += nbytes
+                    self.nloads += 1
+            index += 1
+
+    def stats(self):
+        return '{}: {} of {} samples loaded ({:0.1f} of {:0.1f} MB), {} loads, {} evictions'.format(
+            self.sample_name, len(self.sounds), len(self.soundfiles),
+            self.nbytes/1024/1024, self.memory_budget/1024/1024,
+            self.nloads, self.nevictions)
+
+    def terminate(self):
+        self.is_preloading = False
+        preloader = self.preloader
+        if preloader is not None:
+            preloader.join()
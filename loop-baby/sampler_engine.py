@@ -0,0 +1,214 @@
+import numpy as np
+
+from sample_cache import SampleCache, init_mixer, MIXER_FREQUENCY, MIXER_CHANNELS, SAMPLE_DIR, MEMORY_BUDGET_MB
+
+BLOCK_FRAMES = 512 # frames mixed per block (~23ms at 22050 Hz)
+MAX_VOICES = 16
+STEAL_MODES = ['oldest', 'quietest']
+RETRIGGER_MODES = ['restart', 'layer']
+
+class Voice:
+    """
+    one sample playing: a position in the sample, and its gain
+    """
+    __slots__ = ['pad', 'sample', 'pos', 'gain', 'level', 'started', 'fading']
+    def __init__(self, pad, sample, gain, level, started):
+        self.pad = pad
+        self.sample = sample # float32, shape (nframes, nchannels)
+        self.pos = 0
+        self.gain = gain
+        self.level = level # gain times the sample's rms, for stealing
+        self.started = started
+        self.fading = False # if True, fades out over the next block, then stops
+
+class SamplerEngine:
+    """
+    mixes the voices that are playing into one output buffer, a block
+    at a time; at most max_voices play at once, and triggering a new one
+    past that steals the oldest (or quietest) voice, fading it out over
+    one block so it doesn't click; retrigger='restart' fades out any voice
+    already playing on the same pad, and 'layer' lets them overlap
+    """
+    def __init__(self, max_voices=MAX_VOICES, steal='oldest', retrigger='restart',
+        nchannels=MIXER_CHANNELS, block_frames=BLOCK_FRAMES, master_gain=1.0):
+        if steal not in STEAL_MODES:
+            raise Exception('Invalid steal mode: {}'.format(steal))
+        if retrigger not in RETRIGGER_MODES:
+            raise Exception('Invalid retrigger mode: {}'.format(retrigger))
+        self.max_voices = max_voices
+        self.steal = steal
+        self.retrigger = retrigger
+        self.nchannels = nchannels
+        self.block_frames = block_frames
+        self.master_gain = master_gain
+        self.voices = []
+        self.ntriggered = 0
+        self.nstolen = 0
+        self.sample_levels = {} # id(sample) -> rms, so we only compute it once
+        # preallocated, so that rendering a block allocates nothing new
+        self.buffer = np.zeros((block_frames, nchannels), dtype='f4')
+        self.scratch = np.zeros((block_frames, nchannels), dtype='f4')
+        self.fade_out = np.linspace(1, 0, block_frames, dtype='f4')[:,None]
+        self.output = np.zeros((block_frames, nchannels), dtype='<i2')
+
+    def active_voices(self):
+        return [voice for voice in self.voices if not voice.fading]
+
+    def sample_level(self, sample):
+        key = id(sample)
+        if key not in self.sample_levels:
+            if len(self.sample_levels) > 4*self.max_voices:
+                self.sample_levels.clear()
+            self.sample_levels[key] = float(np.sqrt(np.mean(np.square(sample)))) if len(sample) else 0.0
+        return self.sample_levels[key]
+
+    def trigger(self, pad, sample, gain=1.0):
+        """
+        start playing sample (float32, shape (nframes, nchannels));
+        pad identifies where it came from, for retriggering
+        """
+        if self.retrigger == 'restart':
+            for voice in self.voices:
+                if voice.pad == pad:
+                    voice.fading = True
+        active = self.active_voices()
+        if len(active) >= self.max_voices:
+            if self.steal == 'oldest':
+                victim = min(active, key=lambda voice: voice.started)
+            else:
+                victim = min(active, key=lambda voice: voice.level)
+            victim.fading = True
+            self.nstolen += 1
+        self.ntriggered += 1
+        voice = Voice(pad, sample, gain, gain*self.sample_level(sample), self.ntriggered)
+        self.voices.append(voice)
+        return voice
+
+    def stop(self, pad=None):
+        """
+        fade out the voices on this pad (or all voices, if pad is None)
+        """
+        for voice in self.voices:
+            if pad is None or voice.pad == pad:
+                voice.fading = True
+
+    def render(self):
+        """
+        mixes the next block; returns float32, shape (block_frames, nchannels)
+        """
+        out = self.buffer
+        out.fill(0)
+        voices = []
+        for voice in self.voices:
+            n = min(self.block_frames, len(voice.sample) - voice.pos)
+            if n > 0:
+                scratch = self.scratch[:n]
+                np.multiply(voice.sample[voice.pos:voice.pos+n], voice.gain, out=scratch)
+                if voice.fading:
+                    scratch *= self.fade_out[:n]
+                out[:n] += scratch
+                voice.pos += n
+            if not voice.fading and voice.pos < len(voice.sample):
+                voices.append(voice)
+        self.voices = voices
+        if self.master_gain != 1.0:
+            out *= self.master_gain
+        return out
+
+    def render_int16(self):
+        """
+        mixes the next block, as 16-bit samples for the mixer
+        """
+        out = self.render()
+        np.multiply(out, 32767, out=out)
+        np.clip(out, -32768, 32767, out=out)
+        self.output[:] = out
+        return self.output
+
+    def stats(self):
+        return '{} voices playing (max {}); {} triggered, {} stolen'.format(
+            len(self.active_voices()), self.max_voices, self.ntriggered, self.nstolen)
+
+class PygameOutput:
+    """
+    streams an engine's blocks to one pygame mixer channel:
+    call pump() more often than once per block (e.g., each time we
+    sync the trellis), and it keeps the next block queued up
+    """
+    def __init__(self, engine, channel=0):
+        import pygame
+        self.pygame = pygame
+        self.engine = engine
+        self.channel = pygame.mixer.Channel(channel)
+        self.nblocks = 0
+
+    def next_sound(self):
+        self.nblocks += 1
+        return self.pygame.mixer.Sound(buffer=self.engine.render_int16().tobytes())
+
+    def pump(self):
+        if not self.channel.get_busy():
+            self.channel.play(self.next_sound())
+        if self.channel.get_queue() is None:
+            self.channel.queue(self.next_sound())
+
+def block_deadline(block_frames=BLOCK_FRAMES, frequency=MIXER_FREQUENCY):
+    """
+    seconds of audio in one block, i.e., how long we have to mix it
+    """
+    return block_frames/frequency
+
+class Sampler:
+    """
+    a kit of samples (see SampleCache) played through a SamplerEngine,
+    for the looper's sampler mode;
+    samples stay loaded between uses, so switching to it is instant
+    """
+    def __init__(self, sample_name, sample_dir=SAMPLE_DIR, memory_budget_mb=MEMORY_BUDGET_MB,
+        max_voices=MAX_VOICES, steal='oldest', retrigger='restart'):
+        init_mixer()
+        self.samples = SampleCache(sample_name, sample_dir, memory_budget_mb, as_arrays=True)
+        self.engine = SamplerEngine(max_voices, steal, retrigger)
+        self.output = PygameOutput(self.engine)
+        # load what fits in memory while we wait for the first press
+        self.samples.preload()
+
+    def __len__(self):
+        return len(self.samples)
+
+    def preload(self, pads):
+        """
+        load these pads' samples in the background (e.g., when sampler mode starts)
+        """
+        self.samples.preload(pads)
+
+    def trigger(self, pad, gain=1.0):
+        """
+        plays the pad's sample, if it is loaded; we never decode here,
+        since that would hold up the buttons (see preload)
+        """
+        if len(self.samples) == 0:
+            return
+        sample = self.samples.get_if_loaded(pad)
+        if sample is None:
+            print('   Sample for pad {} is still loading'.format(pad))
+            self.samples.preload([pad])
+            return
+        self.engine.trigger(pad, sample, gain)
+        self.output.pump()
+
+    def is_playing(self):
+        return len(self.engine.voices) > 0
+
+    def pump(self):
+        """
+        call more often than once per block while is_playing()
+        """
+        if self.is_playing():
+            self.output.pump()
+
+    def stats(self):
+        return '{}\n{}'.format(self.samples.stats(), self.engine.stats())
+
+    def terminate(self):
+        self.samples.terminate()
@@ -1,41 +1,254 @@
 import os
 import glob
+import json
+import time
+import shutil
 import xml.etree.ElementTree
+from compression import AudioCompressor, compressed_path, cached_path, CACHE_DIR, COMPRESSED_SUFFIX
+from compression import is_complete_wav
+from engines import ENGINE_FILE_SUFFIX
+
+SAVE_TIMEOUT = 60 # seconds to wait for SL to write a session
+SAVE_POLL_INTERVAL = 0.25 # seconds between checks on files being saved
+MANIFEST_FILE = 'manifest.json' # what we know about each session, by slot
+STAGING_DIR = '.staging' # sessions are saved here, then moved into place
+COMMIT_FILE = 'COMMIT' # lists a staged session's files, once they are all written
+NBANKS = 32 # each bank has one session per track button
+BANK_DIR = 'bank_{:02d}' # banks after the first are saved in subdirectories
+
+def is_complete_session_file(path):
+    """
+    True once SL has written the whole .slsess (i.e., it parses)
+    """
+    try:
+        xml.etree.ElementTree.parse(path)
+    except (OSError, xml.etree.ElementTree.ParseError):
+        return False
+    return True
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_commit_file(staging_dir, names):
+    """
+    flush the staged files to disk, then write COMMIT, listing them
+    (runs in a worker process, since this can take seconds on an SD card)
+    nb: one os.sync() for the whole slot is far cheaper on an SD card
+    than an fsync per file; only COMMIT itself is fsynced after that
+    """
+    os.sync()
+    tmpfile = os.path.join(staging_dir, COMMIT_FILE + '.tmp')
+    with open(tmpfile, 'w') as f:
+        json.dump(names, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpfile, os.path.join(staging_dir, COMMIT_FILE))
+    fsync_path(staging_dir)
+
+class SaveJob:
+    """
+    a session being saved by SL: we know the save is done once every
+    file is complete (the session file parses, and each WAV's header
+    matches its size; see is_complete_wav), and SL reported no errors
+    """
+    def __init__(self, index, outfiles, audiofiles, write_ids):
+        self.index = index
+        self.outfile = outfiles[0]
+        self.audiofiles = audiofiles # loop index -> .wav
+        self.write_ids = write_ids
+        self.paths = list(outfiles) + list(audiofiles.values())
+        self.done = set() # paths that are completely written
+        self.t_start = time.time()
+        self.t_last_poll = 0
+        self.status = 'saving' # or 'committing', 'done' or 'failed'
+        self.commit = None # Future, while committing
+
+    def progress(self):
+        """
+        fraction of files that are completely written
+        """
+        return len(self.done)/len(self.paths)
+
+    def poll(self, write_errors):
+        """
+        check on the files; returns the status ('saving', 'done', or 'failed')
+        """
+        if any(write_id in write_errors for write_id in self.write_ids):
+            self.status = 'failed'
+            return self.status
+        for path in self.paths:
+            if path in self.done:
+                continue
+            if path in self.audiofiles.values():
+                is_complete = is_complete_wav(path)
+            else:
+                is_complete = is_complete_session_file(path)
+            if is_complete:
+                self.done.add(path)
+        if self.progress() == 1.0:
+            self.status = 'done'
+        elif time.time() - self.t_start > SAVE_TIMEOUT:
+            print('Timed out saving session {}'.format(self.index))
+            self.status = 'failed'
+        return self.status
 
 class SLSessionManager:
-    def __init__(self, sessions, session_dir, sl_client, maxloops=8):
+    """
+    sessions are saved in banks of maxloops (one per track button),
+    and only the visible bank (self.bank) is ever read from disk;
+    session N is saved as "N.slsess" in bank_dir(N // maxloops),
+    so bank 0 is session_dir itself (e.g., "0.slsess" ... "7.slsess"),
+    bank 1 is session_dir/bank_01 ("8.slsess" ... "15.slsess"), etc.
+    """
+    def __init__(self, sessions, session_dir, sl_client, maxloops=8, nbanks=NBANKS):
         self.session_dir = session_dir
         self.sessions = sessions
         self.sl_client = sl_client
         self.maxloops = maxloops
+        self.nbanks = nbanks
+        self.bank = 0
+        self.saved_sessions = {} # session index -> info, for banks we've synced
+        self.manifests = {} # bank -> manifest, for banks we've synced
+        self.jobs = {} # session index -> SaveJob, while saving
+        # audio is compressed in the background after saving,
+        # and decompressed in the background before recalling
+        self.compressor = AudioCompressor()
+        self.tasks = [] # (kind, session index, generation, path, future)
+        self.generations = {} # session index -> increases on each save
+        self.pending_load = None # session index waiting on decompression
+        self.on_load_sent = None # called once SL has been sent the pending load (see load_session)
+        # CACHE_DIR is in RAM, so we only keep one session's audio there,
+        # and remove it once SL has loaded it
+        self.cached_index = None # session index whose audio is (being) decompressed
+        self.loading = None # (session index, ping Future, time) until SL has loaded it
+        self.sync()
+        # e.g., left over from before a crash
+        self.clear_cache()
+
+    def bank_dir(self, bank):
+        if bank == 0:
+            return self.session_dir
+        return os.path.join(self.session_dir, BANK_DIR.format(bank))
+
+    def bank_of(self, index):
+        return index // self.maxloops
+
+    def session_index(self, slot):
+        """
+        index of the session in the visible bank at this slot
+        (i.e., SessionButton.name)
+        """
+        return self.bank*self.maxloops + slot
+
+    def set_bank(self, bank):
+        """
+        make a different bank of sessions visible
+        """
+        self.bank = bank % self.nbanks
         self.sync()
 
+    def page(self, step):
+        self.set_bank(self.bank + step)
+
+    def manifest_file(self, bank):
+        return os.path.join(self.bank_dir(bank), MANIFEST_FILE)
+
+    def get_manifest(self, bank):
+        """
+        the manifest stores, for each slot, the mtimes and sizes of its files
+        when we last read them, so that sync() can skip unchanged slots
+        (each bank has its own, which we read the first time we need it)
+        """
+        if bank not in self.manifests:
+            try:
+                with open(self.manifest_file(bank)) as f:
+                    self.manifests[bank] = json.load(f)
+            except (OSError, ValueError):
+                self.manifests[bank] = {}
+            self.recover_staged_sessions(bank)
+        return self.manifests[bank]
+
+    def save_manifest(self, bank):
+        tmpfile = self.manifest_file(bank) + '.tmp'
+        with open(tmpfile, 'w') as f:
+            json.dump(self.manifests[bank], f)
+        os.replace(tmpfile, self.manifest_file(bank))
+
+    def scan_session_dir(self, bank):
+        """
+        returns {filename: [mtime_ns, size]} for every file in the bank's dir
+        (one directory read, rather than a glob per slot)
+        """
+        entries = {}
+        try:
+            with os.scandir(self.bank_dir(bank)) as it:
+                for entry in it:
+                    if entry.is_file():
+                        stat = entry.stat()
+                        entries[entry.name] = [stat.st_mtime_ns, stat.st_size]
+        except FileNotFoundError:
+            pass
+        return entries
+
     def find_audiofiles_for_slsess_file(self, infile):
         """
         e.g., {0: "/home/pi/tmp.slsess_loop_00.wav"}
+        and the indices of loops only saved in compressed form
+        (which are still listed by their .wav path)
         """
         audiofiles = glob.glob(os.path.join(infile + '_loop_*.wav'))
         indices = [int(x.split('_loop_')[1].split('.wav')[0]) for x in audiofiles]
-        return dict(zip(indices, audiofiles))
+        audiofiles = dict(zip(indices, audiofiles))
+        compressed = []
+        for x in glob.glob(os.path.join(infile + '_loop_*.wav' + COMPRESSED_SUFFIX)):
+            index = int(x.split('_loop_')[1].split('.wav')[0])
+            if index not in audiofiles:
+                audiofiles[index] = x[:-len(COMPRESSED_SUFFIX)]
+                compressed.append(index)
+        return audiofiles, sorted(compressed)
+
+    def session_parts(self, infile):
+        """
+        the .slsess files making up a session, and the index of each one's
+        first loop; sessions saved across several SL engines (see EngineRouter)
+        have a file per engine, e.g., "0.slsess_engine_1" starts at loop 4
+        """
+        parts = [(infile, 0)]
+        for path in glob.glob(infile + ENGINE_FILE_SUFFIX.format('*')):
+            engine = path[len(infile + ENGINE_FILE_SUFFIX.format('')):]
+            if engine.isdigit():
+                parts.append((path, int(engine)*self.sl_client.loops_per_engine))
+        return sorted(parts, key=lambda part: part[1])
 
     def add_audio_paths_to_slsess_file(self, infile, audiofiles):
         """
-        1. parse infile as xml
+        1. parse infile (and any other parts of the session) as xml
         2. for each Looper object:
         - add audiopath as loop_audio="..."
         - e.g., loop_audio="/home/pi/tmp.slsess_loop_00.wav"
         """
-        et = xml.etree.ElementTree.parse(infile)
-        loopers = et.find('Loopers')
         has_audio = []
-        for index, looper in enumerate(loopers):
-            if index in audiofiles:
-                loopers[index].set('loop_audio', audiofiles[index])
-            elif 'loop_audio' in loopers[index].keys():
-                # file must have been deleted, because we didn't find it
-                loopers[index].attrib.pop('loop_audio')
-            has_audio.append('loop_audio' in loopers[index].keys())
-        et.write(infile)
+        for path, offset in self.session_parts(infile):
+            et = xml.etree.ElementTree.parse(path)
+            loopers = et.find('Loopers')
+            changed = False
+            for index, looper in enumerate(loopers):
+                if offset + index in audiofiles:
+                    if looper.get('loop_audio') != audiofiles[offset + index]:
+                        looper.set('loop_audio', audiofiles[offset + index])
+                        changed = True
+                elif 'loop_audio' in looper.keys():
+                    # file must have been deleted, because we didn't find it
+                    looper.attrib.pop('loop_audio')
+                    changed = True
+                has_audio.append('loop_audio' in looper.keys())
+            if changed:
+                # only write if needed, to spare the SD card
+                et.write(path)
         return has_audio
 
     def get_audio(self, infile):
@@ -43,61 +256,356 @@ class SLSessionManager:
         find audio files for this slsess file
         then add the audio paths to the slsess file if they are not there
         """
-        audiofiles = self.find_audiofiles_for_slsess_file(infile)
+        audiofiles, compressed = self.find_audiofiles_for_slsess_file(infile)
         has_audio = self.add_audio_paths_to_slsess_file(infile, audiofiles)
         return {'audiofiles': audiofiles,
+            'compressed': compressed,
             'has_audio': has_audio,
             'nloops': len(has_audio)}
 
     def sync(self):
         """
-        look for slsess files, and corresponding audio files
+        look for slsess files in the visible bank, and corresponding audio files
         then inject the audio file paths into the slsess file,
             if it's not already present
         """
-        saved_sessions = {}
-        for i in range(self.maxloops):
-            fnm = '{}.slsess'.format(i)
-            infile = os.path.join(self.session_dir, fnm)
-            saved_sessions[i] = {'session': infile, 'exists': False}
-            if os.path.exists(infile):
+        self.get_manifest(self.bank)
+        entries = self.scan_session_dir(self.bank)
+        manifest_changed = False
+        for slot in range(self.maxloops):
+            i = self.session_index(slot)
+            if i in self.jobs:
+                # still being saved, so leave it alone
+                continue
+            manifest_changed |= self.sync_session(i, entries, save_manifest=False)
+        if manifest_changed:
+            self.save_manifest(self.bank)
+
+    def sync_session(self, i, entries=None, save_manifest=True):
+        """
+        only re-reads the session's files if they changed since
+        we last read them; returns True if the manifest changed
+        """
+        bank = self.bank_of(i)
+        manifest = self.get_manifest(bank)
+        if entries is None:
+            entries = self.scan_session_dir(bank)
+        fnm = '{}.slsess'.format(i)
+        infile = os.path.join(self.bank_dir(bank), fnm)
+        self.saved_sessions[i] = {'session': infile, 'exists': False}
+        key = str(i)
+        if fnm not in entries:
+            # nothing saved here
+            changed = manifest.pop(key, None) is not None
+        else:
+            files = dict((name, stat) for name, stat in entries.items()
+                if name == fnm or name.startswith(fnm + '_'))
+            cached = manifest.get(key)
+            changed = cached is None or cached['files'] != files
+            if changed:
                 audio_info = self.get_audio(infile)
-                saved_sessions[i].update(audio_info)
-                saved_sessions[i]['exists'] = True
-        self.saved_sessions = saved_sessions
+                # get_audio may have rewritten the .slsess files
+                for path, _ in self.session_parts(infile):
+                    stat = os.stat(path)
+                    files[os.path.basename(path)] = [stat.st_mtime_ns, stat.st_size]
+                manifest[key] = {'files': files,
+                    'audiofiles': sorted(audio_info['audiofiles'].items()),
+                    'compressed': audio_info['compressed'],
+                    'has_audio': audio_info['has_audio'],
+                    'nloops': audio_info['nloops']}
+            cached = manifest[key]
+            self.saved_sessions[i].update({
+                'audiofiles': dict(cached['audiofiles']),
+                'compressed': cached.get('compressed', []),
+                'has_audio': cached['has_audio'],
+                'nloops': cached['nloops'],
+                'exists': True})
+        if changed and save_manifest:
+            self.save_manifest(bank)
+        return changed
 
     def exists(self, index):
         """
         check whether saved session file exists for this index
         """
-        return self.saved_sessions[index]['exists']
+        return index in self.saved_sessions and self.saved_sessions[index]['exists']
+
+    def remove_files(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
 
-    def remove_audio_files(self, paths):
+    def staging_dir(self, index):
+        return os.path.join(self.bank_dir(self.bank_of(index)), STAGING_DIR, str(index))
+
+    def slot_files(self, index):
         """
-        removes .wav files when overwriting saved session
+        names of every file in the bank's dir belonging to this slot
+        (e.g., "0.slsess", "0.slsess_engine_1", "0.slsess_loop_00.wav16")
         """
-        for path in paths:
-            os.system('rm {}'.format(path))
+        fnm = '{}.slsess'.format(index)
+        return [name for name in self.scan_session_dir(self.bank_of(index))
+            if name == fnm or name.startswith(fnm + '_')]
+
+    def commit_session(self, index):
+        """
+        swap the staged session in for whatever is in the slot:
+        1. flush the staged files to disk (one os.sync() for the slot)
+        2. write COMMIT, listing the staged files (this is the
+            point at which the new session replaces the old one)
+        3. unlink the slot's old files, and rename the new ones into place
+        1. and 2. happen in the background (see write_commit_file);
+        this returns a Future, and poll_jobs calls finish_commit (3.) once it is done;
+        if we are interrupted after 2., recover_staged_sessions() finishes 3.
+        """
+        staging_dir = self.staging_dir(index)
+        names = sorted(name for name in os.listdir(staging_dir) if name != COMMIT_FILE)
+        return self.compressor.submit(write_commit_file, staging_dir, names)
+
+    def finish_commit(self, index):
+        staging_dir = self.staging_dir(index)
+        bank_dir = self.bank_dir(self.bank_of(index))
+        with open(os.path.join(staging_dir, COMMIT_FILE)) as f:
+            names = json.load(f)
+        self.remove_files([os.path.join(bank_dir, name)
+            for name in self.slot_files(index) if name not in names])
+        for name in names:
+            if os.path.exists(os.path.join(staging_dir, name)):
+                os.replace(os.path.join(staging_dir, name),
+                    os.path.join(bank_dir, name))
+        shutil.rmtree(staging_dir)
+
+    def recover_staged_sessions(self, bank):
+        """
+        finish any commits in this bank that were interrupted (e.g., by
+        a power cut), and throw away any sessions only partially saved
+        """
+        for index in range(bank*self.maxloops, (bank+1)*self.maxloops):
+            staging_dir = self.staging_dir(index)
+            if not os.path.isdir(staging_dir):
+                continue
+            if os.path.exists(os.path.join(staging_dir, COMMIT_FILE)):
+                print('Finishing save of session {}'.format(index))
+                self.finish_commit(index)
+            else:
+                shutil.rmtree(staging_dir)
+
+    def is_saving(self, index):
+        return index in self.jobs
 
     def save_session(self, index, loops):
         """
         save session in SL (.slsess); then save audio (.wav)
+        this returns right away; SL saves to a staging directory,
+        and the slot keeps its old session until poll_jobs() finds
+        that SL has written every file
         """
-        outfile = self.saved_sessions[index]['session']
-        if self.saved_sessions[index]['exists']:
-            self.remove_audio_files(self.saved_sessions[index]['audiofiles'])
-        self.sl_client.save_session(outfile)
+        staging_dir = self.staging_dir(index)
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir)
+        os.makedirs(staging_dir)
+        outfile = os.path.join(staging_dir, os.path.basename(self.saved_sessions[index]['session']))
+        # any compression still running for this slot is now out of date
+        self.generations[index] = self.generations.get(index, 0) + 1
+
+        write_ids = [self.sl_client.new_write_id()]
+        self.sl_client.save_session(outfile, write_ids[0])
+        audiofiles = {}
         for i,loop in enumerate(loops):
             if not loop.has_had_something_recorded:
                 continue
-            audiofile = outfile.replace('.slsess', '.slsess_loop_{0:02d}.wav'.format(i))
-            self.sl_client.save_loop_audio(i, audiofile)
-        self.saved_sessions[index]['exists'] = True
+            audiofiles[i] = outfile.replace('.slsess', '.slsess_loop_{0:02d}.wav'.format(i))
+            write_ids.append(self.sl_client.new_write_id())
+            self.sl_client.save_loop_audio(i, audiofiles[i], write_ids[-1])
+        self.jobs[index] = SaveJob(index, self.sl_client.session_files(outfile),
+            audiofiles, write_ids)
+        return self.jobs[index]
+
+    def is_busy(self):
+        return bool(self.jobs or self.tasks or self.loading)
 
-    def load_session(self, index):
+    def compress_session(self, index):
         """
-        load the .slsess file (which contains links to audio files)
-        return the number of loops we need to have
+        compress a saved session's audio in the background
+        (the .wav files are removed once poll_tasks sees they are done)
+        """
+        info = self.saved_sessions[index]
+        for i, path in info.get('audiofiles', {}).items():
+            if i in info['compressed']:
+                continue
+            self.tasks.append(('compress', index, self.generations.get(index, 0),
+                path, self.compressor.compress(path)))
+
+    def decompress_session(self, index):
+        """
+        decompress a session's audio into the cache, in the background;
+        returns True if nothing is left to decompress
+        """
+        info = self.saved_sessions[index]
+        if index != self.cached_index:
+            self.cached_index = index
+            self.clear_cache()
+        is_ready = True
+        for i in info.get('compressed', []):
+            path = info['audiofiles'][i]
+            if os.path.exists(cached_path(path)) and os.path.getmtime(cached_path(path)) >= os.path.getmtime(compressed_path(path)):
+                continue
+            is_ready = False
+            if not any(task[0] == 'decompress' and task[3] == path for task in self.tasks):
+                self.tasks.append(('decompress', index, self.generations.get(index, 0),
+                    path, self.compressor.decompress(path)))
+        return is_ready
+
+    def cached_files(self, index):
+        """
+        what send_load_session puts in CACHE_DIR for this session
+        """
+        info = self.saved_sessions.get(index)
+        if info is None:
+            return set()
+        files = set(cached_path(info['audiofiles'][i]) for i in info.get('compressed', []))
+        files.update(cached_path(path) for path, offset in self.session_parts(info['session']))
+        return files
+
+    def clear_cache(self):
         """
-        self.sl_client.load_session(self.saved_sessions[index]['session'])
-        return self.saved_sessions[index]['has_audio']
+        remove everything in CACHE_DIR but the audio of the sessions
+        we are about to load, or that SL is loading
+        """
+        if not os.path.isdir(CACHE_DIR):
+            return
+        keep = set()
+        for index in [self.cached_index, self.pending_load, self.loading and self.loading[0]]:
+            if index is not None:
+                keep.update(self.cached_files(index))
+        # (.tmp files are still being written by the compressor)
+        self.remove_files([path for path in glob.glob(os.path.join(CACHE_DIR, '*'))
+            if path not in keep and not path.endswith('.tmp')])
+
+    def poll_tasks(self):
+        """
+        check on compression/decompression in the background
+        """
+        tasks = []
+        for task in self.tasks:
+            kind, index, generation, path, future = task
+            if not future.done():
+                tasks.append(task)
+                continue
+            if future.exception() is not None:
+                print('Error with {} of {}: {}'.format(kind, path, future.exception()))
+            elif kind == 'decompress' and index not in [self.cached_index, self.pending_load]:
+                # we've since moved on to another session
+                self.remove_files([cached_path(path)])
+            elif kind == 'compress' and generation == self.generations.get(index, 0):
+                if index in [self.pending_load, self.loading and self.loading[0]]:
+                    # SL was (or is about to be) pointed at the .wav,
+                    # so keep it until SL has loaded the session
+                    tasks.append(task)
+                    continue
+                # the compressed file is now the current one
+                # (if the slot is being saved over, commit_session cleans up)
+                os.remove(path)
+                self.sync_session(index)
+        self.tasks = tasks
+        if self.pending_load is not None and self.decompress_session(self.pending_load):
+            self.send_load_session(self.pending_load)
+            self.pending_load = None
+        if self.loading is not None:
+            index, future, t_start = self.loading
+            if future.done() or time.time() - t_start > SAVE_TIMEOUT:
+                # SL answers the ping after it has loaded the session
+                # (it handles them in order), so it is done with the files
+                self.loading = None
+                if self.cached_index == index:
+                    self.cached_index = None
+                self.remove_files(self.cached_files(index))
+
+    def poll_jobs(self):
+        """
+        check on any sessions being saved;
+        returns the jobs that finished (successfully or not)
+        """
+        self.poll_tasks()
+        finished = []
+        for index, job in list(self.jobs.items()):
+            if job.status == 'committing':
+                if not job.commit.done():
+                    continue
+                self.jobs.pop(index)
+                if job.commit.exception() is None:
+                    self.finish_commit(index)
+                    job.status = 'done'
+                else:
+                    print('Error committing session {}: {}'.format(index, job.commit.exception()))
+                    shutil.rmtree(self.staging_dir(index))
+                    job.status = 'failed'
+                self.sync_session(index)
+                finished.append(job)
+                continue
+            if time.time() - job.t_last_poll < SAVE_POLL_INTERVAL:
+                continue
+            job.t_last_poll = time.time()
+            if job.poll(self.sl_client.write_errors) == 'saving':
+                continue
+            if job.status == 'done' and any(task[0] == 'compress' and task[1] == index for task in self.tasks):
+                # wait until we're done compressing the files we're replacing
+                continue
+            if job.status == 'done':
+                # point the .slsess at where its audio will end up
+                self.add_audio_paths_to_slsess_file(job.outfile,
+                    dict((i, os.path.join(self.bank_dir(self.bank_of(index)), os.path.basename(path)))
+                        for i, path in job.audiofiles.items()))
+                job.status = 'committing'
+                job.commit = self.commit_session(index)
+                continue
+            # the old session is untouched; just drop the partial one
+            self.jobs.pop(index)
+            shutil.rmtree(self.staging_dir(index))
+            self.sync_session(index)
+            finished.append(job)
+        return finished
+
+    def load_session(self, index, on_sent=None):
+        """
+        load the .slsess file (which contains links to audio files);
+        if the audio is compressed, SL loads it once it has been
+        decompressed (see poll_tasks); either way, once SL has been
+        sent the session, on_sent is called with its has_audio
+        (a list with whether each of its loops has audio)
+        """
+        self.on_load_sent = on_sent
+        if self.decompress_session(index):
+            self.send_load_session(index)
+        else:
+            self.pending_load = index
+
+    def send_load_session(self, index):
+        """
+        point SL at the decompressed copies of any compressed audio
+        """
+        info = self.saved_sessions[index]
+        infile = info['session']
+        if info.get('compressed'):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # don't let SL find parts of a session we cached earlier
+            self.remove_files(glob.glob(cached_path(infile) + ENGINE_FILE_SUFFIX.format('*')))
+            for path, offset in self.session_parts(infile):
+                et = xml.etree.ElementTree.parse(path)
+                for i, looper in enumerate(et.find('Loopers')):
+                    if offset + i in info['compressed']:
+                        looper.set('loop_audio', cached_path(info['audiofiles'][offset + i]))
+                et.write(cached_path(path))
+            infile = cached_path(infile)
+        self.sl_client.load_session(infile)
+        is_compressing = any(task[0] == 'compress' and task[1] == index for task in self.tasks)
+        if info.get('compressed') or is_compressing:
+            self.loading = (index, self.sl_client.ping(), time.time())
+        on_sent, self.on_load_sent = self.on_load_sent, None
+        if on_sent is not None:
+            on_sent(info['has_audio'])
+
+    def terminate(self):
+        self.compressor.terminate()
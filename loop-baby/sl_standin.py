@@ -0,0 +1,146 @@
+import wave
+import socket
+import argparse
+import threading
+from osc4py3 import oscbuildparse
+
+STANDIN_PORT = 9951
+STANDIN_VERSION = '1.7.standin'
+
+def parse_return_url(url):
+    """
+    e.g., "osc.udp://0.0.0.0:7777" -> ("127.0.0.1", 7777)
+    """
+    host, port = url.split('://')[-1].rsplit(':', 1)
+    if host in ['0.0.0.0', '']:
+        host = '127.0.0.1'
+    return host, int(port.strip('/'))
+
+class SooperLooperStandIn:
+    """
+    a local UDP server that speaks the subset of SooperLooper's
+    OSC protocol used by OscSooperLooper, for benchmarks and
+    running without SL; it replies to /ping and /get like SL,
+    and otherwise just keeps track of what it was sent
+    """
+    def __init__(self, host='127.0.0.1', port=STANDIN_PORT, nloops=1, verbose=False):
+        self.host = host
+        self.port = port
+        self.nloops = nloops
+        self.verbose = verbose
+        self.params = {} # (param, loop) -> value
+        self.counts = {} # address pattern (e.g., 'hit') -> # received
+        self.nreceived = 0
+        self.sessions_loaded = []
+        self.sessions_saved = []
+        self.loops_saved = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.host, self.port))
+        self.sock.settimeout(0.1)
+        self.is_running = False
+        self.thread = None
+
+    def start(self):
+        """
+        serve in a background thread
+        """
+        self.is_running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.is_running = False
+        if self.thread is not None:
+            self.thread.join()
+        self.sock.close()
+
+    def serve(self):
+        self.is_running = True
+        while self.is_running:
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle_packet(oscbuildparse.decode_packet(data))
+
+    def handle_packet(self, packet):
+        if isinstance(packet, oscbuildparse.OSCBundle):
+            for element in packet.elements:
+                self.handle_packet(element)
+            return
+        self.nreceived += 1
+        self.handle_message(packet.addrpattern, packet.arguments)
+
+    def reply(self, url, path, args):
+        msg = oscbuildparse.OSCMessage(path, None, args)
+        self.sock.sendto(oscbuildparse.encode_packet(msg), parse_return_url(url))
+
+    def handle_message(self, address, args):
+        if self.verbose:
+            print('standin received: {} {}'.format(address, args))
+        parts = address.strip('/').split('/')
+        if parts[0] == 'sl' and len(parts) == 3:
+            loop, command = int(parts[1]), parts[2]
+        else:
+            loop, command = None, parts[0]
+        self.counts[command] = self.counts.get(command, 0) + 1
+
+        if command == 'ping':
+            url, path = args
+            self.reply(url, path, ['osc.udp://{}:{}'.format(self.host, self.port),
+                STANDIN_VERSION, self.nloops])
+        elif command == 'get':
+            param, url, path = args
+            index = -2 if loop is None else loop
+            self.reply(url, path, [index, param, float(self.params.get((param, loop), 0.0))])
+        elif command == 'set':
+            param, value = args
+            self.params[(param, loop)] = value
+        elif command == 'loop_add':
+            self.nloops += 1
+        elif command == 'load_session':
+            self.sessions_loaded.append(args[0])
+            # like SL, we now have as many loops as the session does
+            try:
+                with open(args[0]) as f:
+                    self.nloops = max(1, f.read().count('<Looper '))
+            except OSError:
+                self.nloops = 1
+        elif command == 'save_session':
+            self.sessions_saved.append(args[0])
+            self.write_session(args[0])
+        elif command == 'save_loop':
+            self.loops_saved.append((loop, args[0]))
+            self.write_loop_audio(args[0])
+
+    def write_session(self, outfile):
+        with open(outfile, 'w') as f:
+            f.write('<SLSession>\n<Loopers>\n')
+            for i in range(self.nloops):
+                f.write('<Looper index="{}" />\n'.format(i))
+            f.write('</Loopers>\n</SLSession>\n')
+
+    def write_loop_audio(self, outfile, nseconds=1, rate=44100):
+        # nb: SL writes 32-bit float, but silence is silence
+        w = wave.open(outfile, 'wb')
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(4*rate*nseconds))
+        w.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="stand-in for SooperLooper's OSC server")
+    parser.add_argument('-p', '--port', type=int, default=STANDIN_PORT)
+    parser.add_argument('-v', '--verbose',
+        dest='verbose', action='store_true')
+    args = parser.parse_args()
+    standin = SooperLooperStandIn(port=args.port, verbose=args.verbose)
+    print('SooperLooper stand-in listening on port {}'.format(args.port))
+    try:
+        standin.serve()
+    except KeyboardInterrupt:
+        standin.stop()
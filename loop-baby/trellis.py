@@ -1,48 +1,166 @@
 import time
-import random
+import threading
+import latency
 from board import SCL, SDA
 import busio
 from adafruit_neotrellis.neotrellis import NeoTrellis
+from button_settings import COLORS
 
 BUTTON_PRESSED = NeoTrellis.EDGE_RISING
 BUTTON_RELEASED = NeoTrellis.EDGE_FALLING
 
-def random_color():
-    return (random.randint(0,255), random.randint(0,255), random.randint(0,255))
+POLL_INTERVAL = 0.02 # the trellis can only be read every 17 ms or so
+INT_PIN = 5 # BCM pin wired to the seesaw's INT line
+TRELLIS_ADDRESS = 0x2E # default I2C address of a NeoTrellis
+BOARD_SIZE = 4 # each NeoTrellis is a 4x4 grid of buttons
+
+class Event:
+    def __init__(self, number, edge, t=None):
+        self.number = number
+        self.edge = edge
+        self.time = time.monotonic() if t is None else t # see GestureEngine
+
+class GPIOEdgeSource:
+    """
+    waits on the seesaw's INT line, which is pulled low
+    whenever the trellis has button events waiting to be read;
+    with several boards, give either one pin (their INT lines wired
+    together) or one pin per board (in the same order as the boards),
+    in which case we only read the boards that signalled
+    """
+    def __init__(self, pin=INT_PIN):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pins = list(pin) if type(pin) in [list, tuple] else [pin]
+        GPIO.setmode(GPIO.BCM)
+        for p in self.pins:
+            GPIO.setup(p, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        if len(self.pins) > 1:
+            # wait_for_edge only handles one pin, so we wait on all of them this way
+            self.event = threading.Event()
+            for p in self.pins:
+                GPIO.add_event_detect(p, GPIO.FALLING,
+                    callback=lambda channel: self.event.set())
+
+    def wait(self, timeout):
+        """
+        returns True if there are events to read,
+        or False if we timed out first
+        """
+        if any(self.GPIO.input(p) == 0 for p in self.pins):
+            # events arrived since the last read
+            return True
+        if len(self.pins) == 1:
+            channel = self.GPIO.wait_for_edge(self.pins[0], self.GPIO.FALLING,
+                timeout=int(1000*timeout))
+            return channel is not None
+        self.event.clear()
+        return self.event.wait(timeout)
+
+    def pending(self):
+        """
+        indices of the boards with events to read (None if we can't tell)
+        """
+        if len(self.pins) == 1:
+            return None
+        return [i for i, p in enumerate(self.pins) if self.GPIO.input(p) == 0]
+
+    def close(self):
+        for p in self.pins:
+            self.GPIO.cleanup(p)
+
+class SimulatedEdgeSource:
+    """
+    stands in for GPIOEdgeSource without hardware (e.g., in tests):
+    call trigger() (e.g., from another thread) to signal an edge;
+    with nboards, it acts like one INT line per board,
+    and trigger(board) signals just that board
+    """
+    def __init__(self, nboards=None):
+        self.nboards = nboards
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.boards = set() # boards that signalled since the last wait
+
+    def trigger(self, board=None):
+        if board is not None:
+            with self.lock:
+                self.boards.add(board)
+        self.event.set()
+
+    def wait(self, timeout):
+        if self.event.wait(timeout):
+            self.event.clear()
+            return True
+        return False
+
+    def pending(self):
+        if self.nboards is None:
+            return None
+        with self.lock:
+            boards, self.boards = self.boards, set()
+        return sorted(boards)
+
+    def close(self):
+        pass
 
 class Trellis:
     """
     relays button presses by adding them to a queue
     buttons can be referred to by name, index, or color group name
     """
-    def __init__(self, startup_color='random', debug=True):
+    def __init__(self, debug=True, edge_source=None,
+        addresses=((TRELLIS_ADDRESS,),)):
+        """
+        if edge_source is given (e.g., GPIOEdgeSource), the trellis
+        is only read after its INT line signals that events arrived;
+        otherwise it is polled every POLL_INTERVAL seconds
+
+        addresses is a grid of I2C addresses, one per board, as the boards
+        are tiled (e.g., ((0x2E, 0x2F), (0x30, 0x31)) for an 8x8 grid);
+        buttons are numbered across all boards, row by row
+        (so a single board is numbered just like a NeoTrellis)
+        """
 
         self.debug = debug
-        self.nbuttons = 16
-        self.colors = {'off': (0, 0, 0), 'purple': (180, 0, 255),
-            'red': (255, 0, 0), 'orange': (255, 164, 0),
-            'green': (0, 255, 0), 'yellow': (158, 152, 17),
-            'gray': (100, 100, 100),
-            'blue': (0, 0, 255),
-            'lightblue': (7, 34, 81),
-            'blueish': (33, 211, 237),
-            'darkgray': (10, 10, 10),
-            'seagreen': (30, 255, 30),
-            'lightseagreen': (39, 239, 120),
-            'salmon': (206, 28, 41),
-            'lightorange': (176, 76, 9),
-            'lightpurple': (87, 20, 174),
-            'lighterpurple': (70, 27, 87),
-            'pink': (100, 0, 100)}
+        self.nrows = BOARD_SIZE*len(addresses)
+        self.ncols = BOARD_SIZE*len(addresses[0])
+        self.nbuttons = self.nrows*self.ncols
+        self.colors = dict(COLORS)
 
         # create the i2c object for the trellis
         self.i2c_bus = busio.I2C(SCL, SDA)
 
-        # create the trellis
-        self.trellis = NeoTrellis(self.i2c_bus) # can set interrupt=True here...
+        # create the trellis (one NeoTrellis per board)
+        self.edge_source = edge_source
+        self.boards = []
+        for row in addresses:
+            for address in row:
+                board = NeoTrellis(self.i2c_bus, interrupt=edge_source is not None,
+                    addr=address)
+                # we write pixels to the trellis ourselves (see show)
+                board.pixels.auto_write = False
+                self.boards.append(board)
+
+        # map each button number to its (board, key on that board), and back
+        boards_per_row = len(addresses[0])
+        self.board_keys = []
+        self.button_numbers = [[None]*BOARD_SIZE**2 for board in self.boards]
+        for i in range(self.nbuttons):
+            y, x = divmod(i, self.ncols)
+            board = (y // BOARD_SIZE)*boards_per_row + x // BOARD_SIZE
+            key = (y % BOARD_SIZE)*BOARD_SIZE + x % BOARD_SIZE
+            self.board_keys.append((board, key))
+            self.button_numbers[board][key] = i
+
+        # set_color draws to the back buffer; show() then sends only
+        # the pixels that differ from what the trellis is showing
+        self.back_buffer = [self.colors['off']]*self.nbuttons
+        self.front_buffer = [None]*self.nbuttons
+        self.i2c_writes = 0 # number of buffer writes sent to the trellis
+        self.pixels_written = 0
 
         # for handling colors of groups of buttons
-        self.startup_color = startup_color
         self.color_map = {}
 
         # to ensure callback set
@@ -55,63 +173,35 @@ class Trellis:
         # callback for when buttons are pressed
         self.button_handler = fcn
         # set handlers for button press
-        self.activate(self.startup_color, lightshow=True)
+        self.activate()
+
+    def board_callback(self, fcn, board):
+        """
+        passes events from this board to fcn, numbered across all boards
+        """
+        button_numbers = self.button_numbers[board]
+        return lambda event: fcn(Event(button_numbers[event.number], event.edge))
 
-    def activate(self, startup_color=None, lightshow=False):
+    def set_board_callbacks(self, fcn):
+        for board_index, board in enumerate(self.boards):
+            callback = self.board_callback(fcn, board_index)
+            for key in range(BOARD_SIZE**2):
+                board.callbacks[key] = callback
+
+    def activate(self):
         if self.button_handler is None:
             print("Error: callback must be set using 'set_callback'")
 
+        # set all keys to trigger the callback
+        self.set_board_callbacks(self.button_handler)
         for i in range(self.nbuttons):
+            board, key = self.board_keys[i]
             # activate rising edge events on all keys
-            self.trellis.activate_key(i, BUTTON_PRESSED)
+            self.boards[board].activate_key(key, BUTTON_PRESSED)
             # activate falling edge events on all keys
-            self.trellis.activate_key(i, BUTTON_RELEASED)
-            # set all keys to trigger the blink callback
-            self.trellis.callbacks[i] = self.button_handler
-
-            if not lightshow:
-                continue
-            #cycle the LEDs on startup
-            if startup_color is not None:
-                if startup_color == 'random':
-                    color = random_color()
-                else:
-                    color = self.colors[startup_color]
-                self.trellis.pixels[i] = color
-                time.sleep(.03)
-
-        for i in range(self.nbuttons):
-            self.trellis.pixels[i] = self.colors['off']
-            if lightshow:
-                time.sleep(.03)
-
-    def end_lightshow(self, event=None):
-        # reset callbacks and turn lights off
-        if event is None or event.edge == BUTTON_PRESSED:
-            self.activate()
-            self.lightshow_on = False
-
-    def lightshow(self):
-        self.lightshow_on = True
-        # first, set callback to interrupt the show
-        for i in range(self.nbuttons):
-            self.trellis.callbacks[i] = self.end_lightshow
-        # now pick buttons and flash lights on/off in random order
-        while True:
-            button_indices = list(range(self.nbuttons))
-            random.shuffle(button_indices)
-            for i in button_indices:
-                self.trellis.pixels[i] = random_color()
-                time.sleep(.07)
-                if not self.lightshow_on:
-                    return
-            for i in button_indices:
-                self.trellis.pixels[i] = self.colors['off']
-                time.sleep(.07)
-                if not self.lightshow_on:
-                    return
-            self.sync()
-            time.sleep(.02)
+            self.boards[board].activate_key(key, BUTTON_RELEASED)
+            self.set_rgb(i, self.colors['off'])
+        self.show()
 
     def set_color_all_buttons(self, color):
         for i in range(self.nbuttons):
@@ -120,12 +210,63 @@ class Trellis:
     def set_color(self, index, color):
         if color in self.color_map:
             color = self.color_map[color]
-        self.trellis.pixels[index] = self.colors[color]
+        self.back_buffer[index] = self.colors[color]
 
-    def sync(self):
-        self.trellis.sync()
+    def set_rgb(self, index, rgb):
+        self.back_buffer[index] = rgb
+
+    def show(self):
+        """
+        push pixels that changed since the last show to the trellis,
+        as a single buffer write per board (only to the boards with
+        changes); returns the number of pixels changed
+        """
+        nchanged = 0
+        boards_changed = set()
+        for i in range(self.nbuttons):
+            if self.back_buffer[i] != self.front_buffer[i]:
+                board, key = self.board_keys[i]
+                self.boards[board].pixels[key] = self.back_buffer[i]
+                self.front_buffer[i] = self.back_buffer[i]
+                boards_changed.add(board)
+                nchanged += 1
+        for board in sorted(boards_changed):
+            self.boards[board].pixels.show()
+            self.i2c_writes += 1
+        if nchanged > 0:
+            if latency.recorder is not None:
+                latency.recorder.mark('led_flush')
+            self.pixels_written += nchanged
+        return nchanged
+
+    def sync(self, boards=None):
+        """
+        read the given boards (or all of them) for button events
+        """
+        # button callbacks run inside trellis.sync(),
+        # so whatever they drew gets shown as one frame
+        for board in (range(len(self.boards)) if boards is None else boards):
+            self.boards[board].sync()
+        nchanged = self.show()
+        if self.debug and nchanged > 0:
+            print('   LEDs: {} pixel(s) changed, {} i2c write(s) total'.format(nchanged, self.i2c_writes))
+
+    def wait_for_input(self, timeout=1.0):
+        """
+        handle any button events, waiting up to timeout seconds for them
+        """
+        if self.edge_source is None:
+            time.sleep(POLL_INTERVAL)
+            self.sync()
+        elif self.edge_source.wait(timeout):
+            self.sync(self.edge_source.pending())
+        else:
+            # no buttons pressed, but something else may have drawn
+            self.show()
 
     def terminate(self):
         for i in range(self.nbuttons):
-            self.trellis.pixels[i] = self.colors['off']
+            self.set_rgb(i, self.colors['off'])
         self.sync()
+        if self.edge_source is not None:
+            self.edge_source.close()
@@ -0,0 +1,577 @@
+import hmac
+import time
+import socket
+import random
+import struct
+import base64
+import hashlib
+import secrets
+import threading
+import urllib.parse
+from collections import deque
+import latency
+from button_settings import COLORS
+
+WEB_HOST = '127.0.0.1' # use e.g. 0.0.0.0 to allow other machines (with a token)
+WEB_PORT = 8080
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11' # from RFC 6455
+SEND_TIMEOUT = 0.5 # seconds before we give up on a client that stopped reading
+LOCAL_HOSTS = ['localhost', '127.0.0.1', '::1'] # what the page may be served as, without a token
+MAX_QUEUED_MESSAGES = 32 # per client; past this, we resend all the LEDs instead
+STATS_WINDOW = 1000 # presses to keep queue delays for
+
+# binary messages (the first byte is the message type):
+# server -> client
+MSG_HELLO = 0 # B nrows, B ncols
+MSG_LEDS = 1 # then (B button, B r, B g, B b) for each button that changed
+MSG_ACK = 3 # d client time of a press we handled (sent after its LEDs)
+# client -> server
+MSG_PRESS = 2 # B button, B pressed (1) or released (0), d client time (ms)
+PRESS_FORMAT = struct.Struct('<BBBd')
+ACK_FORMAT = struct.Struct('<Bd')
+
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1, user-scalable=no">
+<title>loop-baby</title>
+<style>
+body { background: #111; margin: 0; font-family: sans-serif; color: #888; }
+#grid { display: grid; gap: 2vmin; padding: 2vmin; width: 90vmin; height: 90vmin; margin: auto; touch-action: none; }
+.button { background: #000; border-radius: 1.5vmin; border: 1px solid #333; user-select: none; }
+#status { text-align: center; font-size: small; }
+</style></head>
+<body><div id="grid"></div><div id="status">connecting...</div>
+<script>
+var grid = document.getElementById('grid');
+var statusLine = document.getElementById('status');
+var buttons = [];
+var latencies = [];
+var ws = new WebSocket('ws://' + location.host + '/ws' + location.search);
+ws.binaryType = 'arraybuffer';
+function send(number, pressed) {
+    if (ws.readyState != 1) return;
+    var msg = new DataView(new ArrayBuffer(11));
+    msg.setUint8(0, 2); msg.setUint8(1, number); msg.setUint8(2, pressed);
+    msg.setFloat64(3, performance.now(), true);
+    ws.send(msg.buffer);
+}
+function makeGrid(nrows, ncols) {
+    grid.innerHTML = '';
+    grid.style.gridTemplateColumns = 'repeat(' + ncols + ', 1fr)';
+    buttons = [];
+    for (var i = 0; i < nrows*ncols; i++) {
+        var b = document.createElement('div');
+        b.className = 'button';
+        b.addEventListener('pointerdown', function(i) { return function(e) {
+            e.target.setPointerCapture(e.pointerId); send(i, 1); }; }(i));
+        b.addEventListener('pointerup', function(i) { return function(e) { send(i, 0); }; }(i));
+        grid.appendChild(b);
+        buttons.push(b);
+    }
+}
+ws.onmessage = function(e) {
+    var msg = new DataView(e.data);
+    var kind = msg.getUint8(0);
+    if (kind == 0) {
+        makeGrid(msg.getUint8(1), msg.getUint8(2));
+        statusLine.textContent = 'connected';
+    } else if (kind == 1) {
+        for (var j = 1; j + 3 < msg.byteLength; j += 4) {
+            buttons[msg.getUint8(j)].style.background = 'rgb(' + msg.getUint8(j+1) + ',' + msg.getUint8(j+2) + ',' + msg.getUint8(j+3) + ')';
+        }
+    } else if (kind == 3) {
+        latencies.push(performance.now() - msg.getFloat64(1, true));
+        if (latencies.length > 50) latencies.shift();
+        var sorted = latencies.slice().sort(function(a, b) { return a - b; });
+        statusLine.textContent = 'press to LEDs: ' + sorted[Math.floor(sorted.length/2)].toFixed(1) + ' ms (median of ' + sorted.length + ')';
+    }
+};
+ws.onclose = function() { statusLine.textContent = 'disconnected (reload to reconnect)'; };
+</script></body></html>
+"""
+
+class Event:
+    def __init__(self, number, edge, t=None):
+        self.number = number
+        self.edge = edge
+        self.time = time.monotonic() if t is None else t # see GestureEngine
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1(key.encode() + WEBSOCKET_GUID).digest()).decode()
+
+def encode_frame(payload, opcode=OPCODE_BINARY, mask=False):
+    """
+    one websocket frame; clients must mask what they send, servers must not
+    """
+    header = bytes([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    if len(payload) < 126:
+        header += bytes([mask_bit | len(payload)])
+    elif len(payload) < 2**16:
+        header += bytes([mask_bit | 126]) + struct.pack('>H', len(payload))
+    else:
+        header += bytes([mask_bit | 127]) + struct.pack('>Q', len(payload))
+    if mask:
+        key = bytes(random.getrandbits(8) for i in range(4))
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+        header += key
+    return header + payload
+
+def recv_exactly(sock, n, keep_waiting=None):
+    """
+    if the socket times out, we keep reading for as long as keep_waiting() is True
+    """
+    data = b''
+    while len(data) < n:
+        try:
+            chunk = sock.recv(n - len(data))
+        except socket.timeout:
+            if keep_waiting is not None and keep_waiting():
+                continue
+            raise
+        if not chunk:
+            raise ConnectionError('connection closed')
+        data += chunk
+    return data
+
+def read_frame(sock, keep_waiting=None):
+    """
+    returns (opcode, payload) of the next frame
+    (we don't expect fragmented messages, which browsers don't send for these)
+    """
+    b0, b1 = recv_exactly(sock, 2, keep_waiting)
+    n = b1 & 0x7F
+    if n == 126:
+        n = struct.unpack('>H', recv_exactly(sock, 2, keep_waiting))[0]
+    elif n == 127:
+        n = struct.unpack('>Q', recv_exactly(sock, 8, keep_waiting))[0]
+    key = recv_exactly(sock, 4, keep_waiting) if b1 & 0x80 else None
+    payload = recv_exactly(sock, n, keep_waiting)
+    if key is not None:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return b0 & 0x0F, payload
+
+def read_http_request(sock):
+    """
+    returns (path, headers) of an HTTP request
+    """
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(1024)
+        if not chunk or len(data) > 16384:
+            raise ConnectionError('bad request')
+        data += chunk
+    lines = data.split(b'\r\n\r\n')[0].decode('latin-1').split('\r\n')
+    parts = lines[0].split(' ')
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return (parts[1] if len(parts) > 1 else '/'), headers
+
+class WebConnection:
+    """
+    one client's websocket; messages are sent by its own thread, so a slow
+    client never holds up the looper (or the other clients): if it falls
+    MAX_QUEUED_MESSAGES behind, we drop what it hasn't been sent yet
+    (LEDs and acks), and send it every LED instead
+    """
+    def __init__(self, sock, interface):
+        self.sock = sock
+        self.interface = interface
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.needs_all_leds = False
+        self.is_open = True
+        self.ndropped = 0
+        self.thread = threading.Thread(target=self.send_messages, daemon=True)
+        self.thread.start()
+
+    def push(self, frame):
+        with self.condition:
+            if len(self.queue) >= MAX_QUEUED_MESSAGES:
+                self.ndropped += len(self.queue)
+                self.queue.clear()
+                self.needs_all_leds = True
+            else:
+                self.queue.append(frame)
+            self.condition.notify()
+
+    def send_messages(self):
+        while True:
+            with self.condition:
+                while self.is_open and not self.queue and not self.needs_all_leds:
+                    self.condition.wait()
+                if not self.is_open:
+                    return
+                needs_all_leds, self.needs_all_leds = self.needs_all_leds, False
+                frame = None if needs_all_leds else self.queue.popleft()
+            if needs_all_leds:
+                with self.interface.lock:
+                    frame = encode_frame(self.interface.leds_message(range(self.interface.nbuttons)))
+                    # anything queued so far is older than this
+                    with self.condition:
+                        self.ndropped += len(self.queue)
+                        self.queue.clear()
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                # the client's reading thread notices too
+                self.interface.drop_client(self)
+                return
+            self.interface.nframes_sent += 1
+            self.interface.nbytes_sent += len(frame)
+
+    def stop(self):
+        with self.condition:
+            self.is_open = False
+            self.condition.notify()
+
+    def close(self):
+        self.stop()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+class WebInterface:
+    """
+    an interface (like Trellis or Keyboard) drawn in a web browser:
+    serves a page of buttons at http://<host>:<port>/, which talks to us
+    over a websocket; presses are queued up by each client's thread,
+    and handled (along with the callbacks) in sync(), like the trellis;
+    show() sends each client only the LEDs that changed, as one binary message;
+    anyone who can reach the page can press every button (e.g., shutdown),
+    so unless we only listen on localhost, the page (and the websocket)
+    need ?token=<token> (one is made up for us if we don't give one)
+    """
+    def __init__(self, pressed_code, released_code, nrows=4, ncols=4,
+        host=WEB_HOST, port=WEB_PORT, debug=False, token=None):
+        self.pressed_code = pressed_code
+        self.released_code = released_code
+        self.nrows = nrows
+        self.ncols = ncols
+        self.nbuttons = nrows*ncols
+        self.debug = debug
+        self.colors = dict(COLORS)
+        self.color_map = {}
+        self.button_handler = None
+
+        # set_color draws to the back buffer; show() sends what changed
+        self.back_buffer = [self.colors['off']]*self.nbuttons
+        self.front_buffer = list(self.back_buffer)
+        self.lock = threading.Lock() # for the clients, and the front buffer
+        self.clients = [] # WebConnection
+        if token is None and not host.startswith('127.') and host != 'localhost':
+            token = secrets.token_urlsafe(12)
+        self.token = token
+
+        # presses from every client, for the next sync()
+        self.presses = []
+        self.press_lock = threading.Lock()
+        self.has_presses = threading.Event()
+        # there's no INT line, so we signal looper.input_task ourselves
+        self.edge_source = self
+
+        self.nframes_sent = 0
+        self.nbytes_sent = 0
+        self.queue_delays = deque(maxlen=STATS_WINDOW) # ms from receiving each press until handling it
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(4)
+        self.host, self.port = self.server.getsockname()
+        self.is_running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        print('Web interface at http://{}:{}/{}'.format(
+            socket.gethostname() if host == '0.0.0.0' else host, self.port,
+            '' if self.token is None else '?token=' + self.token))
+
+    def serve(self):
+        while self.is_running:
+            try:
+                sock, address = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.handle_connection, args=(sock,), daemon=True).start()
+
+    def is_authorized(self, path, headers):
+        """
+        browsers let any page open a websocket to localhost, so we only
+        take them from our own page (the Origin it sends is where the page
+        came from); without a token, the Host must also be localhost,
+        or else a page could rename itself localhost (DNS rebinding)
+        """
+        host = headers.get('host', '').lower()
+        origin = headers.get('origin')
+        if origin is not None and urllib.parse.urlsplit(origin).netloc.lower() != host:
+            return False
+        if self.token is None:
+            return urllib.parse.urlsplit('//' + host).hostname in LOCAL_HOSTS
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(path).query)
+        return hmac.compare_digest(query.get('token', [''])[0], self.token)
+
+    def handle_connection(self, sock):
+        sock.settimeout(SEND_TIMEOUT)
+        connection = None
+        try:
+            path, headers = read_http_request(sock)
+            if not self.is_authorized(path, headers):
+                sock.sendall(b'HTTP/1.1 403 Forbidden\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                sock.close()
+                return
+            path = urllib.parse.urlsplit(path).path
+            if headers.get('upgrade', '').lower() != 'websocket':
+                if path in ['/', '/index.html']:
+                    body = PAGE.encode()
+                    sock.sendall('HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(len(body)).encode() + body)
+                else:
+                    sock.sendall(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                sock.close()
+                return
+            sock.sendall(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                'Connection: Upgrade\r\nSec-WebSocket-Accept: {}\r\n\r\n').format(
+                websocket_accept(headers['sec-websocket-key'])).encode())
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = WebConnection(sock, self)
+            with self.lock:
+                # a new client starts with everything we are showing
+                connection.push(encode_frame(bytes([MSG_HELLO, self.nrows, self.ncols])))
+                connection.push(encode_frame(self.leds_message(range(self.nbuttons))))
+                self.clients.append(connection)
+            if self.debug:
+                print('Web client connected ({} total)'.format(len(self.clients)))
+            self.read_presses(connection)
+        except (OSError, ConnectionError, KeyError, IndexError):
+            pass
+        if connection is None:
+            sock.close()
+        else:
+            self.drop_client(connection)
+
+    def read_presses(self, connection):
+        # nb: the timeout is for sends, so reads just keep waiting
+        keep_waiting = lambda: self.is_running and connection in self.clients
+        while self.is_running:
+            opcode, payload = read_frame(connection.sock, keep_waiting)
+            if opcode == OPCODE_CLOSE:
+                return
+            elif opcode == OPCODE_PING:
+                connection.push(encode_frame(payload, OPCODE_PONG))
+            elif opcode == OPCODE_BINARY and len(payload) == PRESS_FORMAT.size and payload[0] == MSG_PRESS:
+                _, number, pressed, client_time = PRESS_FORMAT.unpack(payload)
+                if number >= self.nbuttons:
+                    continue
+                with self.press_lock:
+                    self.presses.append((connection, number, pressed, client_time, time.monotonic()))
+                self.has_presses.set()
+
+    def drop_client(self, connection):
+        with self.lock:
+            if connection in self.clients:
+                self.clients.remove(connection)
+                if self.debug:
+                    print('Web client disconnected ({} total)'.format(len(self.clients)))
+        connection.close()
+
+    def send_all(self, message):
+        """
+        (call with self.lock held)
+        """
+        frame = encode_frame(message)
+        for connection in self.clients:
+            connection.push(frame)
+
+    def leds_message(self, indices):
+        message = bytearray([MSG_LEDS])
+        for i in indices:
+            message += bytes([i]) + bytes(self.front_buffer[i])
+        return bytes(message)
+
+    def set_color_map(self, color_map):
+        self.color_map = color_map
+
+    def set_callback(self, fcn):
+        self.button_handler = fcn
+
+    def wait(self, timeout):
+        """
+        returns True if there are presses to handle,
+        or False if we timed out first
+        """
+        if self.has_presses.wait(timeout):
+            self.has_presses.clear()
+            return True
+        return False
+
+    def pending(self):
+        return None
+
+    def sync(self, boards=None):
+        """
+        handle presses from every client, then show what they drew
+        """
+        with self.press_lock:
+            presses, self.presses = self.presses, []
+        for connection, number, pressed, client_time, t_received in presses:
+            self.queue_delays.append(1000*(time.monotonic() - t_received))
+            edge = self.pressed_code if pressed else self.released_code
+            if self.button_handler is not None:
+                self.button_handler(Event(number, edge, t_received))
+        nchanged = self.show()
+        if self.debug and nchanged > 0:
+            print('   LEDs: {} button(s) changed'.format(nchanged))
+        if presses:
+            # the client measures from its press until it gets this,
+            # which comes after the LEDs drawn in response
+            for connection, number, pressed, client_time, t_received in presses:
+                connection.push(encode_frame(ACK_FORMAT.pack(MSG_ACK, client_time)))
+
+    def wait_for_input(self, timeout=1.0):
+        """
+        handle any presses, waiting up to timeout seconds for them
+        """
+        self.wait(timeout)
+        self.sync()
+
+    def set_color_all_buttons(self, color):
+        for i in range(self.nbuttons):
+            self.set_color(i, color)
+
+    def set_color(self, index, color):
+        if color in self.color_map:
+            color = self.color_map[color]
+        self.back_buffer[index] = self.colors[color]
+
+    def set_rgb(self, index, rgb):
+        self.back_buffer[index] = rgb
+
+    def show(self):
+        """
+        send the buttons that changed since the last show to every client,
+        as one message; returns the number of buttons changed
+        """
+        with self.lock:
+            changed = [i for i in range(self.nbuttons) if self.back_buffer[i] != self.front_buffer[i]]
+            if not changed:
+                return 0
+            for i in changed:
+                self.front_buffer[i] = self.back_buffer[i]
+            self.send_all(self.leds_message(changed))
+        if latency.recorder is not None:
+            latency.recorder.mark('led_flush')
+        return len(changed)
+
+    def stats(self):
+        delays = sorted(self.queue_delays)
+        median = delays[len(delays)//2] if delays else 0
+        return 'Web: median {:0.2f} ms queued (last {} presses), {} messages sent ({} bytes)'.format(
+            median, len(delays), self.nframes_sent, self.nbytes_sent)
+
+    def terminate(self):
+        self.set_color_all_buttons('off')
+        self.show()
+        if self.debug:
+            print(self.stats())
+        self.is_running = False
+        self.server.close()
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for connection in clients:
+            connection.stop()
+            connection.thread.join(SEND_TIMEOUT)
+            try:
+                connection.sock.sendall(encode_frame(b'', OPCODE_CLOSE))
+            except OSError:
+                pass
+            connection.close()
+
+class WebClient:
+    """
+    a headless client for WebInterface (e.g., for testing without a
+    browser): keeps track of the LEDs the server sends, and the time from
+    each press until the server finished handling it
+    """
+    def __init__(self, host='127.0.0.1', port=WEB_PORT, timeout=2.0, token=None, origin=None):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(bytes(random.getrandbits(8) for i in range(16))).decode()
+        path = '/ws' if token is None else '/ws?' + urllib.parse.urlencode({'token': token})
+        # (browsers send where the page came from as the Origin)
+        self.sock.sendall(('GET {} HTTP/1.1\r\nHost: {}:{}\r\nUpgrade: websocket\r\n'
+            'Connection: Upgrade\r\nSec-WebSocket-Key: {}\r\nSec-WebSocket-Version: 13\r\n{}\r\n').format(
+            path, host, port, key, '' if origin is None else 'Origin: {}\r\n'.format(origin)).encode())
+        response = b''
+        while b'\r\n\r\n' not in response:
+            chunk = self.sock.recv(1)
+            if not chunk:
+                raise ConnectionError('connection closed during handshake')
+            response += chunk
+        if b' 101 ' not in response.split(b'\r\n')[0] or websocket_accept(key).encode() not in response:
+            raise ConnectionError('bad handshake: {}'.format(response))
+        self.t_start = time.monotonic()
+        self.leds = {} # button -> (r, g, b)
+        self.nrows = self.ncols = None
+        self.nmessages = 0
+        self.latencies = [] # ms from each press (or release) until its ack
+        self.recv_until(lambda: self.nrows is not None)
+
+    def now(self):
+        return 1000*(time.monotonic() - self.t_start)
+
+    def send(self, number, pressed):
+        self.sock.sendall(encode_frame(PRESS_FORMAT.pack(MSG_PRESS, number, int(pressed), self.now()), mask=True))
+
+    def press(self, number):
+        self.send(number, True)
+
+    def release(self, number):
+        self.send(number, False)
+
+    def recv(self):
+        """
+        handle the next message from the server
+        """
+        opcode, payload = read_frame(self.sock)
+        if opcode == OPCODE_CLOSE:
+            raise ConnectionError('server closed the connection')
+        if opcode != OPCODE_BINARY or not payload:
+            return
+        self.nmessages += 1
+        if payload[0] == MSG_HELLO:
+            self.nrows, self.ncols = payload[1], payload[2]
+        elif payload[0] == MSG_LEDS:
+            for j in range(1, len(payload) - 3, 4):
+                self.leds[payload[j]] = tuple(payload[j+1:j+4])
+        elif payload[0] == MSG_ACK:
+            _, client_time = ACK_FORMAT.unpack(payload)
+            self.latencies.append(self.now() - client_time)
+
+    def recv_until(self, done):
+        while not done():
+            self.recv()
+
+    def tap(self, number):
+        """
+        press and release, and wait until the server handled both
+        """
+        nacks = len(self.latencies)
+        self.press(number)
+        self.release(number)
+        self.recv_until(lambda: len(self.latencies) >= nacks + 2)
+
+    def close(self):
+        try:
+            self.sock.sendall(encode_frame(b'', OPCODE_CLOSE, mask=True))
+        except OSError:
+            pass
+        self.sock.close()
@@ -18,14 +18,20 @@ sleep 1 # seconds
 # this line should also be in ~/.jackdrc, because if the below line fails, sooperlooper will start its own jackd using the config in ~/.jackdrc
 /usr/bin/jackd --no-realtime --verbose -dalsa -r44100 -p512 -n3 -dhw:1 -s > /home/pi/loop-baby/jackd_errors.log 2>&1 &
 
-# wait for jack to start
-sleep 7
+# wait for jack to start (up to 10 seconds)
+for i in $(seq 1 100); do
+    JACK_NO_START_SERVER=1 jack_lsp > /dev/null 2>&1 && break
+    sleep 0.1
+done
 
 # start sooperlooper
 sooperlooper -p 9951 -l 1 -c 2 -t 20 &
 
-# wait for sooperlooper to start
-sleep 1
+# wait for sooperlooper to register its ports (up to 10 seconds)
+for i in $(seq 1 100); do
+    JACK_NO_START_SERVER=1 jack_lsp 2> /dev/null | grep -q 'sooperlooper:common_in_1' && break
+    sleep 0.1
+done
 
 # confirm port names
 jack_lsp -c
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the looper's modules import each other from loop-baby/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'loop-baby'))
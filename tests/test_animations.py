@@ -0,0 +1,76 @@
+from animations import Animator
+
+def frames(name, nframes, drawn, closed=None):
+    try:
+        for i in range(nframes):
+            drawn.append((name, i))
+            yield
+    finally:
+        if closed is not None:
+            closed.append(name)
+
+def test_frames_are_drawn_in_order_at_each_frame_rate():
+    animator = Animator()
+    drawn = []
+    animator.start('slow', frames('slow', 3, drawn), 0.5, now=0.0)
+    animator.start('fast', frames('fast', 5, drawn), 0.25, now=0.0)
+    assert animator.time_until_next_frame(now=0.0) == 0
+    for now in [0.0, 0.25, 0.5, 0.75, 1.0]:
+        assert animator.tick(now=now)
+    # at each tick, animations started later draw on top (i.e., after)
+    assert drawn == [('slow', 0), ('fast', 0), ('fast', 1), ('slow', 1), ('fast', 2),
+        ('fast', 3), ('slow', 2), ('fast', 4)]
+    assert animator.time_until_next_frame(now=1.0) == 0.25
+    assert not animator.tick(now=1.125) # nothing is due
+
+def test_on_done_is_called_when_frames_run_out():
+    animator = Animator()
+    drawn, done = [], []
+    animator.start('sweep', frames('sweep', 2, drawn), 0.1, on_done=lambda: done.append(True), now=0.0)
+    for now in [0.0, 0.1]:
+        animator.tick(now=now)
+    assert not done and animator.is_running('sweep')
+    animator.tick(now=0.2)
+    assert done == [True]
+    assert not animator.is_running()
+    assert animator.time_until_next_frame() is None
+
+def test_falling_behind_skips_ahead_instead_of_catching_up():
+    animator = Animator()
+    drawn = []
+    animator.start('show', frames('show', 10, drawn), 0.25, now=0.0)
+    animator.tick(now=0.0)
+    animator.tick(now=2.0) # e.g., a slow save
+    assert not animator.tick(now=2.125)
+    assert animator.tick(now=2.25)
+    assert len(drawn) == 3
+
+def test_stopped_animations_are_closed_and_never_drawn_again():
+    animator = Animator()
+    drawn, closed, done = [], [], []
+    animator.start('sweep', frames('sweep', 10, drawn, closed), 0.1,
+        on_done=lambda: done.append(True), now=0.0)
+    animator.start('save', frames('save', 10, drawn, closed), 0.1, interruptible=False, now=0.0)
+    animator.tick(now=0.0)
+
+    # e.g., a button press
+    assert animator.stop_interruptible() == ['sweep']
+    assert closed == ['sweep']
+    assert animator.tick(now=0.1)
+    assert drawn[-1] == ('save', 1)
+    assert not any(name == 'sweep' for name, i in drawn[2:])
+    assert not done
+
+    assert animator.stop('save')
+    assert not animator.stop('save')
+    assert closed == ['sweep', 'save']
+    assert not animator.tick(now=0.2)
+
+def test_restarting_an_animation_replaces_it_and_draws_it_last():
+    animator = Animator()
+    drawn = []
+    animator.start('a', frames('a', 10, drawn), 0.1, now=0.0)
+    animator.start('b', frames('b', 10, drawn), 0.1, now=0.0)
+    animator.start('a', frames('a2', 10, drawn), 0.1, now=0.0)
+    animator.tick(now=0.0)
+    assert drawn == [('b', 0), ('a2', 0)]
@@ -0,0 +1,35 @@
+from gestures import GestureEngine, DEBOUNCE_SECS, LONG_PRESS_SECS
+
+def make_engine(chords=None):
+    handled = []
+    engine = GestureEngine(lambda number: handled.append(('press', number)) or len(handled),
+        lambda number: handled.append(('release', number)), chords,
+        on_chord=lambda name, tokens: handled.append(('chord', name, tokens)),
+        on_long_press=lambda number, tokens: handled.append(('long_press', number, tokens)))
+    return engine, handled
+
+def test_event_times_not_handling_times_decide_bouncing():
+    engine, handled = make_engine()
+    # e.g., replayed as fast as possible: handled at once, but pressed 0.2s apart
+    for t, number, pressed in [(0.0, 1, True), (0.1, 1, False), (0.3, 1, True), (0.4, 1, False)]:
+        (engine.press if pressed else engine.release)(number, t=t)
+    assert handled == [('press', 1), ('release', 1)]*2
+    assert engine.ndropped == 0
+
+    engine.press(1, t=0.4 + DEBOUNCE_SECS/2)
+    assert engine.ndropped == 1
+
+def test_long_press_is_noticed_on_release_without_polling():
+    engine, handled = make_engine()
+    engine.press(1, t=0.0)
+    engine.release(1, t=LONG_PRESS_SECS + 0.1)
+    assert handled == [('press', 1), ('long_press', 1, [1]), ('release', 1)]
+
+def test_chord_gets_every_press_token():
+    engine, handled = make_engine({'restart': [1, 2]})
+    engine.press(1, t=0.0)
+    engine.press(2, t=0.1)
+    assert handled[-1] == ('chord', 'restart', [1, 2])
+    # a chord's buttons are held at once, but are not a long press
+    engine.poll(t=10.0)
+    assert handled[-1][0] == 'chord'
@@ -0,0 +1,12 @@
+from replay import Event, EventRecorder, read_event_log
+
+def test_events_are_on_disk_before_close(tmp_path):
+    outfile = str(tmp_path / 'events.log')
+    recorder = EventRecorder(outfile)
+    recorder.record(Event(3, 1, 0.0))
+    recorder.record(Event(3, 0, 0.1))
+    # e.g., if the looper were killed here
+    assert [entry[1:] for entry in read_event_log(outfile)] == [(3, 1), (3, 0)]
+    recorder.close()
+    recorder.close()
+    assert len(read_event_log(outfile)) == 2
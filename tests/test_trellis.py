@@ -0,0 +1,116 @@
+import sys
+import time
+import types
+import threading
+
+import pytest
+
+class FakeKeyEvent:
+    def __init__(self, number, edge):
+        self.number = number
+        self.edge = edge
+
+class FakePixels(list):
+    def __init__(self):
+        super().__init__([None]*16)
+        self.auto_write = True
+        self.nshows = 0
+
+    def show(self):
+        self.nshows += 1
+
+class FakeNeoTrellis:
+    """
+    one board, whose button events are queued with press()
+    until the next sync() (like the seesaw's FIFO)
+    """
+    EDGE_RISING = 3
+    EDGE_FALLING = 2
+
+    def __init__(self, i2c, interrupt=False, addr=0x2E):
+        self.interrupt = interrupt
+        self.pixels = FakePixels()
+        self.callbacks = [None]*16
+        self.events = []
+        self.nsyncs = 0
+
+    def activate_key(self, key, edge):
+        pass
+
+    def press(self, key):
+        self.events.append(FakeKeyEvent(key, self.EDGE_RISING))
+
+    def sync(self):
+        self.nsyncs += 1
+        events, self.events = self.events, []
+        for event in events:
+            self.callbacks[event.number](event)
+
+@pytest.fixture
+def trellis_module(monkeypatch):
+    """
+    trellis, with the NeoTrellis boards (and their i2c bus) faked
+    """
+    board = types.ModuleType('board')
+    board.SCL, board.SDA = 3, 2
+    busio = types.ModuleType('busio')
+    busio.I2C = lambda scl, sda: None
+    neotrellis = types.ModuleType('adafruit_neotrellis.neotrellis')
+    neotrellis.NeoTrellis = FakeNeoTrellis
+    package = types.ModuleType('adafruit_neotrellis')
+    package.neotrellis = neotrellis
+    for name, module in [('board', board), ('busio', busio),
+            ('adafruit_neotrellis', package), ('adafruit_neotrellis.neotrellis', neotrellis)]:
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.delitem(sys.modules, 'trellis', raising=False)
+    import trellis
+    return trellis
+
+def make_trellis(trellis_module, edge_source, addresses=((0x2E,),)):
+    trellis = trellis_module.Trellis(debug=False, edge_source=edge_source, addresses=addresses)
+    events = []
+    trellis.set_callback(lambda event: events.append((event.number, event.edge)))
+    return trellis, events
+
+def test_pending_edge_is_read_right_away(trellis_module):
+    source = trellis_module.SimulatedEdgeSource()
+    trellis, events = make_trellis(trellis_module, source)
+    assert trellis.boards[0].interrupt
+
+    trellis.boards[0].press(5)
+    threading.Timer(0.01, source.trigger).start()
+    t0 = time.monotonic()
+    trellis.wait_for_input(timeout=2.0)
+    assert time.monotonic() - t0 < 1.0
+    assert events == [(5, trellis_module.BUTTON_PRESSED)]
+
+def test_timeout_without_an_edge(trellis_module):
+    source = trellis_module.SimulatedEdgeSource()
+    trellis, events = make_trellis(trellis_module, source)
+    t0 = time.monotonic()
+    trellis.wait_for_input(timeout=0.05)
+    assert time.monotonic() - t0 >= 0.05
+    assert events == []
+
+def test_idle_line_skips_reading_the_boards_but_still_shows(trellis_module):
+    source = trellis_module.SimulatedEdgeSource()
+    trellis, events = make_trellis(trellis_module, source)
+    board = trellis.boards[0]
+    nsyncs, nshows = board.nsyncs, board.pixels.nshows
+
+    # e.g., an animation drew something while no buttons were pressed
+    trellis.set_color(3, 'red')
+    trellis.wait_for_input(timeout=0.01)
+    assert board.nsyncs == nsyncs
+    assert board.pixels.nshows == nshows + 1
+    assert board.pixels[3] == trellis.colors['red']
+
+def test_only_boards_that_signalled_are_read(trellis_module):
+    source = trellis_module.SimulatedEdgeSource(nboards=4)
+    trellis, events = make_trellis(trellis_module, source,
+        addresses=((0x2E, 0x2F), (0x30, 0x31)))
+    trellis.boards[2].press(0) # top left key of the bottom left board
+    source.trigger(2)
+    trellis.wait_for_input(timeout=1.0)
+    assert [board.nsyncs for board in trellis.boards] == [0, 0, 1, 0]
+    assert events == [(32, trellis_module.BUTTON_PRESSED)]
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+from web import WebInterface, WebClient, WebConnection, MAX_QUEUED_MESSAGES, encode_frame
+
+PRESSED, RELEASED = 3, 2
+
+@pytest.fixture
+def interface():
+    interface = WebInterface(PRESSED, RELEASED, nrows=2, ncols=2, port=0)
+    def callback(event):
+        if event.edge == PRESSED:
+            interface.set_color(event.number, 'green')
+    interface.set_callback(callback)
+    is_running = [True]
+    def handle_input():
+        while is_running[0]:
+            interface.wait_for_input(0.01)
+    thread = threading.Thread(target=handle_input, daemon=True)
+    thread.start()
+    yield interface
+    is_running[0] = False
+    thread.join()
+    interface.terminate()
+
+def test_press_is_acked_after_its_leds(interface):
+    client = WebClient(port=interface.port)
+    try:
+        assert (client.nrows, client.ncols) == (2, 2)
+        client.recv_until(lambda: len(client.leds) == 4)
+        assert client.leds[1] == (0, 0, 0)
+
+        nmessages = client.nmessages
+        client.tap(1)
+        assert len(client.latencies) == 2
+        # the press drew one button, and nothing else was sent
+        assert client.leds[1] == (0, 255, 0)
+        assert [client.leds[i] for i in [0, 2, 3]] == [(0, 0, 0)]*3
+        assert client.nmessages == nmessages + 3 # LEDs, then two acks
+    finally:
+        client.close()
+
+def test_foreign_origin_is_forbidden(interface):
+    # e.g., some other page open in a browser on this machine
+    with pytest.raises(ConnectionError, match=' 403 '):
+        WebClient(port=interface.port, origin='http://example.com')
+    WebClient(port=interface.port, origin='http://127.0.0.1:{}'.format(interface.port)).close()
+
+def test_token_is_required_off_localhost():
+    interface = WebInterface(PRESSED, RELEASED, host='0.0.0.0', port=0, token='abc')
+    try:
+        with pytest.raises(ConnectionError):
+            WebClient(port=interface.port)
+        with pytest.raises(ConnectionError):
+            WebClient(port=interface.port, token='xyz')
+        WebClient(port=interface.port, token='abc').close()
+    finally:
+        interface.terminate()
+
+def test_token_is_made_up_off_localhost():
+    interface = WebInterface(PRESSED, RELEASED, host='0.0.0.0', port=0)
+    try:
+        assert interface.token
+    finally:
+        interface.terminate()
+
+class StuckSocket:
+    def __init__(self):
+        self.sent = []
+        self.unblock = threading.Event()
+
+    def sendall(self, frame):
+        self.unblock.wait()
+        self.sent.append(frame)
+
+    def close(self):
+        pass
+
+def test_slow_client_gets_every_led_instead_of_a_backlog(interface):
+    sock = StuckSocket()
+    connection = WebConnection(sock, interface)
+    try:
+        for i in range(3*MAX_QUEUED_MESSAGES):
+            connection.push(encode_frame(b'stale'))
+        assert len(connection.queue) <= MAX_QUEUED_MESSAGES
+        assert connection.needs_all_leds
+        sock.unblock.set()
+        connection.thread.join(0.1)
+        # whatever is sent after the backlog was dropped is every LED
+        assert sock.sent[-1] == encode_frame(interface.leds_message(range(interface.nbuttons)))
+    finally:
+        connection.stop()